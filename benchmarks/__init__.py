@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the serialization, persistence and query paths of
+repocket.
+
+::
+
+    make bench
+    make bench BENCH_ROWS=1000,100000,1000000
+    python -m benchmarks --backend fake --rows 1000 --output before.json
+    python -m benchmarks --compare before.json after.json
+
+Every benchmark reports the operations per second, the p50 and p99
+latency of a single operation, the round trips to redis per operation
+and the growth of the peak memory of the process, see
+:py:mod:`benchmarks.measure`. The results are saved as JSON in
+``benchmarks/results`` so that they can be compared between commits.
+
+The benchmarks run against a local ``redis-server``, in a database
+that must be empty and is flushed afterwards, or against an
+in-process stand-in provided by ``fakeredis`` with ``--backend fake``.
+"""
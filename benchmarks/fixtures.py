@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""The models of the benchmarks, shaped after the ones of the
+functional tests, and deterministic data to fill them."""
+from __future__ import unicode_literals
+
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from repocket import attributes
+from repocket.model import ActiveRecord
+
+SEED = 42
+HOUSES = ['Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin']
+
+
+class User(ActiveRecord):
+    id = attributes.AutoUUID()
+    access_token = attributes.Bytes()
+    email = attributes.Unicode(index=True)
+    house_name = attributes.Unicode()
+    github_metadata = attributes.JSON()
+
+
+class BlogPost(ActiveRecord):
+    id = attributes.AutoUUID()
+    author = attributes.Pointer(User)
+    created_at = attributes.DateTime(index='range')
+    title = attributes.Unicode()
+    views = attributes.Integer()
+    rating = attributes.Float()
+    body = attributes.ByteStream()
+
+
+def make_users(count, seed=SEED):
+    """returns unsaved users with deterministic values"""
+    rand = random.Random(seed)
+    users = []
+    for i in range(count):
+        users.append(User(
+            id=uuid.UUID(int=rand.getrandbits(128), version=4),
+            access_token=b'%040x' % rand.getrandbits(160),
+            email='user{0}@hogwarts.uk'.format(i),
+            house_name=rand.choice(HOUSES),
+            github_metadata={
+                'login': 'user{0}'.format(i),
+                'public_repos': rand.randint(0, 200),
+                'followers': rand.randint(0, 5000),
+            },
+        ))
+
+    return users
+
+
+def make_posts(count, users, seed=SEED + 1):
+    """returns unsaved posts by the given users, one per minute"""
+    rand = random.Random(seed)
+    started = datetime(2017, 1, 1)
+    posts = []
+    for i in range(count):
+        posts.append(BlogPost(
+            id=uuid.UUID(int=rand.getrandbits(128), version=4),
+            author=rand.choice(users),
+            created_at=started + timedelta(minutes=i),
+            title='post number {0}'.format(i),
+            views=rand.randint(0, 100),
+            rating=rand.random() * 5,
+            body=b'lorem ipsum dolor sit amet ' * rand.randint(1, 40),
+        ))
+
+    return posts
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Measures a single benchmark: latency per operation, round trips to
+redis and peak memory.
+
+Round trips are counted by the commands written to the redis sockets,
+so a pipeline counts as a single round trip no matter how many
+commands it sends. They cannot be counted against the in-process
+stand-in and are reported as ``None``.
+
+Peak memory is the growth of the peak RSS of the process while the
+benchmark runs, in kilobytes. The peak never goes down, so a benchmark
+that uses less memory than the ones before it reports ``0``.
+"""
+import gc
+import resource
+from contextlib import contextmanager
+from timeit import default_timer
+
+from redis.connection import Connection
+
+
+def percentile(values, rank):
+    """returns the nearest-rank percentile of the given values"""
+    if not values:
+        return
+
+    ordered = sorted(values)
+    index = int(round(rank / 100.0 * len(ordered) + 0.5)) - 1
+    return ordered[min(max(index, 0), len(ordered) - 1)]
+
+
+def get_peak_memory():
+    """returns the peak RSS of the process in kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class RoundTripCounter(object):
+    """counts the commands written to the redis sockets while active"""
+    def __init__(self):
+        self.count = 0
+
+    @contextmanager
+    def counting(self):
+        original = Connection.send_packed_command
+
+        def send_packed_command(connection, command):
+            self.count += 1
+            return original(connection, command)
+
+        Connection.send_packed_command = send_packed_command
+        try:
+            yield self
+        finally:
+            Connection.send_packed_command = original
+
+
+class Measurement(object):
+    """collects the latency of every operation of a benchmark.
+
+    ::
+
+        measurement = Measurement('get', count_round_trips=True)
+        with measurement.running():
+            for id in ids:
+                with measurement.operation():
+                    User.objects.get(id=id)
+
+        measurement.to_dict()
+    """
+    def __init__(self, name, count_round_trips=True, items_per_operation=1):
+        self.name = name
+        self.count_round_trips = count_round_trips
+        self.items_per_operation = items_per_operation
+        self.latencies = []
+        self.elapsed = 0.0
+        self.round_trips = None
+        self.peak_memory = 0
+
+    @contextmanager
+    def running(self):
+        gc.collect()
+        counter = RoundTripCounter()
+        peak_memory = get_peak_memory()
+        started = default_timer()
+        if self.count_round_trips:
+            with counter.counting():
+                yield self
+
+            self.round_trips = counter.count
+        else:
+            yield self
+
+        self.elapsed = default_timer() - started
+        self.peak_memory = get_peak_memory() - peak_memory
+
+    @contextmanager
+    def operation(self):
+        started = default_timer()
+        yield
+        self.latencies.append(default_timer() - started)
+
+    def to_dict(self):
+        operations = len(self.latencies)
+        total = sum(self.latencies)
+        round_trips = self.round_trips
+        if round_trips is not None and operations:
+            round_trips = float(round_trips) / operations
+
+        return {
+            'operations': operations,
+            'items_per_operation': self.items_per_operation,
+            'ops_per_sec': total and operations / total or None,
+            'items_per_sec': total and operations * self.items_per_operation / total or None,
+            'p50_ms': operations and percentile(self.latencies, 50) * 1000 or None,
+            'p99_ms': operations and percentile(self.latencies, 99) * 1000 or None,
+            'round_trips_per_op': round_trips,
+            'peak_memory_kb': self.peak_memory,
+            'elapsed_sec': self.elapsed,
+        }
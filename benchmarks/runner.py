@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Command line of the benchmarks, see :py:mod:`benchmarks`."""
+from __future__ import unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from repocket import configure
+
+from benchmarks.fixtures import BlogPost, User
+from benchmarks.suite import BENCHMARKS, Run, run_benchmarks
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# a benchmark is reported as a regression when it gets slower than this
+TOLERANCE = 0.1
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return
+
+
+def connect(args):
+    """configures the connection of the given backend and returns it"""
+    if args.backend == 'fake':
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit('--backend fake requires fakeredis: pip install fakeredis')
+
+        configure.pool = None
+        configure.clients[configure.default_alias] = fakeredis.FakeRedis()
+        configure.pid = os.getpid()
+        # the stand-in cannot run lua scripts
+        User.objects.server_side_filtering = False
+        BlogPost.objects.server_side_filtering = False
+        return configure.get_connection()
+
+    configure.connection_pool(hostname=args.hostname, port=args.port, db=args.db)
+    connection = configure.get_connection()
+    if connection.dbsize() and not args.force:
+        raise SystemExit('the redis db {0} is not empty, it would be flushed by the benchmarks. '
+                         'Choose another one with --db or pass --force'.format(args.db))
+
+    return connection
+
+
+def get_redis_version(args, connection):
+    if args.backend == 'fake':
+        return
+
+    return connection.info()['redis_version']
+
+
+def run(args):
+    connection = connect(args)
+    report = {
+        'commit': get_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'redis_version': get_redis_version(args, connection),
+        'runs': [],
+    }
+    for rows in args.rows:
+        connection.flushdb()
+        try:
+            results = run_benchmarks(
+                Run(rows, sample=args.sample, repeat=args.repeat, round_trips=args.backend == 'redis'),
+                args.benchmark,
+            )
+        finally:
+            connection.flushdb()
+
+        report['runs'].append({'rows': rows, 'benchmarks': results})
+        print_results(rows, results)
+
+    path = args.output or os.path.join(RESULTS_PATH, '{0}-{1}.json'.format((report['commit'] or 'unknown')[:10], args.backend))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+
+    with open(path, 'w') as fd:
+        json.dump(report, fd, indent=2, sort_keys=True)
+
+    print 'saved to {0}'.format(path)
+    return report
+
+
+def format_number(value, template='{0:.2f}'):
+    if value is None:
+        return '-'
+
+    return template.format(value)
+
+
+def print_results(rows, results):
+    print '\n{0} rows'.format(rows)
+    print '{0:<22} {1:>12} {2:>12} {3:>10} {4:>10} {5:>12} {6:>10}'.format(
+        'benchmark', 'ops/sec', 'items/sec', 'p50 ms', 'p99 ms', 'round trips', 'peak KB')
+    for name, _, _, _, _ in BENCHMARKS:
+        if name not in results:
+            continue
+
+        result = results[name]
+        print '{0:<22} {1:>12} {2:>12} {3:>10} {4:>10} {5:>12} {6:>10}'.format(
+            name,
+            format_number(result['ops_per_sec'], '{0:.1f}'),
+            format_number(result['items_per_sec'], '{0:.1f}'),
+            format_number(result['p50_ms'], '{0:.3f}'),
+            format_number(result['p99_ms'], '{0:.3f}'),
+            format_number(result['round_trips_per_op']),
+            result['peak_memory_kb'],
+        )
+
+
+def compare(before_path, after_path, tolerance=TOLERANCE):
+    """prints the change of ops/sec of every benchmark present in both
+    reports, returns the amount of regressions"""
+    with open(before_path) as fd:
+        before = dict([(r['rows'], r['benchmarks']) for r in json.load(fd)['runs']])
+
+    with open(after_path) as fd:
+        after = dict([(r['rows'], r['benchmarks']) for r in json.load(fd)['runs']])
+
+    regressions = 0
+    for rows in sorted(set(before).intersection(after)):
+        print '\n{0} rows'.format(rows)
+        for name, _, _, _, _ in BENCHMARKS:
+            old, new = before[rows].get(name), after[rows].get(name)
+            if not old or not new or not old['ops_per_sec'] or not new['ops_per_sec']:
+                continue
+
+            change = new['ops_per_sec'] / old['ops_per_sec'] - 1
+            regressed = change < -tolerance
+            regressions += regressed
+            print '{0:<22} {1:>12.1f} {2:>12.1f} {3:>+8.1%}{4}'.format(
+                name, old['ops_per_sec'], new['ops_per_sec'], change, regressed and '  REGRESSION' or '')
+
+    return regressions
+
+
+def parse_rows(value):
+    try:
+        return [int(rows) for rows in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected a comma separated list of integers, got {0}'.format(repr(value)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='repocket benchmarks')
+    parser.add_argument('--rows', type=parse_rows, default=[1000],
+                        help='comma separated amounts of rows, for example 1000,100000,1000000')
+    parser.add_argument('--backend', choices=['redis', 'fake'], default='redis',
+                        help='a local redis-server or the in-process stand-in from fakeredis')
+    parser.add_argument('--hostname', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15, help='an empty redis db, flushed by the benchmarks')
+    parser.add_argument('--force', action='store_true', help='run even when the redis db is not empty')
+    parser.add_argument('--sample', type=int, default=1000,
+                        help='the maximum amount of operations of the benchmarks of a single item')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the amount of operations of the benchmarks that walk all the rows')
+    parser.add_argument('--benchmark', action='append', choices=[name for name, _, _, _, _ in BENCHMARKS],
+                        help='runs only the given benchmark, can be repeated')
+    parser.add_argument('--output', help='the path of the JSON report, defaults to benchmarks/results/<commit>-<backend>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compares the ops/sec of two JSON reports instead of running the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare) and 1 or 0
+
+    run(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""The benchmarks, in the order they run: the serialization paths
+first, then ``save()`` fills redis for the query paths.
+
+Every benchmark is a function that takes the :py:class:`Run` and a
+:py:class:`~benchmarks.measure.Measurement`, registered with
+:py:func:`benchmark`.
+"""
+from __future__ import unicode_literals
+
+from itertools import islice
+
+from repocket import save_many
+from repocket.attributes import ByteStream, Pointer
+
+from benchmarks.fixtures import BlogPost, User, make_posts, make_users
+from benchmarks.measure import Measurement
+
+BENCHMARKS = []
+SAVE_BATCH_SIZE = 500
+PAGE_SIZE = 20
+
+
+def benchmark(name, uses_redis=True, items_per_operation=None, populates=False):
+    """registers a benchmark, ``items_per_operation`` is a function
+    that takes the :py:class:`Run`, one item per operation by default.
+    The benchmarks that ``populates`` redis run before the queries."""
+    def register(func):
+        BENCHMARKS.append((name, func, uses_redis, items_per_operation, populates))
+        return func
+
+    return register
+
+
+class Run(object):
+    """the data of the benchmarks of a single amount of rows.
+
+    **arguments**
+
+    * ``rows`` - the amount of users and blog posts
+    * ``sample`` - the maximum amount of operations of the benchmarks of a single item, like ``get()``
+    * ``repeat`` - the amount of operations of the benchmarks that walk all the rows, like ``all()``
+    * ``round_trips`` - whether the round trips to redis can be counted
+    """
+    def __init__(self, rows, sample=1000, repeat=3, round_trips=True):
+        self.rows = rows
+        self.sample = min(sample, rows)
+        self.repeat = repeat
+        self.round_trips = round_trips
+        self.users = make_users(rows)
+        self.posts = make_posts(rows, self.users)
+
+    def sampled(self, items):
+        """returns ``sample`` items spread across the given ones"""
+        step = max(len(items) // self.sample, 1)
+        return list(islice(items, 0, None, step))[:self.sample]
+
+    def populate(self):
+        """stores the users and the blog posts without measuring"""
+        save_many(self.users, batch_size=SAVE_BATCH_SIZE)
+        save_many(self.posts, batch_size=SAVE_BATCH_SIZE)
+
+
+def get_hash_fields(model):
+    return [(name, field) for name, field in model.__fields__.items() if not isinstance(field, ByteStream)]
+
+
+def get_value(item, name, field):
+    if isinstance(field, Pointer):
+        # serializing a pointer does not require resolving it
+        return item._get_reference(name)
+
+    return getattr(item, name)
+
+
+@benchmark('attributes.to_json', uses_redis=False)
+def to_json(run, measurement):
+    fields = get_hash_fields(BlogPost)
+    for post in run.posts:
+        with measurement.operation():
+            for name, field in fields:
+                field.to_json(get_value(post, name, field))
+
+
+@benchmark('attributes.from_json', uses_redis=False)
+def from_json(run, measurement):
+    fields = get_hash_fields(BlogPost)
+    raw_posts = [BlogPost.__encoder__(post)['hash'] for post in run.posts]
+    for raw in raw_posts:
+        with measurement.operation():
+            for name, field in fields:
+                type(field).from_json(raw[name])
+
+
+@benchmark('model.encode', uses_redis=False)
+def encode(run, measurement):
+    for post in run.posts:
+        with measurement.operation():
+            BlogPost.__encoder__(post)
+
+
+@benchmark('model.decode', uses_redis=False)
+def decode(run, measurement):
+    raw_posts = [BlogPost.__encoder__(post) for post in run.posts]
+    for raw in raw_posts:
+        with measurement.operation():
+            BlogPost.__decoder__(raw['hash'], raw['strings'])
+
+
+@benchmark('save', populates=True)
+def save(run, measurement):
+    for user in run.users:
+        with measurement.operation():
+            user.save()
+
+
+@benchmark('save_many', items_per_operation=lambda run: min(SAVE_BATCH_SIZE, run.rows), populates=True)
+def save_many_posts(run, measurement):
+    for start in range(0, run.rows, SAVE_BATCH_SIZE):
+        with measurement.operation():
+            save_many(run.posts[start:start + SAVE_BATCH_SIZE], batch_size=SAVE_BATCH_SIZE)
+
+
+@benchmark('get')
+def get(run, measurement):
+    for post in run.sampled(run.posts):
+        with measurement.operation():
+            BlogPost.objects.get(id=post.id)
+
+
+@benchmark('filter.indexed')
+def filter_indexed(run, measurement):
+    for user in run.sampled(run.users):
+        with measurement.operation():
+            list(User.objects.filter(email=user.email))
+
+
+@benchmark('filter.unindexed', items_per_operation=lambda run: run.rows)
+def filter_unindexed(run, measurement):
+    for i in range(run.repeat):
+        with measurement.operation():
+            list(BlogPost.objects.filter(views=i))
+
+
+@benchmark('all', items_per_operation=lambda run: run.rows)
+def all_posts(run, measurement):
+    for _ in range(run.repeat):
+        with measurement.operation():
+            list(BlogPost.objects.all())
+
+
+@benchmark('all.as_batch', items_per_operation=lambda run: run.rows)
+def all_posts_as_batch(run, measurement):
+    for _ in range(run.repeat):
+        with measurement.operation():
+            BlogPost.objects.as_batch('views', 'rating')
+
+
+@benchmark('order_by.slice', items_per_operation=lambda run: min(PAGE_SIZE, run.rows))
+def order_by_slice(run, measurement):
+    recent = BlogPost.objects.order_by('-created_at')
+    for i in range(run.sample):
+        start = i * PAGE_SIZE % run.rows
+        with measurement.operation():
+            list(recent[start:start + PAGE_SIZE])
+
+
+@benchmark('count')
+def count(run, measurement):
+    for _ in range(run.sample):
+        with measurement.operation():
+            BlogPost.objects.count()
+
+
+def run_benchmarks(run, names=None):
+    """runs the registered benchmarks, all of them by default, and
+    returns a dict with the results of each one"""
+    results = {}
+    skipped = [name for name, _, _, _, populates in BENCHMARKS if populates and names and name not in names]
+    if skipped:
+        run.populate()
+
+    for name, func, uses_redis, items_per_operation, _ in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        measurement = Measurement(
+            name,
+            count_round_trips=uses_redis and run.round_trips,
+            items_per_operation=items_per_operation and items_per_operation(run) or 1,
+        )
+        with measurement.running():
+            func(run, measurement)
+
+        results[name] = measurement.to_dict()
+
+    return results
@@ -4,7 +4,8 @@ from repocket.registry import MODELS
 from repocket import attributes
 from repocket.connections import configure
 from repocket.model import ActiveRecord
-from repocket.manager import ActiveRecordManager
+from repocket.manager import ActiveRecordManager, QuerySet, save_many
+from repocket.batch import RecordBatch
 from repocket.util import is_null
 
 __all__ = [
@@ -12,6 +13,9 @@ __all__ = [
     'configure',
     'ActiveRecord',
     'ActiveRecordManager',
+    'QuerySet',
+    'RecordBatch',
+    'save_many',
     'MODELS',
     'is_null',
 ]
@@ -1,2 +1,4 @@
 from collections import OrderedDict
 MODELS = OrderedDict()
+ATTRIBUTES = OrderedDict()
+DECODERS = {}
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import json
+import calendar
 import importlib
 import logging
 import dateutil.parser
@@ -10,7 +11,8 @@ from datetime import datetime
 
 from decimal import Decimal as PythonsDecimal
 
-from repocket._cache import MODELS
+from repocket._cache import MODELS, ATTRIBUTES, DECODERS
+from repocket.compression import get_algorithm
 from repocket.util import is_null
 
 logger = logging.getLogger("repocket.attributes")
@@ -20,19 +22,67 @@ def get_current_time(field):
     return datetime.utcnow()
 
 
+class AttributeRegistry(type):
+    """registers every attribute class in ``ATTRIBUTES`` by its module
+    and type name, so that serialized values can be decoded without
+    importing modules"""
+    def __init__(AttributeClass, name, bases, members):
+        super(AttributeRegistry, AttributeClass).__init__(name, bases, members)
+        ATTRIBUTES[(AttributeClass.__module__, name)] = AttributeClass
+
+
+def get_decoder(module_name, type_name):
+    """returns the function that casts raw values of the given
+    attribute type, memoized per ``(module_name, type_name)``"""
+    key = (module_name, type_name)
+    try:
+        return DECODERS[key]
+    except KeyError:
+        pass
+
+    attribute = ATTRIBUTES.get(key)
+    if attribute is None:
+        # the attribute class was not imported yet
+        module = importlib.import_module(module_name)
+        attribute = getattr(module, type_name)
+
+    DECODERS[key] = attribute.cast
+    return DECODERS[key]
+
+
 class Attribute(object):
     """Repocket treats its models and attributes as fully serializable.
     Every attribute contains a ``to_python`` method that knows how to
     serialize the type safely.
 
     """
+    __metaclass__ = AttributeRegistry
     __base_type__ = bytes
     __empty_value__ = b''
+    __range_index__ = False
+    # how the lua filter compares the stored values, see :py:mod:`repocket.scripting`
+    __script_comparison__ = None
+    # the array type of the column in a :py:class:`~repocket.batch.RecordBatch`
+    __array_typecode__ = None
+    # whether the values can be changed in place, see ActiveRecord.get_dirty_fields()
+    __mutable__ = False
+
+    def __init__(self, null=False, default=None, encoding='utf-8', index=False, compress=None, threshold=4096):
+        """
+        **arguments**
 
-    def __init__(self, null=False, default=None, encoding='utf-8'):
+        * ``index`` - ``True`` keeps a set of primary keys per value, ``'range'`` keeps a sorted set scored by :py:meth:`to_score`
+        * ``compress`` - the name of the algorithm used to compress the stored values, ``zlib`` or ``bz2``, see :py:mod:`repocket.compression`
+        * ``threshold`` - the minimum size in bytes of the values that get compressed, defaults to ``4096``
+        """
         self.can_be_null = null
         self.default = default
         self.encoding = encoding
+        self.index = index
+        self.compress = compress
+        self.threshold = threshold
+        if compress is not None:
+            get_algorithm(compress)
 
     def to_string(self, value):
         """Utility method that knows how to safely convert the value into a string"""
@@ -45,6 +95,27 @@ class Attribute(object):
     def from_string(self, value):
         return self.cast(value)
 
+    def pack(self, value):
+        """Returns the raw string stored by the ``compact`` codec, see
+        :py:mod:`repocket.codecs`"""
+        return self.to_string(value)
+
+    def unpack(self, raw_value):
+        """Takes a raw string stored by the ``compact`` codec and returns
+        the python value"""
+        return self.cast(raw_value)
+
+    def to_index_value(self, value):
+        """Returns the string that represents the value inside of a
+        secondary index, see :py:meth:`~repocket.model.ActiveRecord._calculate_index_key`
+        """
+        return self.to_string(value)
+
+    def to_score(self, value):
+        """Returns the float that represents the value inside of a
+        range index, only available when ``__range_index__`` is ``True``"""
+        return float(self.cast(value))
+
     @classmethod
     def get_base_type(cls):
         """Returns the __base_type__"""
@@ -81,12 +152,8 @@ class Attribute(object):
 
     @classmethod
     def from_python(cls, data):
-        type_name = data['type']
-        module_name = data['module']
-        raw_value = data['value']
-        module = importlib.import_module(module_name)
-        attribute = getattr(module, type_name)
-        return attribute.cast(raw_value)
+        decoder = get_decoder(data['module'], data['type'])
+        return decoder(data['value'])
 
     @classmethod
     def from_json(cls, raw_value):
@@ -108,6 +175,7 @@ class UUID(Attribute):
     ``__base_type__ = uuid.UUID``
     """
     __base_type__ = PythonsUUID
+    __script_comparison__ = 'bytes'
 
     @classmethod
     def cast(cls, value):
@@ -122,6 +190,12 @@ class UUID(Attribute):
         except ValueError as e:
             raise ValueError(": ".join([str(e), repr(value)]))
 
+    def pack(self, value):
+        return self.cast(value).bytes
+
+    def unpack(self, raw_value):
+        return self.__base_type__(bytes=raw_value)
+
 
 class AutoUUID(UUID):
     """Automatically assigns a uuid1 as the value.
@@ -136,10 +210,14 @@ class Unicode(Attribute):
     """
     __base_type__ = unicode
     __empty_value__ = u''
+    __script_comparison__ = 'bytes'
 
     def to_string(self, value):
         return super(Unicode, self).to_string(unicode(value))
 
+    def unpack(self, raw_value):
+        return raw_value.decode(self.encoding)
+
 
 class Bytes(Attribute):
     """Handles raw byte strings
@@ -147,6 +225,7 @@ class Bytes(Attribute):
     """
     __base_type__ = bytes
     __empty_value__ = b''
+    __script_comparison__ = 'bytes'
 
 
 class Integer(Attribute):
@@ -155,6 +234,9 @@ class Integer(Attribute):
     """
     __base_type__ = int
     __empty_value__ = 0
+    __range_index__ = True
+    __script_comparison__ = 'number'
+    __array_typecode__ = b'l'
 
 
 class Float(Attribute):
@@ -163,6 +245,12 @@ class Float(Attribute):
     """
     __base_type__ = float
     __empty_value__ = 0.0
+    __range_index__ = True
+    __script_comparison__ = 'number'
+    __array_typecode__ = b'd'
+
+    def pack(self, value):
+        return repr(self.cast(value))
 
 
 class Decimal(Attribute):
@@ -171,6 +259,8 @@ class Decimal(Attribute):
     """
     __base_type__ = PythonsDecimal
     __empty_value__ = PythonsDecimal('0')
+    __range_index__ = True
+    __script_comparison__ = 'number'
 
 
 class JSON(Unicode):
@@ -180,6 +270,8 @@ class JSON(Unicode):
     ``__base_type__ = unicode``
     """
     __base_type__ = json.dumps
+    __script_comparison__ = None
+    __mutable__ = True
 
     @classmethod
     def cast(cls, value):
@@ -191,6 +283,12 @@ class JSON(Unicode):
         except ValueError:
             return value
 
+    def pack(self, value):
+        return json.dumps(value)
+
+    def unpack(self, raw_value):
+        return json.loads(raw_value)
+
 
 class DateTime(Attribute):
     """Repocket treats its models and attributes as fully serializable.
@@ -200,9 +298,10 @@ class DateTime(Attribute):
     """
     __base_type__ = datetime
     __empty_value__ = None
+    __range_index__ = True
 
-    def __init__(self, auto_now=False, null=False):
-        super(DateTime, self).__init__(null=null)
+    def __init__(self, auto_now=False, null=False, index=False):
+        super(DateTime, self).__init__(null=null, index=index)
         self.auto_now = False
 
     @classmethod
@@ -221,19 +320,92 @@ class DateTime(Attribute):
 
         return self.cast(value).isoformat()
 
+    def to_score(self, value):
+        """returns the seconds since the epoch, naive datetimes are
+        considered to be in UTC"""
+        value = self.cast(value)
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1000000.0
+
+
+class Reference(object):
+    """An unresolved :py:class:`Pointer` value: knows the model and the
+    primary key of the referenced item but does not touch redis until
+    :py:meth:`resolve` is called.
+    """
+    def __init__(self, model, primary_key):
+        self.model = model
+        self.primary_key = primary_key
+
+    def __repr__(self):
+        return 'Reference({0})'.format(self._calculate_hash_key())
+
+    def get_id(self):
+        return self.primary_key
+
+    def _calculate_hash_key(self):
+        return b':'.join([
+            self.model._static_key_prefix(),
+            bytes(self.primary_key),
+        ])
+
+    def resolve(self):
+        """retrieves the referenced item from redis"""
+        return self.model.objects.get(self.primary_key)
+
+
+class PointerDescriptor(object):
+    """Installed in the model class for every :py:class:`Pointer`
+    attribute, resolves the :py:class:`Reference` the first time the
+    attribute is accessed and keeps the retrieved item.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        try:
+            value = instance.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+        if isinstance(value, Reference):
+            value = value.resolve()
+            instance.__dict__[self.name] = value
+
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    def __delete__(self, instance):
+        instance.__dict__.pop(self.name, None)
+
+    def get_reference(self, instance):
+        """returns the current value without resolving it"""
+        return instance.__dict__.get(self.name)
+
 
 class Pointer(Attribute):
     """Think of it as a soft foreign key.
 
     This will automatically store the unique id of the target model
-    and automatically retrieves it for you.
+    and automatically retrieves it for you, lazily, the first time the
+    attribute is accessed. Use ``prefetch()`` to retrieve the
+    references of many items at once:
+
+    ::
+
+        BlogPost.objects.filter(title='Hello').prefetch('author')
     """
     __base_type__ = None
     __empty_value__ = None
+    __script_comparison__ = 'bytes'
 
-    def __init__(self, to_model, null=False):
+    def __init__(self, to_model, null=False, index=False):
         self.model = to_model
-        super(Pointer, self).__init__(null=null)
+        super(Pointer, self).__init__(null=null, index=index)
 
     def to_string(self, value):
         if not value:
@@ -246,12 +418,12 @@ class Pointer(Attribute):
 
     @classmethod
     def cast(cls, value):
-        """this method uses a redis connection to retrieve the referenced item"""
+        """returns a :py:class:`Reference` to the item, without touching redis"""
         if is_null(value):
             return
 
-        if type(value) in MODELS.values():
-            # the value is already a valid model instance
+        if isinstance(value, Reference) or type(value) in MODELS.values():
+            # the value is already a valid model instance or reference
             return value
 
         try:
@@ -264,13 +436,21 @@ class Pointer(Attribute):
         if not Model:
             raise ReferenceError('The model {0} is not available in repocket. Make sure that you imported it'.format(compound_name))
 
-        result = Model.objects.get(**{Model.__primary_key__: model_uuid})
-        return result
+        return Reference(Model, model_uuid)
 
 
 class ByteStream(Attribute):
     """Handles bytes that will be stored as a string in redis
     ``__base_type__ = bytes``
+
+    **arguments**
+
+    * ``lazy`` - when ``True`` the contents are not retrieved along with the item, only when the attribute is accessed, see :py:meth:`~repocket.model.ActiveRecord.open_stream`
+    * ``compress`` - compresses every saved or appended chunk of at least ``threshold`` bytes, see :py:mod:`repocket.compression`
     """
     __base_type__ = bytes
     __empty_value__ = b''
+
+    def __init__(self, null=False, default=None, index=False, lazy=False, compress=None, threshold=4096):
+        super(ByteStream, self).__init__(null=null, default=default, index=index, compress=compress, threshold=threshold)
+        self.lazy = lazy
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Runs repocket calls in a pool of worker threads so that the redis
+round-trips of many calls overlap instead of blocking the caller.
+
+Every ``a*`` method of the models and managers returns an
+:py:class:`~multiprocessing.pool.AsyncResult` right away:
+
+::
+
+    pending = [User.objects.aget(i) for i in user_ids]
+    users = [p.get() for p in pending]
+
+    post.asave().get(timeout=5)
+
+The size of the pool can be set once, before the first call:
+
+::
+
+    from repocket.background import configure_workers
+
+    configure_workers(32)
+
+Calls made from a worker thread, like the ones that query the nodes of
+a sharded model within ``afilter()``, run inline instead of waiting for
+another worker, so the pool never deadlocks.
+
+The calls run within the :py:func:`~repocket.identity.identity_map`
+context of the caller, and child processes create their own pool.
+"""
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from repocket import identity, instrumentation
+
+_state = {
+    'workers': 10,
+    'pool': None,
+    # the process that created the pool, see get_pool()
+    'pid': None,
+}
+_lock = threading.Lock()
+_worker = threading.local()
+
+
+def _mark_worker():
+    _worker.active = True
+
+
+def in_worker():
+    """returns ``True`` when called from a worker thread of the pool"""
+    return getattr(_worker, 'active', False)
+
+
+def configure_workers(workers=10):
+    """sets the amount of worker threads, replacing the current pool.
+
+    **arguments**
+
+    * ``workers`` - the amount of threads, defaults to ``10``
+    """
+    with _lock:
+        pool = _state['pool']
+        _state['workers'] = workers
+        _state['pool'] = None
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def get_pool():
+    """returns the :py:class:`~multiprocessing.pool.ThreadPool` in
+    use, creating it on the first call and again in child processes,
+    which do not inherit the worker threads of the parent"""
+    with _lock:
+        if _state['pool'] is None or _state['pid'] != os.getpid():
+            _state['pool'] = ThreadPool(processes=_state['workers'], initializer=_mark_worker)
+            _state['pid'] = os.getpid()
+
+        return _state['pool']
+
+
+def submit(func, *args, **kw):
+    """calls the function in a worker thread, returns an
+    :py:class:`~multiprocessing.pool.AsyncResult`"""
+    if instrumentation.hooks:
+        func = instrumentation.propagate(func)
+
+    func = identity.propagate(func)
+
+    return get_pool().apply_async(func, args, kw)
+
+
+def map_all(func, items):
+    """returns the list of results of calling the function with every
+    item, in parallel in the worker threads or one after the other when
+    called from a worker thread"""
+    items = list(items)
+    if len(items) == 1 or in_worker():
+        return [func(item) for item in items]
+
+    pending = [submit(func, item) for item in items]
+    return [p.get() for p in pending]
+
+
+def iter_ahead(batches):
+    """consumes the given iterable of batches, retrieving the next
+    batch in a worker thread while the current one is yielded"""
+    if in_worker():
+        for batch in batches:
+            for item in batch:
+                yield item
+
+        return
+
+    batches = iter(batches)
+    pending = submit(next, batches, None)
+    while True:
+        batch = pending.get()
+        if batch is None:
+            return
+
+        pending = submit(next, batches, None)
+        for item in batch:
+            yield item
+
+
+def iter_interleaved(iterables):
+    """yields the items of the given iterables of batches, retrieving
+    the next batch of all of them in parallel, so that only a batch per
+    iterable is held at a time"""
+    iterators = [iter(i) for i in iterables]
+    while iterators:
+        batches = map_all(lambda iterator: next(iterator, None), iterators)
+        iterators = [i for i, batch in zip(iterators, batches) if batch is not None]
+        for batch in batches:
+            for item in batch or ():
+                yield item
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Column-wise storage of many items of the same model.
+
+Holding a large result set as model instances costs a python object,
+with its own ``__dict__``, per item. A :py:class:`RecordBatch` keeps a
+single sequence per attribute instead: ``Integer`` and ``Float``
+attributes are stored in :py:mod:`array` columns and the other
+attributes in lists.
+
+::
+
+    batch = Build.objects.filter(status='failed').as_batch('id', 'duration')
+    total = sum(batch.column('duration'))
+
+    for build_id, duration in batch.iter_rows('id', 'duration'):
+        print build_id, duration
+
+Instances are only created when a row is indexed or the batch is
+iterated, with the attributes that were not stored in the batch
+deferred, see :py:meth:`~repocket.manager.ActiveRecordManager.only`.
+Like the items retrieved from redis, they are built without calling
+``__init__`` but call ``__post_load__``, unless the model defines its
+own ``__init__``, see :py:mod:`repocket.serializers`.
+"""
+from array import array
+from collections import OrderedDict
+from itertools import izip
+
+from repocket.attributes import Pointer
+from repocket.serializers import build_with_init, overrides_init
+
+
+class RecordBatch(object):
+    """the values of many items of the same model, one column per
+    attribute.
+
+    **arguments**
+
+    * ``model`` - the model class
+    * ``names`` - the attributes stored in the batch, defaults to all of them. The primary key is always stored.
+    * ``alias`` - the alias of the connection pool of the items, see :py:meth:`~repocket.model.ActiveRecord.get_alias`
+    """
+    def __init__(self, model, names=None, alias=None):
+        self.model = model
+        self.alias = alias
+        names = list(names or model.__fields__.keys())
+        if model.__primary_key__ not in names:
+            names.insert(0, model.__primary_key__)
+
+        invalid = [name for name in names if name not in model.__fields__]
+        if invalid:
+            raise KeyError("{0} is not a valid field in {1}, options are {2}".format(
+                ', '.join(invalid), model.__compound_name__, model.__fields__.keys()))
+
+        self.columns = OrderedDict()
+        for name in names:
+            typecode = model.__fields__[name].__array_typecode__
+            self.columns[name] = array(typecode) if typecode else []
+
+        self.deferred_fields = frozenset(model.__fields__.keys()).difference(names)
+        self._pointers = frozenset([name for name in names if isinstance(model.__fields__[name], Pointer)])
+        self._with_init = overrides_init(model)
+
+    @classmethod
+    def from_items(cls, model, items, names=None, alias=None):
+        """returns a batch with the values of the given instances"""
+        batch = cls(model, names, alias)
+        batch.extend(items)
+        return batch
+
+    def _append_value(self, name, value):
+        column = self.columns[name]
+        try:
+            column.append(value)
+        except (TypeError, OverflowError):
+            # ``None`` or a number that the array cannot hold
+            column = self.columns[name] = list(column)
+            column.append(value)
+
+    def append(self, item):
+        """stores the values of the given instance"""
+        if not isinstance(item, self.model):
+            raise TypeError('{0} is not an instance of {1}'.format(repr(item), self.model.__compound_name__))
+
+        for name in self.columns:
+            if name in self._pointers:
+                # storing a pointer does not require resolving it
+                value = item._get_reference(name)
+            else:
+                value = getattr(item, name)
+
+            self._append_value(name, value)
+
+    def extend(self, items):
+        """stores the values of every given instance"""
+        for item in items:
+            self.append(item)
+
+    def column(self, name):
+        """returns the sequence with the values of the given attribute"""
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KeyError("{0} is not stored in the batch, options are {1}".format(name, self.columns.keys()))
+
+    def iter_rows(self, *names):
+        """yields a tuple with the values of the given attributes, all
+        of them by default, per row, without creating instances"""
+        return izip(*[self.column(name) for name in names or self.columns])
+
+    def get(self, index, name):
+        """returns the value of an attribute of a single row"""
+        return self.column(name)[index]
+
+    def _build_item(self, index):
+        if self._with_init:
+            data = dict([(name, column[index]) for name, column in self.columns.items()])
+            return build_with_init(self.model, data, self.deferred_fields, self.alias)
+
+        instance = self.model.__new__(self.model)
+        values = instance.__dict__
+        for name, column in self.columns.items():
+            values[name] = column[index]
+
+        if self.deferred_fields:
+            values['_deferred_fields'] = self.deferred_fields
+
+        if self.alias:
+            values['_using'] = self.alias
+
+        values['_persisted'] = True
+        if self.model.__post_load__ is not None:
+            instance.__post_load__()
+
+        return instance
+
+    def __len__(self):
+        return len(self.columns[self.model.__primary_key__])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            batch = type(self)(self.model, self.columns.keys(), self.alias)
+            for name, column in self.columns.items():
+                batch.columns[name] = column[index]
+
+            return batch
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('{0} index out of range'.format(self.model.__compound_name__))
+
+        return self._build_item(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._build_item(index)
+
+    def __repr__(self):
+        return '<RecordBatch of {0} {1} items>'.format(len(self), self.model.__compound_name__)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Codecs define how the value of each attribute is stored inside of
+the redis hash of a model.
+
+* ``envelope`` - the default, stores every value in a json object
+  that describes its type, see :py:meth:`~repocket.attributes.Attribute.to_python`
+* ``compact`` - stores the raw value, prefixed by a single byte that
+  identifies the format version. The type is determined by the
+  attributes declared in the model, see :py:meth:`~repocket.attributes.Attribute.pack`
+
+The codec is chosen per model through the ``__codec__`` member:
+
+::
+
+    class User(ActiveRecord):
+        __codec__ = 'compact'
+
+        email = attributes.Unicode()
+
+Values are always decoded according to the format in which they were
+stored, so changing the codec of a model does not require migrating
+the existing data.
+"""
+from __future__ import unicode_literals
+
+from repocket.attributes import Attribute
+from repocket.compression import decompress_value
+from repocket.errors import RepocketActiveRecordDefinitionError
+
+
+# the first byte of every value stored by the compact codec
+COMPACT_V1 = b'\x01'
+COMPACT_V1_NULL = b'\x02'
+
+
+class EnvelopeCodec(object):
+    """stores the values as json objects containing the module and
+    type name of the attribute"""
+    name = 'envelope'
+
+    def encode(self, field, value):
+        return field.to_json(value)
+
+    def decode(self, field, raw_value):
+        return Attribute.from_json(raw_value)
+
+
+class CompactCodec(object):
+    """stores the raw values prefixed by a version marker"""
+    name = 'compact'
+
+    def encode(self, field, value):
+        if value is None:
+            return COMPACT_V1_NULL
+
+        return COMPACT_V1 + field.pack(value)
+
+    def decode(self, field, raw_value):
+        if raw_value[:1] == COMPACT_V1_NULL:
+            return
+
+        return field.unpack(raw_value[1:])
+
+
+CODECS = {
+    EnvelopeCodec.name: EnvelopeCodec(),
+    CompactCodec.name: CompactCodec(),
+}
+
+
+def get_codec(name):
+    """returns the codec registered with the given name"""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise RepocketActiveRecordDefinitionError('invalid codec {0}, options are {1}'.format(
+            repr(name), ', '.join(sorted(CODECS))))
+
+
+def detect_codec(raw_value):
+    """returns the codec that was used to store the given raw value"""
+    if raw_value[:1] in (COMPACT_V1, COMPACT_V1_NULL):
+        return CODECS[CompactCodec.name]
+
+    return CODECS[EnvelopeCodec.name]
+
+
+def decode_value(field, raw_value):
+    """decodes a raw value from a redis hash, regardless of the codec
+    that was used to store it and of its compression.
+
+    **arguments**
+
+    * ``field`` - the :py:class:`~repocket.attributes.Attribute` declared in the model, or ``None`` when the model does not declare it anymore
+    * ``raw_value`` - the raw string stored in redis
+    """
+    raw_value = decompress_value(raw_value)
+    codec = detect_codec(raw_value)
+    if field is None and codec.name != EnvelopeCodec.name:
+        # without the schema there is no way to know the type
+        return
+
+    return codec.decode(field, raw_value)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Transparent compression of large attribute values.
+
+Any attribute can be declared with ``compress`` and a ``threshold`` in
+bytes, the values smaller than the threshold are stored as usual:
+
+::
+
+    class Build(ActiveRecord):
+        metadata = attributes.JSON(compress='zlib', threshold=4096)
+        stdout = attributes.ByteStream(compress='zlib')
+
+Values stored in the hash get a two bytes header: the
+``COMPRESSED`` marker followed by the identifier of the algorithm.
+
+``ByteStream`` values are stored as a sequence of frames, so that
+:py:meth:`~repocket.model.ActiveRecord.append_to_bytestream` can append
+a compressed chunk without retrieving the contents. The string starts
+with ``STREAM_MAGIC`` and every frame has a header with the identifier
+of the algorithm, the stored size and the original size. Streams stored
+before compression was enabled become the first frame of the stream
+on the first append. A stream is only read as frames when the magic
+bytes are followed by a valid frame header, see :py:func:`is_framed`,
+so contents that happen to start with ``STREAM_MAGIC`` are kept as
+they are.
+
+Values are always decoded according to their header, so compressed
+and uncompressed values coexist and changing the declaration does not
+require migrating the existing data.
+"""
+import bz2
+import struct
+import zlib
+
+from repocket.errors import RepocketActiveRecordDefinitionError
+
+# the first byte of a compressed hash value, see repocket.codecs
+COMPRESSED = b'\x03'
+# the first bytes of a ByteStream stored in frames
+STREAM_MAGIC = b'\x00RPS'
+# algorithm identifier, stored size, original size
+FRAME_HEADER = struct.Struct(b'>cII')
+# the magic bytes and the header of the first frame
+STREAM_HEADER_SIZE = len(STREAM_MAGIC) + FRAME_HEADER.size
+# the identifier of the frames stored without compression
+UNCOMPRESSED = b'-'
+# the maximum amount of uncompressed bytes in a single frame
+FRAME_SIZE = 1024 * 1024
+
+ALGORITHMS = {
+    'zlib': (b'z', zlib.compress, zlib.decompress),
+    'bz2': (b'b', bz2.compress, bz2.decompress),
+}
+DECOMPRESSORS = dict([(identifier, decompress) for identifier, _, decompress in ALGORITHMS.values()])
+DECOMPRESSORS[UNCOMPRESSED] = bytes
+
+# appends a frame, turning the contents stored before compression
+# was enabled into the first frame, see is_framed(). KEYS: the stream
+# key, ARGV: the magic bytes, the frames and the algorithm identifiers
+APPEND_FRAMES_SCRIPT = br"""
+local function size(length)
+    return string.char(
+        math.floor(length / 16777216) % 256,
+        math.floor(length / 65536) % 256,
+        math.floor(length / 256) % 256,
+        length % 256)
+end
+
+local function unpack_size(bytes)
+    local a, b, c, d = string.byte(bytes, 1, 4)
+    return ((a * 256 + b) * 256 + c) * 256 + d
+end
+
+local magic = ARGV[1]
+local length = string.len(magic)
+local head = redis.call('GETRANGE', KEYS[1], 0, length + 8)
+local framed = string.sub(head, 1, length) == magic
+if framed and string.len(head) > length then
+    local identifier = string.sub(head, length + 1, length + 1)
+    local stored_size = unpack_size(string.sub(head, length + 2, length + 5))
+    local original_size = unpack_size(string.sub(head, length + 6, length + 9))
+    framed = string.len(head) == length + 9
+        and string.find(ARGV[3], identifier, 1, true) ~= nil
+        and (identifier ~= '-' or stored_size == original_size)
+        and length + 9 + stored_size <= redis.call('STRLEN', KEYS[1])
+end
+
+if head == '' then
+    redis.call('SET', KEYS[1], magic)
+elseif not framed then
+    local contents = redis.call('GET', KEYS[1])
+    local length = size(string.len(contents))
+    redis.call('SET', KEYS[1], magic .. '-' .. length .. length .. contents)
+end
+
+return redis.call('APPEND', KEYS[1], ARGV[2])
+"""
+
+
+def get_algorithm(name):
+    """returns a tuple with the identifier, the compression and the
+    decompression function of the given algorithm"""
+    try:
+        return ALGORITHMS[name]
+    except KeyError:
+        raise RepocketActiveRecordDefinitionError('invalid compression {0}, options are {1}'.format(
+            repr(name), ', '.join(sorted(ALGORITHMS))))
+
+
+def compress_value(name, threshold, raw_value):
+    """returns the raw value of a hash field compressed with the given
+    algorithm, or untouched when smaller than the threshold or
+    incompressible"""
+    if name is None or len(raw_value) < threshold:
+        return raw_value
+
+    identifier, compress, _ = get_algorithm(name)
+    compressed = compress(raw_value)
+    if len(compressed) + 2 >= len(raw_value):
+        return raw_value
+
+    return COMPRESSED + identifier + compressed
+
+
+def decompress_value(raw_value):
+    """returns the raw value of a hash field as it was before being
+    compressed, untouched when it was not"""
+    if raw_value[:1] != COMPRESSED:
+        return raw_value
+
+    return DECOMPRESSORS[raw_value[1:2]](raw_value[2:])
+
+
+def pack_frames(name, threshold, data):
+    """returns the frames of the given bytes, one frame per
+    ``FRAME_SIZE`` bytes"""
+    identifier, compress, _ = get_algorithm(name)
+    frames = []
+    for start in range(0, len(data), FRAME_SIZE):
+        chunk = data[start:start + FRAME_SIZE]
+        stored, stored_identifier = chunk, UNCOMPRESSED
+        if len(chunk) >= threshold:
+            compressed = compress(chunk)
+            if len(compressed) < len(chunk):
+                stored, stored_identifier = compressed, identifier
+
+        frames.append(FRAME_HEADER.pack(stored_identifier, len(stored), len(chunk)))
+        frames.append(stored)
+
+    return b''.join(frames)
+
+
+def pack_stream(name, threshold, data):
+    """returns the whole string stored for a ByteStream with the given
+    contents"""
+    if name is None:
+        return data
+
+    return STREAM_MAGIC + pack_frames(name, threshold, data)
+
+
+def parse_frame_header(header):
+    """returns a tuple with the algorithm identifier, the stored size
+    and the original size of a frame, ``None`` when the given bytes
+    are not a frame header"""
+    if len(header) != FRAME_HEADER.size:
+        return
+
+    identifier, stored_size, size = FRAME_HEADER.unpack(header)
+    if identifier in DECOMPRESSORS:
+        return identifier, stored_size, size
+
+
+def iter_frames(value, offset=len(STREAM_MAGIC)):
+    """yields a tuple with the algorithm identifier, the original
+    size and the stored bytes of every frame. Bytes appended without
+    frames, when compression was disabled afterwards, are yielded as
+    an uncompressed frame."""
+    while offset < len(value):
+        header = parse_frame_header(value[offset:offset + FRAME_HEADER.size])
+        if header is not None:
+            identifier, stored_size, size = header
+            end = offset + FRAME_HEADER.size + stored_size
+            if end <= len(value):
+                yield identifier, size, value[offset + FRAME_HEADER.size:end]
+                offset = end
+                continue
+
+        rest = value[offset:]
+        yield UNCOMPRESSED, len(rest), rest
+        return
+
+
+def is_framed(head, length):
+    """returns ``True`` when the string stored for a ByteStream, given
+    its first ``STREAM_HEADER_SIZE`` bytes and its length, is stored in
+    frames: it starts with ``STREAM_MAGIC`` followed by nothing else or
+    by a frame header whose frame fits in the string"""
+    if head[:len(STREAM_MAGIC)] != STREAM_MAGIC:
+        return False
+
+    if length == len(STREAM_MAGIC):
+        return True
+
+    header = parse_frame_header(head[len(STREAM_MAGIC):STREAM_HEADER_SIZE])
+    if header is None:
+        return False
+
+    identifier, stored_size, size = header
+    if identifier == UNCOMPRESSED and stored_size != size:
+        return False
+
+    return STREAM_HEADER_SIZE + stored_size <= length
+
+
+def unpack_stream(value):
+    """returns the contents of the string stored for a ByteStream,
+    whether it was stored in frames or not"""
+    if not is_framed(value[:STREAM_HEADER_SIZE], len(value)):
+        return value
+
+    return b''.join([DECOMPRESSORS[identifier](stored) for identifier, _, stored in iter_frames(value)])
+
+
+def append_frames(pipeline, key, frames):
+    """adds the command that appends the given frames to the stream
+    into the pipeline, see ``APPEND_FRAMES_SCRIPT``"""
+    script = pipeline.register_script(APPEND_FRAMES_SCRIPT)
+    return script(keys=[key], args=[STREAM_MAGIC, frames, b''.join(sorted(DECOMPRESSORS))], client=pipeline)
@@ -1,17 +1,49 @@
+import os
+import threading
+
 import redis
 
+from repocket.instrumentation import InstrumentedConnection, InstrumentedUnixDomainSocketConnection
+from repocket.sharding import HashRing, get_server_address
+
 
 class configure(object):
     """global redis connection manager.
     this class is intended to be used as a singleton:
 
     * the ``connection_pool`` method will set a global connection pool with the given ``hostname``, ``port`` and ``db``
-    * the ``get_connection`` can be used safely at any time after ``connection_pool`` was already set.
+    * the ``get_connection`` can be used safely at any time, the default pool connects to ``localhost:6379`` until ``connection_pool`` is called.
+
+    More than one connection pool can be configured, each one under
+    an alias:
+
+    ::
+
+        configure.connection_pool(hostname='localhost', max_connections=50)
+        configure.connection_pool(unix_socket_path='/tmp/redis.sock', alias='sessions')
+
+        configure.get_connection('sessions')
+
+    The pools are recreated in child processes after ``fork()``, so
+    pre-fork servers never share sockets between processes.
     """
     pool = None
+    default_alias = 'default'
+    default_invalidation_channel = 'repocket:invalidations'
+    invalidation_channel = None
+
+    pools = {}
+    clients = {}
+    settings = {}
+    rings = {}
+    pid = None
+    lock = threading.RLock()
 
     @classmethod
-    def connection_pool(cls, hostname='localhost', port=6379, db=0):
+    def connection_pool(cls, hostname='localhost', port=6379, db=0, alias=None,
+                        password=None, max_connections=None, socket_timeout=None,
+                        socket_connect_timeout=None, socket_keepalive=False,
+                        unix_socket_path=None):
         """sets the global redis connection pool.
 
         **arguments**
@@ -19,13 +51,187 @@ class configure(object):
         * ``hostname`` - a string pointing to a valid hostname, defaults to ``localhost``
         * ``port`` - an integer with the port to connect to, defaults to ``6379``
         * ``db`` - a positive integer with the redis db to connect to, defaults to ``0``
+        * ``alias`` - the name of the pool, defaults to ``default``
+        * ``password`` - the redis password, if any
+        * ``max_connections`` - the maximum amount of connections open at once, unlimited by default
+        * ``socket_timeout`` - seconds to wait for a reply before raising an error
+        * ``socket_connect_timeout`` - seconds to wait for the connection to be established
+        * ``socket_keepalive`` - enables TCP keepalive, defaults to ``False``
+        * ``unix_socket_path`` - connects through the given unix socket instead of ``hostname`` and ``port``
+        """
+        alias = alias or cls.default_alias
+        settings = {
+            'db': db,
+            'password': password,
+            'max_connections': max_connections,
+            'socket_timeout': socket_timeout,
+        }
+        if unix_socket_path:
+            settings['connection_class'] = InstrumentedUnixDomainSocketConnection
+            settings['path'] = unix_socket_path
+        else:
+            settings['connection_class'] = InstrumentedConnection
+            settings['host'] = hostname
+            settings['port'] = port
+            settings['socket_connect_timeout'] = socket_connect_timeout
+            settings['socket_keepalive'] = socket_keepalive
+
+        with cls.lock:
+            cls._check_fork()
+            if cls.settings.get(alias) != settings or alias not in cls.pools:
+                cls.settings[alias] = settings
+                cls._create_pool(alias)
+
+        return cls
+
+    @classmethod
+    def _create_pool(cls, alias):
+        pool = redis.ConnectionPool(**cls.settings[alias])
+        cls.pools[alias] = pool
+        cls.clients[alias] = redis.Redis(connection_pool=pool)
+        cls.pid = os.getpid()
+        if alias == cls.default_alias:
+            cls.pool = pool
+
+    @classmethod
+    def _check_fork(cls):
+        """recreates all the pools when running in a child process"""
+        if cls.pid is None or cls.pid == os.getpid():
+            return
+
+        for pool in cls.pools.values():
+            # the sockets are shared with the parent process, close
+            # only our copy of them instead of shutting them down
+            for connection in pool._available_connections + list(pool._in_use_connections):
+                if connection._sock is not None:
+                    connection._sock.close()
+                    connection._sock = None
+
+        for alias in cls.settings.keys():
+            cls._create_pool(alias)
+
+    @classmethod
+    def shards(cls, nodes, alias=None, replicas=160):
+        """spreads the records of the given alias across the given
+        nodes, see :py:mod:`repocket.sharding`.
+
+        **arguments**
+
+        * ``nodes`` - a list with the aliases of connection pools already configured
+        * ``alias`` - the sharded alias, defaults to ``default``
+        * ``replicas`` - see :py:class:`~repocket.sharding.HashRing`
         """
-        cls.pool = redis.ConnectionPool(host=hostname, port=port, db=db)
+        alias = alias or cls.default_alias
+        for node in nodes:
+            if node not in cls.settings:
+                raise KeyError('there is no connection pool named {0}'.format(repr(node)))
+
+        cls.rings[alias] = HashRing(nodes, replicas=replicas)
         return cls
 
     @classmethod
-    def get_connection(cls):
+    def get_ring(cls, using=None):
+        """returns the :py:class:`~repocket.sharding.HashRing` of the
+        given alias or ``None`` when it is not sharded"""
+        return cls.rings.get(using or cls.default_alias)
+
+    @classmethod
+    def get_nodes(cls, using=None):
+        """returns the aliases of all the nodes of the given alias"""
+        using = using or cls.default_alias
+        ring = cls.rings.get(using)
+        if ring is None:
+            return [using]
+
+        return list(ring.nodes)
+
+    @classmethod
+    def get_node(cls, using=None, key=None):
+        """returns the alias of the node that stores the given key"""
+        using = using or cls.default_alias
+        ring = cls.rings.get(using)
+        if ring is None:
+            return using
+
+        if key is None:
+            raise ValueError('{0} is sharded, the key is required to choose the node'.format(repr(using)))
+
+        return ring.get_node(key)
+
+    @classmethod
+    def get_connections(cls, using=None):
+        """returns the connections of all the nodes of the given alias"""
+        return [cls.get_connection(node) for node in cls.get_nodes(using)]
+
+    @classmethod
+    def get_connection(cls, using=None, key=None):
         """returns a connection from the pool.
-        this method should **only** be called after you already called ``connection_pool``
+        the default alias connects to ``localhost:6379`` when ``connection_pool`` was not called yet
+
+        **arguments**
+
+        * ``using`` - the alias of the pool, defaults to ``default``
+        * ``key`` - the redis key that will be used, required when the alias is sharded
         """
-        return redis.Redis(connection_pool=cls.pool)
+        using = cls.get_node(using, key)
+        if cls.pid != os.getpid():
+            with cls.lock:
+                cls._check_fork()
+
+        client = cls.clients.get(using)
+        if client is None and using == cls.default_alias and cls.pool is None:
+            # not configured yet, connect to the local redis like redis.Redis() does
+            cls.connection_pool()
+            client = cls.clients[using]
+
+        if using == cls.default_alias and cls.pool is not None:
+            if client is None or client.connection_pool is not cls.pool:
+                # the pool was set directly
+                client = cls.clients[using] = redis.Redis(connection_pool=cls.pool)
+
+        if client is None:
+            raise KeyError('there is no connection pool named {0}, options are {1}'.format(
+                repr(using), ', '.join(sorted(cls.settings))))
+
+        return client
+
+    @classmethod
+    def stats(cls, using=None):
+        """returns a dict with the amount of connections ``created``,
+        ``in_use`` and ``idle`` in the given pool"""
+        using = using or cls.default_alias
+        pool = cls.pools[using]
+        return {
+            'created': pool._created_connections,
+            'in_use': len(pool._in_use_connections),
+            'idle': len(pool._available_connections),
+            'max_connections': pool.max_connections,
+        }
+
+    @classmethod
+    def publish_invalidations(cls, channel=None):
+        """makes ``save()``, ``delete()`` and ``append_to_bytestream()``
+        publish the redis key of the item in the given pub/sub channel,
+        see :py:mod:`repocket.readcache`. Pass ``channel=False`` to stop publishing.
+
+        **arguments**
+
+        * ``channel`` - the channel name, defaults to ``repocket:invalidations``
+        """
+        if channel is False:
+            cls.invalidation_channel = None
+        else:
+            cls.invalidation_channel = channel or cls.default_invalidation_channel
+
+        return cls
+
+
+def get_database(connection):
+    """returns the address of the redis server and the database of the
+    given client, which tell apart the same key stored in different
+    places, ``None`` for clients without a connection pool"""
+    pool = getattr(connection, 'connection_pool', None)
+    if pool is None:
+        return
+
+    return get_server_address(pool.connection_kwargs), pool.connection_kwargs.get('db', 0)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Identity maps keep the items already retrieved from redis, keyed by
+their database, see :py:func:`~repocket.connections.get_database`, and
+their redis hash key, so that retrieving the same item again returns
+the same instance without a round-trip.
+
+An identity map can be enabled for a single model:
+
+::
+
+    User.objects.use_identity_map(max_size=5000)
+
+or for every model, within a context:
+
+::
+
+    with identity_map(max_size=1000) as items:
+        post = BlogPost.objects.get(id=post_id)
+        post.author  # retrieved once per context
+
+    print items.stats()
+"""
+import functools
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+_context = threading.local()
+
+
+class IdentityMap(object):
+    """a thread-safe, size-bound mapping of redis keys to model
+    instances that evicts the least recently used items first.
+
+    **arguments**
+
+    * ``max_size`` - the maximum amount of items kept, defaults to ``1000``
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        """returns the instance stored in the given key or ``None``,
+        counting the hit or miss"""
+        with self.lock:
+            instance = self.items.pop(key, None)
+            if instance is None:
+                self.misses += 1
+                return
+
+            self.hits += 1
+            # re-insert so that it becomes the most recently used
+            self.items[key] = instance
+            return instance
+
+    def put(self, key, instance):
+        """stores the instance, evicting the least recently used
+        items when ``max_size`` is exceeded"""
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = instance
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def evict(self, key):
+        """removes the given key, if present"""
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """returns a dict with the ``hits``, ``misses``, ``size`` and ``max_size``"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.items),
+            'max_size': self.max_size,
+        }
+
+
+def propagate(func):
+    """returns the given function running, in another thread, within
+    the :py:func:`identity_map` contexts of the current thread"""
+    stack = getattr(_context, 'stack', None)
+    if not stack:
+        return func
+
+    stack = list(stack)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kw):
+        previous = getattr(_context, 'stack', None)
+        _context.stack = stack
+        try:
+            return func(*args, **kw)
+        finally:
+            _context.stack = previous
+
+    return wrapper
+
+
+def get_context_identity_map():
+    """returns the identity map of the innermost :py:func:`identity_map`
+    context of the current thread, if any"""
+    stack = getattr(_context, 'stack', None)
+    if stack:
+        return stack[-1]
+
+
+@contextmanager
+def identity_map(max_size=1000):
+    """enables an :py:class:`IdentityMap` for every model within the
+    context, in the current thread"""
+    if not hasattr(_context, 'stack'):
+        _context.stack = []
+
+    items = IdentityMap(max_size=max_size)
+    _context.stack.append(items)
+    try:
+        yield items
+    finally:
+        _context.stack.pop()
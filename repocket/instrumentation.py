@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""Measures how much redis work every repocket call does.
+
+The operations ``save``, ``delete``, ``get``, ``all``, ``filter``,
+``serialize`` and ``hydrate`` are reported to the registered hooks as
+an :py:class:`Operation`, with its duration, the redis commands it
+issued, the size of its pipelines and the bytes sent and received:
+
+::
+
+    from repocket import instrumentation
+
+    @instrumentation.add_hook
+    def send_to_statsd(operation):
+        statsd.timing('repocket.{0}.{1}'.format(operation.model_name, operation.name), operation.duration * 1000)
+        statsd.incr('repocket.{0}.commands'.format(operation.model_name), operation.commands)
+
+:py:class:`Stats` is a hook that keeps counters and histograms per
+model and operation, ready to be exported to Prometheus, for example:
+
+::
+
+    with instrumentation.collect_stats() as stats:
+        User.objects.filter(house_name='Gryffindor')
+
+    stats.snapshot()
+
+When no hook is registered the instrumented calls only check that the
+list of hooks is empty. The commands and bytes are counted by the
+connections of the pools created by
+:py:meth:`~repocket.connections.configure.connection_pool`.
+
+``all`` and ``filter`` are measured while the items are retrieved,
+excluding the time the caller spends between them. A single redis
+command is accounted to every operation running at the time, so
+``serialize`` and ``hydrate`` are also part of the ``save`` and
+``get`` that triggered them.
+"""
+import functools
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+import redis
+
+logger = logging.getLogger('repocket.instrumentation')
+
+# the registered hooks, see add_hook()
+hooks = []
+_context = threading.local()
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PIPELINE_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Operation(object):
+    """a single instrumented call, passed to every hook once it finishes.
+
+    * ``name`` - ``save``, ``delete``, ``get``, ``all``, ``filter``, ``serialize`` or ``hydrate``
+    * ``model`` - the model class
+    * ``duration`` - in seconds
+    * ``commands`` - the amount of redis commands issued
+    * ``round_trips`` - the amount of times commands were written to redis, a pipeline is a single round trip
+    * ``pipelines`` - a list with the amount of commands of every pipeline
+    * ``bytes_sent`` - the size of the commands written to redis
+    * ``bytes_received`` - the size of the values returned by redis, excluding the protocol framing
+    * ``items`` - the amount of items retrieved by ``all`` and ``filter``
+    * ``error`` - the exception raised by the call, if any
+
+    The counters are updated through :py:meth:`add`, which is safe to
+    call from the worker threads that run the call in parallel, see
+    :py:func:`propagate`.
+    """
+    def __init__(self, name, model):
+        self.lock = threading.Lock()
+        self.name = name
+        self.model = model
+        self.duration = 0.0
+        self.commands = 0
+        self.round_trips = 0
+        self.pipelines = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.items = 0
+        self.error = None
+
+    def add(self, commands=0, round_trips=0, bytes_sent=0, bytes_received=0, pipeline=None):
+        """accounts the given amounts of redis work to the operation"""
+        with self.lock:
+            self.commands += commands
+            self.round_trips += round_trips
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+            if pipeline is not None:
+                self.pipelines.append(pipeline)
+
+    @property
+    def model_name(self):
+        return self.model.__compound_name__
+
+    def __repr__(self):
+        return '<Operation {0} {1} {2:.6f}s {3} commands>'.format(self.model_name, self.name, self.duration, self.commands)
+
+
+def add_hook(hook):
+    """registers a callable that receives every :py:class:`Operation`,
+    returns the hook so that it can be used as a decorator"""
+    if hook not in hooks:
+        hooks.append(hook)
+
+    return hook
+
+
+def remove_hook(hook):
+    """unregisters the given hook"""
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+def _get_running():
+    running = getattr(_context, 'running', None)
+    if running is None:
+        running = _context.running = []
+
+    return running
+
+
+def _notify(operation):
+    for hook in list(hooks):
+        try:
+            hook(operation)
+        except Exception:
+            logger.exception('the instrumentation hook %r failed', hook)
+
+
+@contextmanager
+def measure(name, model):
+    """reports the operation of the code within the context to the
+    hooks, does nothing when there are none"""
+    if not hooks:
+        yield
+        return
+
+    operation = Operation(name, model)
+    running = _get_running()
+    running.append(operation)
+    started = default_timer()
+    try:
+        yield operation
+    except Exception as e:
+        operation.error = e
+        raise
+    finally:
+        operation.duration = default_timer() - started
+        running.remove(operation)
+        _notify(operation)
+
+
+def instrumented(name, get_model=type):
+    """decorates a method so that every call is reported as the given
+    operation, ``get_model`` takes ``self`` and returns the model class"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kw):
+            if not hooks:
+                return method(self, *args, **kw)
+
+            with measure(name, get_model(self)):
+                return method(self, *args, **kw)
+
+        return wrapper
+
+    return decorate
+
+
+def instrumented_function(name, model, func):
+    """returns the given function reporting every call as the given
+    operation of the given model"""
+    @functools.wraps(func)
+    def wrapper(*args, **kw):
+        if not hooks:
+            return func(*args, **kw)
+
+        with measure(name, model):
+            return func(*args, **kw)
+
+    return wrapper
+
+
+def instrumented_iterator(name, model, get_iterator):
+    """yields the items of the iterator returned by ``get_iterator()``
+    and reports a single operation with the time spent retrieving
+    them, once it is exhausted or closed"""
+    operation = Operation(name, model)
+    running = _get_running()
+    iterator = None
+    try:
+        while True:
+            running.append(operation)
+            started = default_timer()
+            try:
+                if iterator is None:
+                    iterator = iter(get_iterator())
+
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception as e:
+                operation.error = e
+                raise
+            finally:
+                operation.duration += default_timer() - started
+                running.remove(operation)
+
+            operation.items += 1
+            yield item
+    finally:
+        _notify(operation)
+
+
+def propagate(func):
+    """returns the given function accounting the redis commands that
+    it issues, in another thread, to the operations running in the
+    current thread"""
+    operations = list(_get_running())
+    if not operations:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kw):
+        previous = getattr(_context, 'running', None)
+        _context.running = list(operations)
+        try:
+            return func(*args, **kw)
+        finally:
+            _context.running = previous
+
+    return wrapper
+
+
+def _get_payload_size(response):
+    if isinstance(response, basestring):
+        return len(response)
+
+    if isinstance(response, (list, tuple)):
+        return sum([_get_payload_size(r) for r in response])
+
+    return 0
+
+
+class InstrumentedConnectionMixin(object):
+    """accounts the commands and bytes of the connection to every
+    operation running in the current thread"""
+    def send_command(self, *args):
+        if hooks:
+            for operation in _get_running():
+                operation.add(commands=1)
+
+        return super(InstrumentedConnectionMixin, self).send_command(*args)
+
+    def pack_commands(self, commands):
+        if hooks:
+            commands = list(commands)
+            for operation in _get_running():
+                operation.add(commands=len(commands), pipeline=len(commands))
+
+        return super(InstrumentedConnectionMixin, self).pack_commands(commands)
+
+    def send_packed_command(self, command):
+        if hooks:
+            running = _get_running()
+            if running:
+                size = sum([len(c) for c in isinstance(command, basestring) and [command] or command])
+                for operation in running:
+                    operation.add(round_trips=1, bytes_sent=size)
+
+        return super(InstrumentedConnectionMixin, self).send_packed_command(command)
+
+    def read_response(self):
+        response = super(InstrumentedConnectionMixin, self).read_response()
+        if hooks:
+            running = _get_running()
+            if running:
+                size = _get_payload_size(response)
+                for operation in running:
+                    operation.add(bytes_received=size)
+
+        return response
+
+
+class InstrumentedConnection(InstrumentedConnectionMixin, redis.Connection):
+    pass
+
+
+class InstrumentedUnixDomainSocketConnection(InstrumentedConnectionMixin, redis.UnixDomainSocketConnection):
+    pass
+
+
+class Histogram(object):
+    """counts the observed values per bucket, the buckets are the
+    inclusive upper bounds, like the histograms of Prometheus"""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        """returns the cumulative count of every bucket, the last one is ``+Inf``"""
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative.append((bound, total))
+
+        return {
+            'buckets': cumulative,
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class Stats(object):
+    """a hook that keeps, per model and operation, the counters
+    ``calls``, ``errors``, ``commands``, ``round_trips``, ``bytes_sent``,
+    ``bytes_received`` and ``items`` and the histograms ``duration``
+    and ``pipeline_size``.
+
+    ::
+
+        stats = instrumentation.add_hook(instrumentation.Stats())
+        ...
+        stats.snapshot()['myapp.models:User']['get']['counters']['commands']
+    """
+    COUNTERS = ('calls', 'errors', 'commands', 'round_trips', 'bytes_sent', 'bytes_received', 'items')
+
+    def __init__(self, duration_buckets=DURATION_BUCKETS, pipeline_size_buckets=PIPELINE_SIZE_BUCKETS):
+        self.duration_buckets = duration_buckets
+        self.pipeline_size_buckets = pipeline_size_buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """discards everything collected so far"""
+        with self.lock:
+            self.metrics = OrderedDict()
+
+    def _get_metrics(self, operation):
+        key = (operation.model_name, operation.name)
+        if key not in self.metrics:
+            self.metrics[key] = {
+                'counters': OrderedDict([(name, 0) for name in self.COUNTERS]),
+                'duration': Histogram(self.duration_buckets),
+                'pipeline_size': Histogram(self.pipeline_size_buckets),
+            }
+
+        return self.metrics[key]
+
+    def __call__(self, operation):
+        with self.lock:
+            metrics = self._get_metrics(operation)
+            counters = metrics['counters']
+            counters['calls'] += 1
+            counters['errors'] += operation.error is not None
+            counters['commands'] += operation.commands
+            counters['round_trips'] += operation.round_trips
+            counters['bytes_sent'] += operation.bytes_sent
+            counters['bytes_received'] += operation.bytes_received
+            counters['items'] += operation.items
+            metrics['duration'].observe(operation.duration)
+            for size in operation.pipelines:
+                metrics['pipeline_size'].observe(size)
+
+    def snapshot(self):
+        """returns a dict of model names to a dict of operation names
+        to the counters and histograms"""
+        result = OrderedDict()
+        with self.lock:
+            for (model_name, name), metrics in self.metrics.items():
+                result.setdefault(model_name, OrderedDict())[name] = {
+                    'counters': dict(metrics['counters']),
+                    'duration': metrics['duration'].to_dict(),
+                    'pipeline_size': metrics['pipeline_size'].to_dict(),
+                }
+
+        return result
+
+
+@contextmanager
+def collect_stats(stats=None):
+    """registers a :py:class:`Stats` hook within the context"""
+    stats = add_hook(stats or Stats())
+    try:
+        yield stats
+    finally:
+        remove_hook(stats)
@@ -1,20 +1,682 @@
 # -*- coding: utf-8 -*-
 
+import copy
+import json
+import base64
 import logging
+import uuid
+from functools import partial
+from itertools import chain, islice
+from operator import attrgetter
+from collections import OrderedDict
 
-from repocket.connections import configure
-from repocket.attributes import Attribute
+from repocket import background, instrumentation, scripting
+from repocket.attributes import Pointer, Reference
+from repocket.batch import RecordBatch
+from repocket.connections import configure, get_database
+from repocket.codecs import decode_value
+from repocket.compression import unpack_stream
+from repocket.identity import IdentityMap, get_context_identity_map
+from repocket.readcache import get_read_cache
+from repocket.util import parse_lookup, RANGE_OPERATORS
 
 logger = logging.getLogger('repocket.manager')
 
 
+def save_many(instances, batch_size=100, transaction=True, force=False, connection=None):
+    """Persists many model instances, possibly of different models,
+    writing ``batch_size`` instances per pipeline. Returns a list with
+    the redis keys of every instance, just like
+    :py:meth:`~repocket.model.ActiveRecord.save` does.
+    ::
+
+        save_many([User(email='foo@bar.com'), User(email='bar@foo.com')], batch_size=500)
+
+    **arguments**
+
+    * ``instances`` - an iterable of :py:class:`~repocket.model.ActiveRecord` instances
+    * ``batch_size`` - the amount of instances written per pipeline, defaults to ``100``
+    * ``transaction`` - wraps every pipeline in ``MULTI``/``EXEC``, defaults to ``True``
+    * ``force`` - writes all the attributes, even the ones that did not change
+    * ``connection`` - writes all the instances with the given connection
+      instead of the connection pool of each instance, see
+      :py:meth:`~repocket.model.ActiveRecord.get_alias`
+    """
+    instances = list(instances)
+    results = {}
+    for start in range(0, len(instances), batch_size):
+        batch = instances[start:start + batch_size]
+        fields = {}
+        nodes = OrderedDict()
+        for instance in batch:
+            instance._set_primary_key()
+            fields[id(instance)] = instance._get_fields_to_save(force)
+            conn = connection or instance._get_connection()
+            nodes.setdefault(id(conn), (conn, []))[1].append(instance)
+
+        for conn, node_batch in nodes.values():
+            stored_index_keys = _get_stored_index_keys_in_batch(node_batch, fields, conn)
+            pipeline = conn.pipeline(transaction=transaction)
+            for instance in node_batch:
+                index_keys = stored_index_keys.get(id(instance), [])
+                results[id(instance)] = instance._save_to_pipeline(pipeline, index_keys, fields[id(instance)])
+
+            pipeline.execute()
+
+        for instance in batch:
+            instance._mark_as_persisted()
+            instance._invalidate_read_cache()
+            instance._update_identity_map()
+
+    return [results[id(instance)] for instance in instances]
+
+
+def prefetch(instances, *names):
+    """Retrieves the items referenced by the given
+    :py:class:`~repocket.attributes.Pointer` attributes of all the
+    instances at once: every distinct item is loaded a single time,
+    through pipelined batches, instead of one round-trip per instance.
+    """
+    references = OrderedDict()
+    for instance in instances:
+        for name in names:
+            field = instance.__fields__.get(name)
+            if not isinstance(field, Pointer):
+                raise AttributeError('{0} is not a Pointer attribute of {1}'.format(name, instance.__compound_name__))
+
+            reference = instance._get_reference(name)
+            if isinstance(reference, Reference):
+                key = reference._calculate_hash_key()
+                references.setdefault(key, (reference.model, []))[1].append((instance, name))
+
+    keys_by_model = OrderedDict()
+    for key, (model, _) in references.items():
+        keys_by_model.setdefault(model, []).append(key)
+
+    for model, keys in keys_by_model.items():
+        items = dict([(i._calculate_hash_key(), i) for i in model.objects.get_items_from_redis_keys(keys)])
+        for key in keys:
+            for instance, name in references[key][1]:
+                # resolving a pointer does not change it, see PointerDescriptor
+                instance.__dict__[name] = items.get(key)
+
+    return instances
+
+
+class ResultSet(list):
+    """The list of items returned by :py:meth:`ActiveRecordManager.all`
+    and :py:meth:`ActiveRecordManager.filter`"""
+
+    def prefetch(self, *names):
+        """retrieves the items referenced by the given
+        :py:class:`~repocket.attributes.Pointer` attributes at once,
+        see :py:func:`prefetch`
+        ::
+
+            posts = BlogPost.objects.filter(title='Hello').prefetch('author')
+        """
+        prefetch(self, *names)
+        return self
+
+    def count(self, *args):
+        """returns the amount of items, or the amount of occurrences
+        of the given item"""
+        if args:
+            return super(ResultSet, self).count(*args)
+
+        return len(self)
+
+    def order_by(self, *names):
+        """returns a new :py:class:`ResultSet` sorted in python by the
+        given attributes, prefix the name with ``-`` for descending
+        order
+        ::
+
+            User.objects.filter(house_name='Gryffindor').order_by('-name')
+        """
+        results = ResultSet(self)
+        for name in reversed(names):
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            results.sort(key=lambda item: item.get(name), reverse=descending)
+
+        return results
+
+
+class Page(ResultSet):
+    """The list of items returned by :py:meth:`ActiveRecordManager.page`,
+    ``next_cursor`` is ``None`` in the last page"""
+    next_cursor = None
+
+
+class QuerySet(object):
+    """A lazy, chainable query over the items of a model, returned by
+    :py:meth:`ActiveRecordManager.all` and :py:meth:`ActiveRecordManager.filter`.
+
+    Nothing is retrieved from redis until the query is iterated,
+    indexed, measured or compared. The lookups, ordering, slices and
+    field selection are then turned into the cheapest plan available:
+
+    * lookups of indexed attributes intersect the indexes and only the
+      matching items are retrieved
+    * ordering by a range index retrieves only the items of the slice
+    * otherwise the keyspace is walked with ``SCAN``, batch by batch,
+      and stops as soon as the slice is complete
+
+    ::
+
+        recent = BlogPost.objects.filter(author=user).order_by('-created_at')
+        recent.first()
+        recent[:10]
+        recent.count()
+
+    Iterating streams the items and keeps them once the iteration
+    finishes, so the query is evaluated only once.
+    """
+    def __init__(self, manager, connection=None):
+        self.manager = manager
+        self.connection = connection
+        self.lookups = {}
+        self.ordering = ()
+        self.start = 0
+        self.stop = None
+        self._result_cache = None
+
+    def _clone(self, **options):
+        clone = copy.copy(self)
+        clone.lookups = dict(self.lookups)
+        clone._result_cache = None
+        for name, value in options.items():
+            setattr(clone, name, value)
+
+        return clone
+
+    def _is_sliced(self):
+        return self.start > 0 or self.stop is not None
+
+    def _check_not_sliced(self, operation):
+        if self._is_sliced():
+            raise TypeError('cannot call {0}() once a slice has been taken'.format(operation))
+
+    def all(self):
+        """returns a copy of the query"""
+        return self._clone()
+
+    def filter(self, **kw):
+        """returns a query that also matches all the given lookups,
+        see :py:meth:`ActiveRecordManager.filter`"""
+        self._check_not_sliced('filter')
+        self.manager._validate_lookups(kw)
+
+        clone = self._clone()
+        clone.lookups.update(kw)
+        return clone
+
+    def order_by(self, *names):
+        """returns a query ordered by the given attributes, prefix the
+        name with ``-`` for descending order.
+
+        A single attribute declared with ``index='range'`` is ordered by
+        redis, any other ordering happens in python after all the
+        matching items were retrieved.
+        """
+        self._check_not_sliced('order_by')
+        self.manager._validate_field_names([n.lstrip('-') for n in names])
+        manager = self.manager._clone(ordering=None)
+        if len(names) == 1 and names[0].lstrip('-') in self.manager.model.__range_indexes__:
+            return self._clone(manager=manager.order_by(names[0]), ordering=())
+
+        return self._clone(manager=manager, ordering=names)
+
+    def only(self, *names):
+        """see :py:meth:`ActiveRecordManager.only`"""
+        return self._clone(manager=self.manager.only(*names))
+
+    def defer(self, *names):
+        """see :py:meth:`ActiveRecordManager.defer`"""
+        return self._clone(manager=self.manager.defer(*names))
+
+    def using(self, alias):
+        """see :py:meth:`ActiveRecordManager.using`"""
+        return self._clone(manager=self.manager.using(alias))
+
+    def prefetch(self, *names):
+        """retrieves the items and the items referenced by the given
+        :py:class:`~repocket.attributes.Pointer` attributes, see
+        :py:func:`prefetch`"""
+        prefetch(self._fetch_all(), *names)
+        return self
+
+    def first(self):
+        """returns the first item or ``None``, retrieving only that item"""
+        if self._result_cache is not None:
+            return self._result_cache and self._result_cache[0] or None
+
+        for item in self[:1]:
+            return item
+
+    def count(self):
+        """returns the amount of matching items, answered by the
+        indexes whenever possible, see :py:meth:`ActiveRecordManager.count`"""
+        if self._result_cache is not None:
+            return len(self._result_cache)
+
+        if self.manager.ordering is not None or self.ordering:
+            # ordering skips the items without value
+            return len(self._fetch_all())
+
+        total = self.manager.count(**self.lookups)
+        total = max(total - self.start, 0)
+        if self.stop is not None:
+            total = max(0, min(total, self.stop - self.start))
+
+        return total
+
+    def exists(self):
+        """returns ``True`` when at least one item matches"""
+        return self.first() is not None
+
+    def iterator(self, batch_size=None):
+        """streams the matching items without keeping them"""
+        return self._iter_results(batch_size)
+
+    def as_batch(self, *names):
+        """returns a :py:class:`~repocket.batch.RecordBatch` with the
+        given attributes, all of them by default, of the matching
+        items. The items are streamed into the batch, only the
+        instances of the current batch of every node are alive at a
+        time.
+        ::
+
+            batch = Build.objects.filter(status='failed').as_batch('id', 'duration')
+            total = sum(batch.column('duration'))
+
+        """
+        query = names and self.only(*names) or self
+        if query._result_cache is not None:
+            items = query._result_cache
+        else:
+            items = query.iterator()
+
+        return RecordBatch.from_items(self.manager.model, items, names, self.manager.get_alias())
+
+    def __iter__(self):
+        if self._result_cache is not None:
+            return iter(self._result_cache)
+
+        return self._iter_and_cache()
+
+    def _iter_and_cache(self):
+        if self._result_cache is not None:
+            # evaluated since the iterator was created, by len() for example
+            for item in self._result_cache:
+                yield item
+
+            return
+
+        results = ResultSet()
+        for item in self._iter_results():
+            results.append(item)
+            yield item
+
+        self._result_cache = results
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            for _ in self:
+                pass
+
+        return self._result_cache
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __nonzero__(self):
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+
+        return self.exists()
+
+    def __eq__(self, other):
+        if isinstance(other, (QuerySet, list)):
+            return list(self._fetch_all()) == list(other)
+
+        return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._fetch_all())
+
+    def __getitem__(self, index):
+        if self._result_cache is not None:
+            return self._result_cache[index]
+
+        if not isinstance(index, slice):
+            if index < 0:
+                return self._fetch_all()[index]
+
+            for item in self[index:index + 1]:
+                return item
+
+            raise IndexError('{0} index out of range'.format(self.manager.model.__compound_name__))
+
+        start, stop = index.start or 0, index.stop
+        if index.step not in (None, 1) or start < 0 or (stop is not None and stop < 0):
+            return ResultSet(self._fetch_all()[index])
+
+        if stop is not None:
+            stop = self.start + stop
+
+        if self.stop is not None:
+            stop = self.stop if stop is None else min(stop, self.stop)
+
+        return self._clone(start=self.start + start, stop=stop)
+
+    def _get_manager(self):
+        # the filtered and ordered attributes must be retrieved to be compared
+        names = [parse_lookup(k)[0] for k in self.lookups] + [n.lstrip('-') for n in self.ordering]
+        return self.manager._with_loaded_fields(names)
+
+    def _iter_results(self, batch_size=None):
+        if not instrumentation.hooks:
+            return self._plan_results(batch_size)
+
+        name = self.lookups and 'filter' or 'all'
+        return instrumentation.instrumented_iterator(name, self.manager.model, partial(self._plan_results, batch_size))
+
+    def _plan_results(self, batch_size=None):
+        manager = self._get_manager()
+        batch_size = batch_size or manager.batch_size
+        indexed_lookups = manager._get_indexed_lookups(self.lookups)
+
+        if self.ordering:
+            results = ResultSet(self._iter_matching(manager, indexed_lookups, batch_size))
+            return iter(results.order_by(*self.ordering)[self.start:self.stop])
+
+        if indexed_lookups:
+            return self._iter_from_indexes(manager, indexed_lookups, batch_size)
+
+        if manager.ordering is not None and not self.lookups and self._is_sliced():
+            stop = self.stop is None and -1 or self.stop - 1
+            ids = manager._get_ordered_ids(self.start, stop, self.connection)
+            return self._iter_from_ids(manager, [i for i, _ in ids], batch_size)
+
+        if not self.lookups and not self._is_sliced() and manager.ordering is None:
+            # everything: retrieve a batch of every node at a time, in parallel
+            connections = manager._get_connections(self.connection)
+            return background.iter_interleaved([manager._iter_batches([conn], batch_size) for conn in connections])
+
+        return islice(self._iter_matching(manager, [], batch_size), self.start, self.stop)
+
+    def _iter_matching(self, manager, indexed_lookups, batch_size):
+        arguments = not indexed_lookups and manager.ordering is None and manager._get_script_arguments(self.lookups)
+        if indexed_lookups:
+            items = self._iter_from_ids(manager, self._get_ids_from_indexes(manager, indexed_lookups), batch_size)
+        elif arguments:
+            # the lookups are compared by redis, python checks them again
+            items = manager._iter_scripted(arguments, batch_size, self.connection)
+        else:
+            items = manager.iterator(batch_size=batch_size, connection=self.connection)
+
+        for item in items:
+            if item is not None and item.matches(self.lookups):
+                yield item
+
+    def _iter_from_indexes(self, manager, indexed_lookups, batch_size):
+        if len(indexed_lookups) < len(self.lookups):
+            # some lookups can only be compared in python
+            return islice(self._iter_matching(manager, indexed_lookups, batch_size), self.start, self.stop)
+
+        ids = self._get_ids_from_indexes(manager, indexed_lookups)[self.start:self.stop]
+        # the indexes are read before the items, python checks them again
+        return (item for item in self._iter_from_ids(manager, ids, batch_size) if item is not None and item.matches(self.lookups))
+
+    def _iter_from_ids(self, manager, ids, batch_size):
+        for start in range(0, len(ids), batch_size):
+            for item in manager._get_items_from_ids(ids[start:start + batch_size], self.connection):
+                yield item
+
+    def _get_ids_from_indexes(self, manager, lookups):
+        """returns the matching primary keys of every node, sorted by
+        the ordering of the manager or by the first range lookup"""
+        model = manager.model
+        ordering = manager.ordering
+        ranges = manager._get_score_ranges(lookups)
+        if ordering is None and ranges:
+            ordering = (ranges[0][0], False)
+
+        def get_ids(conn):
+            ids = manager._get_ids_from_indexes(lookups, conn)
+            if ordering is None:
+                return ids
+
+            key = model._calculate_range_index_key(ordering[0])
+            pipeline = conn.pipeline(transaction=False)
+            for i in ids:
+                pipeline.zscore(key, i)
+
+            return [(i, score) for i, score in zip(ids, pipeline.execute()) if score is not None]
+
+        results = manager._fan_out(get_ids, self.connection)
+        if ordering is None:
+            return list(chain.from_iterable(results))
+
+        ordered = sorted(chain.from_iterable(results), key=lambda item: (item[1], item[0]), reverse=ordering[1])
+        return [i for i, _ in ordered]
+
+
+class TemporaryKeys(object):
+    """a pipeline that queues the commands of the wrapped pipeline
+    with the given prefix added to their key, used by
+    :py:meth:`ActiveRecordManager.reindex`"""
+    def __init__(self, pipeline, prefix):
+        self.pipeline = pipeline
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        command = getattr(self.pipeline, name)
+
+        def call(key, *args, **kw):
+            command(self.prefix + key, *args, **kw)
+            return self
+
+        return call
+
+
+def _get_stored_index_keys_in_batch(instances, fields, conn):
+    """retrieves the currently stored index keys of all the given
+    instances through a single pipeline, returns a dict keyed by the
+    ``id()`` of each instance"""
+    indexed = [i for i in instances if i._get_indexes_to_update(fields[id(i)])]
+    if not indexed:
+        return {}
+
+    pipeline = conn.pipeline(transaction=False)
+    for instance in indexed:
+        pipeline.hmget(instance._calculate_hash_key(), instance._get_indexes_to_update(fields[id(instance)]))
+
+    results = {}
+    for instance, stored_values in zip(indexed, pipeline.execute()):
+        results[id(instance)] = instance._parse_stored_index_keys(stored_values, fields[id(instance)])
+
+    return results
+
+
 class ActiveRecordManager(object):
-    def __init__(self, model):
+    """Retrieves the items of the adopted model from redis.
+
+    Items are always loaded in batches of ``batch_size`` keys, each
+    batch costs a single round-trip because all the ``HGETALL`` and
+    ``GET`` commands of the batch are sent through one pipeline.
+    """
+    batch_size = 100
+    identity_map = None
+    deferred_fields = frozenset()
+    alias = None
+    ordering = None
+    server_side_filtering = True
+
+    def __init__(self, model, batch_size=None):
         self.model = model
+        self.batch_size = batch_size or self.batch_size
+
+    def _clone(self, **options):
+        """returns a copy of the manager with the given options"""
+        clone = copy.copy(self)
+        for name, value in options.items():
+            setattr(clone, name, value)
+
+        return clone
+
+    def using(self, alias):
+        """Returns a manager that reads from the connection pool with
+        the given alias, see :py:class:`~repocket.connections.configure`.
+        The retrieved items are saved through the same pool.
+        ::
+
+            Session.objects.using('sessions').get(session_id)
+        """
+        return self._clone(alias=alias)
+
+    def get_alias(self):
+        """returns the alias of the connection pool in use"""
+        return self.alias or self.model.__using__
+
+    def _get_connection(self, key=None):
+        """returns the connection to the node that stores the given
+        key, see :py:mod:`repocket.sharding`"""
+        return configure.get_connection(self.get_alias(), key)
+
+    def _get_connections(self, connection=None):
+        """returns the given connection or the connections to every node"""
+        if connection is not None:
+            return [connection]
+
+        return configure.get_connections(self.get_alias())
+
+    def _route(self, keys, connection=None):
+        """groups the given keys by the node that stores them, returns
+        a list of tuples ``(connection, keys)``"""
+        if connection is not None or configure.get_ring(self.get_alias()) is None:
+            return [(connection or self._get_connection(), list(keys))]
+
+        nodes = OrderedDict()
+        for key in keys:
+            nodes.setdefault(configure.get_node(self.get_alias(), key), []).append(key)
+
+        return [(configure.get_connection(node), node_keys) for node, node_keys in nodes.items()]
+
+    def _fan_out(self, func, connection=None):
+        """calls the function with the connection of every node, in
+        parallel when there is more than one, returns the list of results"""
+        return background.map_all(func, self._get_connections(connection))
+
+    def _validate_field_names(self, names):
+        for name in names:
+            if name not in self.model.__fields__:
+                msg = '"{0}" is not a field of the model {1}, options are {2}'
+                raise AttributeError(msg.format(name, self.model.__compound_name__, self.model.__fields__.keys()))
+
+    def _validate_lookups(self, kw):
+        """checks that the given ``filter()`` keyword arguments target
+        existing fields and that the range lookups only target the
+        attributes that can be scored"""
+        for lookup in kw:
+            name, operator = parse_lookup(lookup)
+            self._validate_field_names([name])
+            field = self.model.__fields__[name]
+            if operator in RANGE_OPERATORS and not field.__range_index__:
+                msg = 'the lookup "{0}" is not supported by the {1} attribute "{2}" of the model {3}'
+                raise ValueError(msg.format(lookup, type(field).__name__, name, self.model.__compound_name__))
+
+    def only(self, *names):
+        """Returns a manager that retrieves only the given attributes,
+        the primary key is always retrieved. The other attributes are
+        retrieved the first time they are accessed.
+        ::
+
+            for post in BlogPost.objects.only('title', 'created_at').all():
+                print post.title
+
+        """
+        self._validate_field_names(names)
+        deferred = set(self.model.__fields__.keys()).difference(names)
+        deferred.discard(self.model.__primary_key__)
+        return self._clone(deferred_fields=frozenset(deferred))
+
+    def defer(self, *names):
+        """Returns a manager that does not retrieve the given
+        attributes until they are accessed.
+        ::
+
+            for post in BlogPost.objects.defer('body').all():
+                print post.title
+
+        """
+        self._validate_field_names(names)
+        deferred = self.deferred_fields.union(names)
+        return self._clone(deferred_fields=deferred.difference([self.model.__primary_key__]))
+
+    def _with_loaded_fields(self, names):
+        """returns a manager that retrieves the given attributes"""
+        if not self.deferred_fields.intersection(names):
+            return self
+
+        return self._clone(deferred_fields=self.deferred_fields.difference(names))
+
+    def use_identity_map(self, max_size=1000):
+        """Keeps up to ``max_size`` retrieved items of the adopted model
+        in an :py:class:`~repocket.identity.IdentityMap`, pass
+        ``max_size=0`` to disable it. Returns the identity map.
+        """
+        self.identity_map = None
+        if max_size:
+            self.identity_map = IdentityMap(max_size=max_size)
+
+        return self.identity_map
+
+    def get_identity_map(self):
+        """returns the identity map in use: the one of the current
+        :py:func:`~repocket.identity.identity_map` context or the one
+        enabled with :py:meth:`use_identity_map`"""
+        identity_map = get_context_identity_map()
+        if identity_map is None:
+            identity_map = self.identity_map
+
+        return identity_map
 
     def create(self, **kwargs):
         return self.model.create(**kwargs)
 
+    def bulk_create(self, instances, batch_size=None, transaction=True, force=False, connection=None):
+        """Persists many instances of the adopted model with one
+        pipeline per ``batch_size`` instances, returns the instances.
+        ::
+
+            User.objects.bulk_create([User(email='foo@bar.com'), User(email='bar@foo.com')])
+
+        """
+        instances = list(instances)
+        for instance in instances:
+            if not isinstance(instance, self.model):
+                raise TypeError('{0} is not an instance of {1}'.format(instance, self.model.__compound_name__))
+
+        if self.alias:
+            for instance in instances:
+                instance._using = self.alias
+
+        save_many(
+            instances,
+            batch_size=batch_size or self.batch_size,
+            transaction=transaction,
+            force=force,
+            connection=connection,
+        )
+        return instances
+
+    @instrumentation.instrumented('get', get_model=attrgetter('model'))
     def get(self, id):
         instance = self.model()
         instance.set(instance.__primary_key__, id)
@@ -24,12 +686,235 @@ class ActiveRecordManager(object):
         return self.get_item_from_redis_key(redis_key)
 
     def filter(self, **kw):
-        all_results = self.all()
-        results = [i for i in all_results if i is not None and i.matches(kw)]
-        return results
+        """Returns a lazy :py:class:`QuerySet` of the items that match
+        all the given lookups.
+
+        When any of the lookups targets an attribute declared with
+        ``index=True`` the candidates are retrieved from the secondary
+        indexes, otherwise every item is loaded and compared in python.
+        ::
+
+            class User(ActiveRecord):
+                email = attributes.Unicode(index=True)
+                name = attributes.Unicode()
+
+            User.objects.filter(email='foo@bar.com')
+            User.objects.filter(email__in=['foo@bar.com', 'bar@foo.com'], name='Foo')
+
+        Attributes declared with ``index='range'`` support the lookups
+        ``__gt``, ``__gte``, ``__lt`` and ``__lte`` through their sorted
+        set, and the items are returned in the order of the first of
+        them:
+        ::
+
+            class BlogPost(ActiveRecord):
+                created_at = attributes.DateTime(index='range')
+
+            BlogPost.objects.filter(created_at__gte=an_hour_ago, created_at__lt=now)
+
+        The range lookups of the attributes without a range index are
+        compared in python, only ``Integer``, ``Float``, ``Decimal`` and
+        ``DateTime`` attributes support them, any other raises
+        ``ValueError``.
+        """
+        return QuerySet(self).filter(**kw)
+
+    def aget(self, id):
+        """Same as :py:meth:`get` but runs in a worker thread, returns
+        an :py:class:`~multiprocessing.pool.AsyncResult`, see
+        :py:mod:`repocket.background`"""
+        return background.submit(self.get, id)
+
+    def afilter(self, **kw):
+        """Same as :py:meth:`filter` but runs in a worker thread, returns
+        an :py:class:`~multiprocessing.pool.AsyncResult` of the
+        :py:class:`ResultSet`"""
+        return background.submit(lambda: self.filter(**kw)._fetch_all())
+
+    def _get_indexed_lookups(self, kw):
+        lookups = []
+        for lookup, value in sorted(kw.items()):
+            name, operator = parse_lookup(lookup)
+            if name in self.model.__indexes__ and operator in ('exact', 'in'):
+                lookups.append((name, operator, value))
+            elif name in self.model.__range_indexes__ and operator in RANGE_OPERATORS + ('exact',) and value is not None:
+                lookups.append((name, operator, value))
+
+        return lookups
+
+    def _get_score_ranges(self, lookups):
+        """returns a list of tuples ``(name, min, max)`` with the
+        ``ZRANGEBYSCORE`` boundaries of the range lookups"""
+        bounds = OrderedDict()
+        for name, operator, value in lookups:
+            if name not in self.model.__range_indexes__:
+                continue
+
+            score = self.model.__range_indexes__[name].to_score(value)
+            lower, upper = bounds.setdefault(name, ([], []))
+            if operator in ('gt', 'gte', 'exact'):
+                lower.append((score, operator == 'gt'))
+            if operator in ('lt', 'lte', 'exact'):
+                upper.append((score, operator != 'lt'))
+
+        ranges = []
+        for name, (lower, upper) in bounds.items():
+            minimum = maximum = None
+            if lower:
+                # the highest lower bound, exclusive wins on ties
+                score, exclusive = max(lower)
+                minimum = '{0}{1!r}'.format(exclusive and '(' or '', score)
+            if upper:
+                # the lowest upper bound, exclusive wins on ties
+                score, inclusive = min(upper)
+                maximum = '{0}{1!r}'.format(not inclusive and '(' or '', score)
+
+            ranges.append((name, minimum or '-inf', maximum or '+inf'))
+
+        return ranges
+
+    def _get_ids_from_indexes(self, lookups, conn):
+        """returns the primary keys that match all the given lookups,
+        in the order of the first range lookup, if any"""
+        ranges = self._get_score_ranges(lookups)
+        exact_keys = []
+        unions = []
+        for name, operator, value in lookups:
+            if name in self.model.__range_indexes__:
+                continue
+            elif operator == 'in':
+                unions.append([self.model._calculate_index_key(name, v) for v in value])
+            else:
+                exact_keys.append(self.model._calculate_index_key(name, value))
+
+        if not all(unions):
+            # an empty ``__in`` lookup can never match
+            return []
+
+        pipeline = conn.pipeline()
+        if exact_keys:
+            pipeline.sinter(*exact_keys)
+
+        for keys in unions:
+            pipeline.sunion(*keys)
+
+        for name, minimum, maximum in ranges:
+            pipeline.zrangebyscore(self.model._calculate_range_index_key(name), minimum, maximum)
+
+        results = pipeline.execute()
+        if ranges:
+            # keep the order of the first sorted set
+            set_results = results[:len(results) - len(ranges)]
+            range_results = results[len(results) - len(ranges):]
+            ordered_ids = range_results[0]
+            other_ids = [set(r) for r in set_results + range_results[1:]]
+            if other_ids:
+                allowed_ids = reduce(set.intersection, other_ids)
+                ordered_ids = [i for i in ordered_ids if i in allowed_ids]
+
+            matching_ids = ordered_ids
+        else:
+            matching_ids = reduce(set.intersection, results)
+
+        return list(matching_ids)
+
+    def count(self, **kw):
+        """Returns the amount of items that match all the given
+        lookups, or of all the items when no lookup is given.
+        ::
+
+            User.objects.count()
+            User.objects.count(house_name='Gryffindor')
+
+        When every lookup targets an indexed attribute the items are
+        counted through the indexes, without retrieving them.
+
+        .. note:: items stored before the model had a membership set
+                  are only counted after calling :py:meth:`reindex`
+        """
+        self._validate_lookups(kw)
+        if not kw:
+            key = self.model._calculate_members_key()
+            return sum(self._fan_out(lambda conn: conn.scard(key)))
+
+        lookups = self._get_indexed_lookups(kw)
+        if len(lookups) == len(kw):
+            return sum(self._fan_out(lambda conn: self._count_from_indexes(lookups, conn)))
+
+        return len(self.filter(**kw))
+
+    def _count_from_indexes(self, lookups, conn):
+        if len(lookups) == 1:
+            name, operator, value = lookups[0]
+            if name in self.model.__range_indexes__:
+                _, minimum, maximum = self._get_score_ranges(lookups)[0]
+                return conn.zcount(self.model._calculate_range_index_key(name), minimum, maximum)
+
+            if operator == 'exact':
+                return conn.scard(self.model._calculate_index_key(name, value))
+
+        return len(self._get_ids_from_indexes(lookups, conn))
+
+    def exists(self, id):
+        """Returns ``True`` when an item with the given primary key is
+        stored in redis, without retrieving it"""
+        key = ':'.join([self.model._static_key_prefix(), str(id)])
+        return bool(self._get_connection(key).exists(key))
+
+    def reindex(self, connection=None):
+        """Rebuilds the secondary indexes of the model from scratch,
+        useful after adding ``index=True`` to an attribute of a model
+        that already has data stored in redis.
+
+        The indexes are written into temporary keys, a pipeline per
+        :py:attr:`batch_size` items, and then renamed over the current
+        ones, so that the existing indexes keep working meanwhile and
+        neither the client nor redis buffer the whole keyspace.
+        """
+        search_pattern = ':'.join([self.model._static_index_prefix(), '*'])
+        for conn in self._get_connections(connection):
+            prefix = b'repocket-reindex:{0}:'.format(uuid.uuid4().hex)
+            items = (item for item in self.iterator(connection=conn) if item is not None)
+            while True:
+                batch = list(islice(items, self.batch_size))
+                if not batch:
+                    break
+
+                pipeline = conn.pipeline(transaction=False)
+                for instance in batch:
+                    instance._update_indexes(TemporaryKeys(pipeline, prefix), [])
+
+                pipeline.execute()
+
+            for keys in self._scan_pattern(conn, search_pattern):
+                # the indexes without items
+                pipeline = conn.pipeline(transaction=False)
+                for key in keys:
+                    pipeline.exists(prefix + key)
+
+                stale_keys = [key for key, rebuilt in zip(keys, pipeline.execute()) if not rebuilt]
+                if stale_keys:
+                    conn.delete(*stale_keys)
+
+            for keys in self._scan_pattern(conn, prefix + b'*'):
+                pipeline = conn.pipeline(transaction=False)
+                for key in keys:
+                    pipeline.rename(key, key[len(prefix):])
+
+                pipeline.execute()
+
+    def _scan_pattern(self, conn, pattern):
+        """yields the keys that match the given pattern in batches, one
+        batch per ``SCAN`` call"""
+        cursor = None
+        while cursor != 0:
+            cursor, keys = conn.scan(cursor or 0, match=pattern, count=self.batch_size)
+            if keys:
+                yield keys
 
     def all(self, connection=None):
-        """Lists all items in redis, returns instances of the adopted model.
+        """Returns a lazy :py:class:`QuerySet` of all the items of the
+        adopted model.
         ::
 
             class BlogPost(ActiveRecord):
@@ -40,41 +925,482 @@ class ActiveRecordManager(object):
            BlogPost.objects.all()
 
         """
-        conn = connection or configure.get_connection()
+        return QuerySet(self, connection=connection)
+
+    def first(self):
+        """returns the first item or ``None``, see :py:meth:`QuerySet.first`"""
+        return self.all().first()
+
+    def as_batch(self, *names):
+        """returns all the items in a :py:class:`~repocket.batch.RecordBatch`,
+        see :py:meth:`QuerySet.as_batch`"""
+        return self.all().as_batch(*names)
+
+    def iterator(self, batch_size=None, connection=None):
+        """Lazily yields all the items of the adopted model, walking the
+        keyspace with ``SCAN`` so that neither the redis server nor the
+        python process have to hold all the keys at once.
+        ::
+
+            for post in BlogPost.objects.iterator(batch_size=500):
+                print post.title
+
+        **arguments**
+
+        * ``batch_size`` - the ``COUNT`` hint passed to every ``SCAN``
+          call and the amount of items retrieved per pipeline,
+          defaults to :py:attr:`ActiveRecordManager.batch_size`
+
+        .. note:: ``SCAN`` might return the same key more than once
+                  when the keyspace is rehashed during the iteration.
+                  Managers returned by :py:meth:`order_by` walk the
+                  sorted set instead, page by page.
+        """
+        batch_size = batch_size or self.batch_size
+        if self.ordering is not None:
+            for page in self._iter_pages(batch_size, connection):
+                for item in page:
+                    yield item
+
+            return
+
+        for conn in self._get_connections(connection):
+            for keys in self._scan_keys(conn, batch_size):
+                for item in self._iter_items_from_redis_keys(keys, batch_size, conn):
+                    yield item
+
+    iter_all = iterator
+
+    def aall(self, batch_size=None, connection=None):
+        """Same as :py:meth:`iterator` but retrieves the next batch of
+        items in a worker thread while the current batch is consumed.
+        ::
+
+            for post in BlogPost.objects.aall(batch_size=500):
+                print post.title
+        """
+        batch_size = batch_size or self.batch_size
+        if self.ordering is not None:
+            return background.iter_ahead(self._iter_pages(batch_size, connection))
+
+        return background.iter_ahead(self._iter_batches(self._get_connections(connection), batch_size))
+
+    def _iter_pages(self, batch_size, connection=None):
+        """yields the pages of an ordered manager"""
+        cursor = None
+        while True:
+            page = self._get_page(cursor, batch_size, connection)
+            yield page
+            cursor = page.next_cursor
+            if cursor is None:
+                return
+
+    def _iter_batches(self, connections, batch_size):
+        for conn in connections:
+            for keys in self._scan_keys(conn, batch_size):
+                yield list(self._iter_items_from_redis_keys(keys, batch_size, conn))
+
+    def order_by(self, name):
+        """Returns a manager that retrieves the items ordered by the
+        given attribute, which must be declared with
+        ``index='range'``. Prefix the name with ``-`` for descending
+        order. Items whose value is ``None`` are not part of the index
+        and are skipped.
+        ::
+
+            recent = BlogPost.objects.order_by('-created_at')
+            recent[0]
+            recent[20:40]
+            recent.page(size=50)
+        """
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name not in self.model.__range_indexes__:
+            msg = '"{0}" must be declared with index=\'range\' to order {1} by it'
+            raise AttributeError(msg.format(name, self.model.__compound_name__))
+
+        return self._clone(ordering=(name, descending))
+
+    def _get_ordering(self):
+        if self.ordering is None:
+            raise TypeError('{0} items must be ordered through order_by() first'.format(self.model.__compound_name__))
+
+        return self.ordering
+
+    def __iter__(self):
+        return self.iterator()
+
+    def __getitem__(self, index):
+        """Retrieves only the items in the given position of the
+        sorted set of an ordered manager, see :py:meth:`order_by`"""
+        if not isinstance(index, slice):
+            results = self[index:index + 1]
+            if not results:
+                raise IndexError('{0} index out of range'.format(self.model.__compound_name__))
+
+            return results[0]
+
+        start, stop = index.start or 0, index.stop
+        if index.step not in (None, 1) or start < 0 or (stop is not None and stop < 0):
+            raise ValueError('only positive slices without step are supported')
+
+        if stop is not None and stop <= start:
+            return ResultSet()
+
+        ids = self._get_ordered_ids(start, stop is None and -1 or stop - 1)
+        return ResultSet(self._get_items_from_ids([i for i, _ in ids]))
+
+    def page(self, after=None, size=50):
+        """Returns a :py:class:`Page` with up to ``size`` items of an
+        ordered manager, starting after the given cursor. Every page
+        costs the same regardless of its depth.
+        ::
+
+            page = BlogPost.objects.order_by('-created_at').page(size=50)
+            while page.next_cursor:
+                page = BlogPost.objects.order_by('-created_at').page(after=page.next_cursor, size=50)
+
+        **arguments**
+
+        * ``after`` - the ``next_cursor`` of the previous page, ``None`` for the first one
+        * ``size`` - the maximum amount of items in the page, defaults to ``50``
+        """
+        return self._get_page(after, size)
+
+    def _get_page(self, after, size, connection=None):
+        if after is None:
+            ids = self._get_ordered_ids(0, size, connection)
+        else:
+            score, member = self._decode_cursor(after)
+            results = self._fan_out(lambda conn: self._get_range_after(conn, score, member, size + 1), connection)
+            ids = self._merge_ordered(results)[:size + 1]
+
+        page = Page(self._get_items_from_ids([i for i, _ in ids[:size]], connection))
+        if len(ids) > size:
+            page.next_cursor = self._encode_cursor(*ids[size - 1])
+
+        return page
+
+    def _encode_cursor(self, member, score):
+        name, descending = self._get_ordering()
+        return base64.urlsafe_b64encode(json.dumps([name, descending, score, member]))
+
+    def _decode_cursor(self, cursor):
+        try:
+            name, descending, score, member = json.loads(base64.urlsafe_b64decode(bytes(cursor)))
+        except (TypeError, ValueError):
+            raise ValueError('invalid cursor: {0}'.format(repr(cursor)))
+
+        if (name, descending) != self._get_ordering():
+            raise ValueError('the cursor belongs to another ordering: {0}'.format(repr(cursor)))
+
+        return score, bytes(member)
+
+    def _get_ordered_ids(self, start, stop, connection=None):
+        """returns a list of tuples ``(primary_key, score)`` in the
+        given positions of the sorted set, merging every node"""
+        name, descending = self._get_ordering()
+        key = self.model._calculate_range_index_key(name)
+        connections = self._get_connections(connection)
+        if len(connections) == 1:
+            conn = connections[0]
+            get_range = descending and conn.zrevrange or conn.zrange
+            return get_range(key, start, stop, withscores=True)
+
+        # any node might hold the items before ``start``
+        def get_range(conn):
+            return (descending and conn.zrevrange or conn.zrange)(key, 0, stop, withscores=True)
+
+        results = self._fan_out(get_range, connection)
+        return self._merge_ordered(results)[start:stop >= 0 and stop + 1 or None]
+
+    def _get_range_after(self, conn, score, member, count):
+        """returns up to ``count`` tuples ``(primary_key, score)`` that
+        come after the given score and member in the sorted set.
+
+        When the member is still stored with the same score its rank
+        locates the page, otherwise the members sharing the score are
+        read ``count`` at a time until the ones after it are found."""
+        name, descending = self._get_ordering()
+        key = self.model._calculate_range_index_key(name)
+        pipeline = conn.pipeline(transaction=False)
+        pipeline.zscore(key, member)
+        if descending:
+            pipeline.zrevrank(key, member)
+        else:
+            pipeline.zrank(key, member)
+
+        current, rank = pipeline.execute()
+        if current is not None and current == float(score):
+            get_range = descending and conn.zrevrange or conn.zrange
+            return get_range(key, rank + 1, rank + count, withscores=True)
+
+        exclusive = '({0!r}'.format(score)
+        if descending:
+            get_range = conn.zrevrangebyscore
+            ties_after = lambda m: m < member
+            following = (exclusive, '-inf')
+        else:
+            get_range = conn.zrangebyscore
+            ties_after = lambda m: m > member
+            following = (exclusive, '+inf')
+
+        ties = []
+        start = 0
+        while len(ties) < count:
+            window = get_range(key, score, score, start=start, num=count, withscores=True)
+            ties.extend([t for t in window if ties_after(t[0])])
+            if len(window) < count:
+                break
+
+            start += count
+
+        if len(ties) >= count:
+            return ties[:count]
+
+        return ties + get_range(key, *following, start=0, num=count - len(ties), withscores=True)
+
+    def _merge_ordered(self, results):
+        """merges the ``(primary_key, score)`` tuples of many nodes in
+        the same order redis uses: by score, then by member"""
+        _, descending = self._get_ordering()
+        merged = chain.from_iterable(results)
+        return sorted(merged, key=lambda item: (item[1], item[0]), reverse=descending)
+
+    def _get_items_from_ids(self, ids, connection=None):
+        prefix = self.model._static_key_prefix()
+        keys = [':'.join([prefix, i]) for i in ids]
+        return self.get_items_from_redis_keys(keys, connection=connection)
+
+    def _scan_keys(self, conn, batch_size, arguments=None):
+        """yields the hash keys of the adopted model in batches, one
+        batch per ``SCAN`` call. When the arguments of the filter
+        script are given only the matching keys are yielded, see
+        :py:mod:`repocket.scripting`"""
         prefix = self.model._static_key_prefix()
         search_pattern = ':'.join([prefix, '*'])
 
-        keys = conn.keys(search_pattern)
-        items = [self.get_item_from_redis_key(k) for k in filter(lambda x: ':field:' not in x, keys)]
-        return items
+        cursor = None
+        while cursor != 0:
+            if arguments:
+                cursor, keys = scripting.scan_matching(conn, cursor or 0, search_pattern, batch_size, arguments)
+            else:
+                cursor, keys = conn.scan(cursor or 0, match=search_pattern, count=batch_size)
+
+            keys = [k for k in keys if ':field:' not in k]
+            if keys:
+                yield keys
+
+    def _get_script_arguments(self, lookups):
+        if not self.server_side_filtering:
+            return []
+
+        return scripting.compile_lookups(self.model, lookups)
+
+    def _iter_scripted(self, arguments, batch_size, connection=None):
+        """yields the items whose keys are returned by the filter
+        script, walking every node"""
+        for conn in self._get_connections(connection):
+            for keys in self._scan_keys(conn, batch_size, arguments):
+                for item in self._iter_items_from_redis_keys(keys, batch_size, conn):
+                    yield item
 
     def get_raw_dict_from_redis(self, key, connection=None):
-        conn = connection or configure.get_connection()
-        try:
-            return conn.hgetall(key)
-        except Exception as e:
-            logger.warning('Failed to retrieve key {0}: {1}'.format(key, e))
+        conn = connection or self._get_connection(key)
+        for _, raw, _ in self._get_raw_items_from_redis([key], conn):
+            return raw
 
     def get_item_from_redis_key(self, key, connection=None):
-        conn = connection or configure.get_connection()
-        raw = self.get_raw_dict_from_redis(key)
-        if not raw:
+        items = self.get_items_from_redis_keys([key], connection=connection)
+        if items:
+            return items[0]
+
+    def get_items_from_redis_keys(self, keys, batch_size=None, connection=None):
+        """Returns the instances stored in the given hash keys, skipping
+        the keys that do not exist anymore.
+
+        The keys are retrieved in batches of ``batch_size``, each one
+        in a single pipeline. When the model is sharded the nodes are
+        queried in parallel.
+        """
+        batch_size = batch_size or self.batch_size
+        groups = self._route(keys, connection)
+        if len(groups) == 1:
+            conn, keys = groups[0]
+            return list(self._iter_items_from_redis_keys(keys, batch_size, conn))
+
+        def get_node_items(group):
+            conn, node_keys = group
+            return list(self._iter_items_from_redis_keys(node_keys, batch_size, conn, with_keys=True))
+
+        items = dict(chain.from_iterable(background.map_all(get_node_items, groups)))
+        return [items[key] for key in keys if key in items]
+
+    def _iter_items_from_redis_keys(self, keys, batch_size, conn, with_keys=False):
+        identity_map = self.get_identity_map()
+        if identity_map is None:
+            for item in self._iter_items_from_redis(keys, batch_size, conn, with_keys=with_keys):
+                yield item
+
             return
 
-        data = self.deserialize_raw_item(raw)
-        instance = self.model(**data)
-        for field_name, field in self.model.__string_fields__.items():
-            string_key = instance._calculate_key_for_field(field_name)
-            value = conn.get(string_key)
-            instance.set(field_name, value)
+        database = get_database(conn)
+        cached = {}
+        missing = []
+        for key in keys:
+            instance = identity_map.get((database, key))
+            if instance is None:
+                missing.append(key)
+            else:
+                cached[key] = instance
+
+        for key, instance in self._iter_items_from_redis(missing, batch_size, conn, with_keys=True):
+            identity_map.put((database, key), instance)
+            cached[key] = instance
+
+        for key in keys:
+            if key in cached:
+                yield with_keys and (key, cached[key]) or cached[key]
+
+    def _iter_items_from_redis(self, keys, batch_size, conn, with_keys=False):
+        keys = list(keys)
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            for key, raw, strings in self._get_raw_items_from_redis(batch, conn):
+                item = self.build_item(raw, strings)
+                yield with_keys and (key, item) or item
+
+    def _get_raw_items_from_redis(self, keys, conn):
+        """returns a list of tuples ``(key, raw_hash, strings)`` for the
+        given keys that exist, going through the
+        :py:class:`~repocket.readcache.ReadCache` when enabled"""
+        read_cache = get_read_cache()
+        if read_cache is None or self.deferred_fields:
+            return self._get_raw_items_from_pipeline(keys, conn)
+
+        database = get_database(conn)
+        cached = {}
+        missing = []
+        for key in keys:
+            value = read_cache.get(key, database)
+            if value is None:
+                missing.append(key)
+            else:
+                cached[key] = value
+
+        token = read_cache.get_token()
+        for key, raw, strings in self._get_raw_items_from_pipeline(missing, conn):
+            read_cache.put(key, (raw, strings), token, database)
+            cached[key] = (raw, strings)
+
+        return [(key, ) + cached[key] for key in keys if key in cached]
+
+    def _get_raw_items_from_pipeline(self, keys, conn):
+        """retrieves the hash and the ByteStream strings of every given
+        key through a single pipeline, returns a list of tuples
+        ``(key, raw_hash, strings)``"""
+        if not keys:
+            return []
+
+        hash_fields = self._get_loaded_hash_fields()
+        string_fields = [n for n in self.model.__string_fields__.keys() if n not in self.deferred_fields and n not in self.model.__lazy_streams__]
+        pipeline = conn.pipeline(transaction=False)
+        for key in keys:
+            if hash_fields:
+                pipeline.hmget(key, hash_fields)
+            else:
+                pipeline.hgetall(key)
+
+            for field_name in string_fields:
+                pipeline.get(':'.join([key, 'field', field_name]))
+
+        results = pipeline.execute(raise_on_error=False)
+        if hash_fields:
+            for index in range(0, len(results), len(string_fields) + 1):
+                results[index] = self._get_raw_dict_from_hmget(hash_fields, results[index])
+        step = len(string_fields) + 1
+
+        items = []
+        for index, key in enumerate(keys):
+            raw = results[index * step]
+            values = results[index * step + 1:(index + 1) * step]
+            failures = [r for r in [raw] + values if isinstance(r, Exception)]
+            if failures:
+                logger.warning('Failed to retrieve key {0}: {1}'.format(key, failures[0]))
+                continue
+
+            if not raw:
+                continue
+
+            strings = dict([(n, v) for n, v in zip(string_fields, values) if v is not None])
+            items.append((key, raw, strings))
+
+        return items
+
+    def _get_loaded_hash_fields(self):
+        """returns the names of the hash fields that must be retrieved
+        through ``HMGET``, or ``None`` when the whole hash is retrieved"""
+        if not self.deferred_fields:
+            return
+
+        string_fields = self.model.__string_fields__
+        return [n for n in self.model.__fields__.keys() if n not in self.deferred_fields and n not in string_fields]
+
+    def _get_raw_dict_from_hmget(self, names, values):
+        """turns the reply of ``HMGET`` into the same dict returned by
+        ``HGETALL``, which is empty when the item does not exist"""
+        if isinstance(values, Exception):
+            return values
+
+        if values[names.index(self.model.__primary_key__)] is None:
+            return {}
+
+        return dict([(n, v) for n, v in zip(names, values) if v is not None])
+
+    def load_fields(self, instance, names, connection=None):
+        """retrieves the given attributes of an instance, returns a
+        dict with the values"""
+        conn = connection or self._get_connection(instance._calculate_hash_key())
+        string_fields = self.model.__string_fields__
+        hash_names = [n for n in names if n not in string_fields]
+        string_names = [n for n in names if n in string_fields]
+
+        pipeline = conn.pipeline(transaction=False)
+        if hash_names:
+            pipeline.hmget(instance._calculate_hash_key(), hash_names)
+
+        for name in string_names:
+            pipeline.get(instance._calculate_key_for_field(name))
+
+        results = pipeline.execute()
+        raw_values = zip(hash_names, hash_names and results.pop(0) or [])
+
+        values = {}
+        for name, raw_value in raw_values:
+            field = self.model.__fields__[name]
+            value = raw_value and decode_value(field, raw_value)
+            if value:
+                values[name] = field.cast(value)
+            else:
+                values[name] = field.get_empty_value()
+
+        for name, raw_value in zip(string_names, results):
+            values[name] = raw_value and unpack_stream(raw_value) or self.model.__fields__[name].get_empty_value()
+
+        return values
 
-        return instance
+    def build_item(self, raw, strings=None):
+        """Creates an instance of the adopted model from the raw hash
+        and ByteStream values retrieved from redis, through the
+        decoder generated for the model, see :py:mod:`repocket.serializers`"""
+        return self.model.__decoder__(raw, strings, self.deferred_fields, self.alias)
 
     def deserialize_raw_item(self, raw_item):
         data = {}
+        fields = self.model.__fields__
         for key, raw_value in raw_item.iteritems():
             try:
-                value = Attribute.from_json(raw_value)
+                value = decode_value(fields.get(key), raw_value)
             except TypeError as e:
                 logger.error('Failed to deserialize field {0}.{1} because: {2}'.format(
                     self.model.__class__.__name__,
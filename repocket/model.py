@@ -1,10 +1,17 @@
+import copy
 import json
 import uuid
 import logging
 
-from repocket import attributes
-from repocket.connections import configure
+from repocket import attributes, background
+from repocket.codecs import decode_value, get_codec
+from repocket.compression import append_frames, compress_value, pack_frames, pack_stream
+from repocket.connections import configure, get_database
+from repocket.instrumentation import instrumented
+from repocket.readcache import get_read_cache
 from repocket.registry import ActiveRecordRegistry
+from repocket.streams import DEFAULT_CHUNK_SIZE, StreamReader
+from repocket.util import parse_lookup, RANGE_OPERATORS
 
 
 logger = logging.getLogger("repocket.model")
@@ -35,9 +42,25 @@ class ActiveRecord(object):
         key = obj1.save()
         connection = configure.get_connection()
         raw_results = connection.hgetall(key)
+
+    The items retrieved from redis are built without calling
+    ``__init__``, unless the model defines its own, declare a
+    ``__post_load__`` method to prepare them once their values are set:
+
+    ::
+
+        class User(ActiveRecord):
+            ...
+
+            def __post_load__(self):
+                self.display_name = self.name or self.email
     """
 
     __metaclass__ = ActiveRecordRegistry
+    __codec__ = 'envelope'
+    __using__ = None
+    # called with every instance retrieved from redis, see above
+    __post_load__ = None
 
     def __init__(self, *args, **kw):
         for attribute, field in self.__fields__.items():
@@ -54,6 +77,53 @@ class ActiveRecord(object):
         attributes = ', '.join(['{0}={1}'.format(k, repr(v)) for k, v in self.to_dict(simple=True).items() if v])
         return '{0}({1})'.format(self.__compound_name__, attributes)
 
+    def __setattr__(self, name, value):
+        if name in self.__fields__:
+            self.__dict__.setdefault('_dirty_fields', set()).add(name)
+
+        super(ActiveRecord, self).__setattr__(name, value)
+
+    def __getattr__(self, name):
+        # only called when the attribute is not set, which is the
+        # case of the attributes deferred by ``only()`` or ``defer()``
+        if name in self.get_deferred_fields():
+            self._load_deferred_fields([name])
+            return getattr(self, name)
+
+        raise AttributeError("'{0}' object has no attribute '{1}'".format(self.__class__.__name__, name))
+
+    def get_deferred_fields(self):
+        """returns the names of the attributes that were not retrieved
+        from redis yet, see :py:meth:`~repocket.manager.ActiveRecordManager.only`"""
+        return self.__dict__.get('_deferred_fields', frozenset())
+
+    def _defer_fields(self, names):
+        for name in names:
+            delattr(self, name)
+
+        self._deferred_fields = frozenset(names)
+
+    def _load_deferred_fields(self, names):
+        values = self.objects.using(self.get_alias()).load_fields(self, names)
+        pending = self.__dict__.get('_pending_appends', {})
+        # the set of deferred fields can be shared between instances
+        self._deferred_fields = self.get_deferred_fields().difference(names)
+        for name in names:
+            if name in pending:
+                # the bytes given to set() were not saved yet, now the
+                # whole value is in memory and will be written by save()
+                setattr(self, name, values[name] + b''.join(pending.pop(name)))
+            else:
+                self._set_clean(name, values[name])
+
+        self._take_snapshot(names)
+
+    def _defer_stream(self, name):
+        """drops the in-memory contents of a ByteStream, they are
+        retrieved again when the attribute is accessed"""
+        self._deferred_fields = self.get_deferred_fields().union([name])
+        self.__dict__.pop(name, None)
+
     def __getitem__(self, name):
         options = self.__fields__.keys()
         if name not in options:
@@ -86,6 +156,59 @@ class ActiveRecord(object):
             cls.__name__,
         )
 
+    @classmethod
+    def _static_index_prefix(cls):
+        return b'repocket-index:{0}:{1}'.format(
+            cls.__namespace__,
+            cls.__name__,
+        )
+
+    @classmethod
+    def _calculate_index_key(cls, name, value):
+        """returns the redis key of the set that contains the primary
+        keys of every instance whose field ``name`` holds the given ``value``:
+
+        ::
+
+            repocket-index:yourapp.models:Person:eq:email:foo@bar.com
+        """
+        field = cls.__fields__[name]
+        return b':'.join([
+            cls._static_index_prefix(),
+            'eq',
+            name,
+            field.to_index_value(value),
+        ])
+
+    @classmethod
+    def _calculate_range_index_key(cls, name):
+        """returns the redis key of the sorted set that contains the
+        primary keys of every instance scored by the field ``name``:
+
+        ::
+
+            repocket-index:yourapp.models:Person:range:born_at
+        """
+        return b':'.join([
+            cls._static_index_prefix(),
+            'range',
+            name,
+        ])
+
+    @classmethod
+    def _calculate_members_key(cls):
+        """returns the redis key of the set that contains the primary
+        keys of every instance:
+
+        ::
+
+            repocket-index:yourapp.models:Person:members
+        """
+        return b':'.join([
+            cls._static_index_prefix(),
+            'members',
+        ])
+
     def get_id(self):
         return getattr(self, self.__primary_key__, None)
 
@@ -143,15 +266,68 @@ class ActiveRecord(object):
         return self.get(self.__primary_key__)
 
     def append_to_bytestream(self, field_name, value):
+        """appends the given bytes to the ByteStream in redis right
+        away, without retrieving its contents.
+
+        The contents held by the instance, if any, are dropped and
+        retrieved again the next time the attribute is accessed.
+        """
         redis_key = self._calculate_key_for_field(field_name)
-        conn = configure.get_connection()
-        conn.append(redis_key, value)
+        conn = self._get_connection()
+        pipeline = conn.pipeline()
+        self._append_to_pipeline(pipeline, field_name, value)
+        self._publish_invalidation(pipeline)
+        pipeline.execute()
+        self._invalidate_read_cache()
+        self._update_identity_map()
+
+        if field_name in self.get_dirty_fields():
+            # the unsaved contents are kept to be written by save()
+            old_value = getattr(self, field_name) or b''
+            self._set_clean(field_name, bytes(old_value) + bytes(value))
+        else:
+            self._defer_stream(field_name)
 
-        old_value = getattr(self, field_name) or ''
-        new_value = bytes(old_value) + bytes(value)
-        setattr(self, field_name, new_value)
         return redis_key
 
+    def _append_to_pipeline(self, pipeline, field_name, value):
+        field = self.__string_fields__[field_name]
+        redis_key = self._calculate_key_for_field(field_name)
+        if field.compress:
+            return append_frames(pipeline, redis_key, pack_frames(field.compress, field.threshold, bytes(value)))
+
+        return pipeline.append(redis_key, value)
+
+    def open_stream(self, field_name, chunk_size=DEFAULT_CHUNK_SIZE):
+        """returns a read-only file with the contents of the given
+        ByteStream stored in redis, retrieved with ``GETRANGE`` chunk by
+        chunk, see :py:class:`~repocket.streams.StreamReader`
+
+        ::
+
+            with build.open_stream('stdout') as stream:
+                stream.seek(-1024, os.SEEK_END)
+                tail = stream.read(1024)
+
+        **arguments**
+
+        * ``field_name`` - the name of a ByteStream attribute
+        * ``chunk_size`` - the maximum amount of bytes retrieved at once, defaults to ``64KB``
+        """
+        if field_name not in self.__string_fields__:
+            raise AttributeError('{0} is not a ByteStream of {1}, options are {2}'.format(
+                field_name, self.__compound_name__, ', '.join(self.__string_fields__.keys())))
+
+        return StreamReader(self._get_connection(), self._calculate_key_for_field(field_name), chunk_size)
+
+    def _get_reference(self, name):
+        """returns the value of a :py:class:`~repocket.attributes.Pointer`
+        attribute without retrieving the referenced item"""
+        if name in self.get_deferred_fields():
+            self._load_deferred_fields([name])
+
+        return getattr(type(self), name).get_reference(self)
+
     def get(self, attribute, fallback=None):
         return getattr(self, attribute, fallback)
 
@@ -163,12 +339,23 @@ class ActiveRecord(object):
             raise AttributeError(msg)
 
         if isinstance(field, attributes.ByteStream):
+            if self.is_persisted() and field_name not in self.get_dirty_fields():
+                # the stored contents are not sent again
+                self._defer_stream(field_name)
+
+            if field_name in self.get_deferred_fields():
+                # appended by save() without retrieving the contents
+                self.__dict__.setdefault('_pending_appends', {}).setdefault(field_name, []).append(bytes(value))
+                return
+
             old_value = getattr(self, field_name, bytes()) or bytes()
             value = bytes(old_value) + bytes(value)
 
         setattr(self, field_name, value)
 
-    def to_dict(self, simple=False):
+    def to_dict(self, simple=False, fields=None):
+        """Serializes the instance, optionally restricted to the given
+        field names"""
         data = {
             # the "hash" key contains the main attributes, but special
             # attributes like ByteStream get translated into other
@@ -180,11 +367,21 @@ class ActiveRecord(object):
             'strings': {},
         }
         simple_version = {}
+        codec = get_codec(self.__codec__)
         for name, field in self.__fields__.items():
-            value = getattr(self, name, field.get_empty_value())
+            if fields is not None and name not in fields:
+                continue
+
+            if isinstance(field, attributes.Pointer) and not simple:
+                # serializing a pointer does not require resolving it
+                value = self._get_reference(name)
+            else:
+                value = getattr(self, name, field.get_empty_value())
 
             try:
-                serialized_value = field.to_json(value)
+                serialized_value = codec.encode(field, value)
+                if field.compress and not isinstance(field, attributes.ByteStream):
+                    serialized_value = compress_value(field.compress, field.threshold, serialized_value)
 
             except Exception as e:
                 logger.error('Failed to serialize field {0}.{1} of type {2} with value: {3} - {4}'.format(
@@ -225,49 +422,300 @@ class ActiveRecord(object):
 
         return data
 
-    def save(self):
-        """Persists the model in redis.
-        Automatically generates a primary key value if one was not provided
+    def _get_indexes_to_update(self, fields=None):
+        """returns the names of the indexed attributes among the given
+        field names, or all of them"""
+        return [n for n in self.__indexes__.keys() if fields is None or n in fields]
+
+    def _get_stored_index_keys(self, conn, names=None):
+        """returns the index keys that currently hold the primary key of
+        this instance, based on the values stored in redis"""
+        names = self._get_indexes_to_update(names)
+        if not names:
+            return []
+
+        stored_values = conn.hmget(self._calculate_hash_key(), names)
+        return self._parse_stored_index_keys(stored_values, names)
+
+    def _parse_stored_index_keys(self, stored_values, names=None):
+        """takes the raw values of the indexed fields, as returned by
+        ``HMGET``, and returns their index keys"""
+        keys = []
+        for name, raw_value in zip(self._get_indexes_to_update(names), stored_values):
+            if raw_value is None:
+                continue
+
+            value = decode_value(self.__fields__[name], raw_value)
+            keys.append(self._calculate_index_key(name, value))
+
+        return keys
+
+    def _update_indexes(self, pipeline, stored_index_keys, names=None):
+        """adds the commands that keep the secondary indexes up-to-date
+        into the given pipeline"""
+        primary_key = bytes(self._primary_key)
+        current_keys = [self._calculate_index_key(name, self.get(name)) for name in self._get_indexes_to_update(names)]
+
+        for key in set(stored_index_keys).difference(current_keys):
+            pipeline.srem(key, primary_key)
+
+        for key in current_keys:
+            pipeline.sadd(key, primary_key)
+
+        pipeline.sadd(self._calculate_members_key(), primary_key)
+        for name, field in self.__range_indexes__.items():
+            if names is not None and name not in names:
+                continue
+
+            key = self._calculate_range_index_key(name)
+            value = self.get(name)
+            if value is None:
+                pipeline.zrem(key, primary_key)
+            else:
+                pipeline.zadd(key, **{primary_key: field.to_score(value)})
+
+        return pipeline
+
+    def _remove_from_indexes(self, pipeline, stored_index_keys):
+        """adds the commands that remove the primary key from every
+        index into the given pipeline"""
+        primary_key = bytes(self._primary_key)
+        for key in stored_index_keys:
+            pipeline.srem(key, primary_key)
+
+        pipeline.srem(self._calculate_members_key(), primary_key)
+        for name in self.__range_indexes__.keys():
+            pipeline.zrem(self._calculate_range_index_key(name), primary_key)
+
+        return pipeline
+
+    def _save_to_pipeline(self, pipeline, stored_index_keys, fields=None):
+        """adds the commands that persist the model into the given
+        pipeline, the primary key must be already set.
+
+        When ``fields`` is given only those attributes are written.
         """
-        self._set_primary_key()
         redis_hash_key = self._calculate_hash_key()
-
-        conn = configure.get_connection()
-        data = self.to_dict()
-        pipeline = conn.pipeline()
-        pipeline = pipeline.hmset(redis_hash_key, data['hash'])
         redis_keys = {
             'hash': redis_hash_key,
-            'strings': {}
+            'strings': dict([(n, self._calculate_key_for_field(n)) for n in self.__string_fields__.keys()])
         }
+        pending_appends = self.__dict__.get('_pending_appends', {})
+        for name, chunks in pending_appends.items():
+            pipeline = self._append_to_pipeline(pipeline, name, b''.join(chunks))
+
+        if fields is not None and not fields:
+            # nothing else changed
+            if pending_appends:
+                self._publish_invalidation(pipeline)
+
+            return redis_keys
+
+        deferred_streams = self.get_deferred_fields().intersection(self.__string_fields__)
+        if fields is None and deferred_streams:
+            # the streams that were not retrieved did not change
+            fields = set(self.__fields__).difference(deferred_streams)
+
+        data = self.__encoder__(self, fields)
+        if data['hash']:
+            pipeline = pipeline.hmset(redis_hash_key, data['hash'])
+
         for name, value in data['strings'].items():
-            redis_string_key = self._calculate_key_for_field(name)
-            redis_keys['strings'][name] = redis_string_key
-            pipeline = pipeline.set(redis_string_key, value)
+            field = self.__string_fields__[name]
+            pipeline = pipeline.set(redis_keys['strings'][name], pack_stream(field.compress, field.threshold, value))
 
+        self._update_indexes(pipeline, stored_index_keys, fields)
+        self._publish_invalidation(pipeline)
+        return redis_keys
+
+    def _publish_invalidation(self, pipeline):
+        """publishes the hash key in the invalidation channel, when
+        enabled, see :py:mod:`repocket.readcache`"""
+        if configure.invalidation_channel:
+            pipeline.publish(configure.invalidation_channel, self._calculate_hash_key())
+
+    def _invalidate_read_cache(self):
+        read_cache = get_read_cache()
+        if read_cache is not None:
+            read_cache.invalidate(self._calculate_hash_key(), get_database(self._get_connection()))
+
+    def _update_identity_map(self, evict=False):
+        """makes the identity map in use point to this instance, or
+        evicts it"""
+        identity_map = self.objects.get_identity_map()
+        if identity_map is None:
+            return
+
+        key = (get_database(self._get_connection()), self._calculate_hash_key())
+        if evict:
+            identity_map.evict(key)
+        else:
+            identity_map.put(key, self)
+
+    def get_alias(self):
+        """returns the alias of the connection pool that stores this
+        instance, see :py:class:`~repocket.connections.configure`"""
+        return self.__dict__.get('_using') or self.__using__
+
+    def _get_connection(self):
+        """returns the connection to the node that stores this instance"""
+        return configure.get_connection(self.get_alias(), self._calculate_hash_key())
+
+    def get_dirty_fields(self):
+        """returns the names of the attributes that changed since the
+        instance was retrieved from redis or last saved, including the
+        values of mutable attributes, like ``JSON``, changed in place"""
+        dirty = set(self.__dict__.get('_dirty_fields', ()))
+        if not self.__mutable_fields__ or not self.is_persisted():
+            return dirty
+
+        snapshots = self.__dict__.get('_snapshots', {})
+        for name in self.__mutable_fields__.difference(dirty):
+            if name not in self.__dict__:
+                # deferred
+                continue
+
+            if name not in snapshots or snapshots[name] != self.__dict__[name]:
+                dirty.add(name)
+
+        return dirty
+
+    def _take_snapshot(self, names=None):
+        """keeps a copy of the loaded values of the mutable attributes,
+        so that changing them in place marks them as dirty"""
+        if not self.__mutable_fields__:
+            return
+
+        snapshots = self.__dict__.setdefault('_snapshots', {})
+        for name in self.__mutable_fields__:
+            if (names is None or name in names) and name in self.__dict__:
+                snapshots[name] = copy.deepcopy(self.__dict__[name])
+
+    def is_persisted(self):
+        """returns ``True`` when the instance was retrieved from redis
+        or already saved"""
+        return self.__dict__.get('_persisted', False)
+
+    def _mark_as_persisted(self):
+        self.__dict__.pop('_dirty_fields', None)
+        self.__dict__.pop('_pending_appends', None)
+        self._take_snapshot()
+        self._persisted = True
+
+    def _mark_as_deleted(self):
+        # the next save() writes every attribute again
+        self.__dict__.pop('_persisted', None)
+        self.__dict__.pop('_snapshots', None)
+
+    def _set_clean(self, name, value):
+        """sets the attribute without marking it as dirty"""
+        super(ActiveRecord, self).__setattr__(name, value)
+
+    def _get_fields_to_save(self, force=False):
+        """returns the names of the attributes that need to be written
+        or ``None`` when all of them need to be written"""
+        if force or not self.is_persisted():
+            return
+
+        return self.get_dirty_fields()
+
+    @instrumented('save')
+    def save(self, force=False):
+        """Persists the model in redis.
+        Automatically generates a primary key value if one was not provided.
+
+        Instances that were retrieved from redis or already saved only
+        write the attributes that changed since then, pass
+        ``force=True`` to write all of them.
+        """
+        self._set_primary_key()
+
+        conn = self._get_connection()
+        fields = self._get_fields_to_save(force)
+        stored_index_keys = self._get_stored_index_keys(conn, fields)
+        pipeline = conn.pipeline()
+        redis_keys = self._save_to_pipeline(pipeline, stored_index_keys, fields)
         pipeline.execute()
+        self._mark_as_persisted()
+        self._invalidate_read_cache()
+        self._update_identity_map()
         return redis_keys
 
+    @instrumented('delete')
     def delete(self):
         """Deletes all the redis keys used by this model"""
         keys = [self._calculate_hash_key()]
         keys.extend([self._calculate_key_for_field(k) for k in self.__string_fields__.keys()])
 
-        conn = configure.get_connection()
-        results = conn.delete(*keys)
-        return results
+        conn = self._get_connection()
+        stored_index_keys = self._get_stored_index_keys(conn)
+        pipeline = conn.pipeline()
+        pipeline.delete(*keys)
+        self._remove_from_indexes(pipeline, stored_index_keys)
+        self._publish_invalidation(pipeline)
+        results = pipeline.execute()
+        self._mark_as_deleted()
+        self._invalidate_read_cache()
+        self._update_identity_map(evict=True)
+        return results[0]
+
+    def asave(self, force=False):
+        """Same as :py:meth:`save` but runs in a worker thread, returns
+        an :py:class:`~multiprocessing.pool.AsyncResult`, see
+        :py:mod:`repocket.background`"""
+        return background.submit(self.save, force=force)
+
+    def adelete(self):
+        """Same as :py:meth:`delete` but runs in a worker thread, returns
+        an :py:class:`~multiprocessing.pool.AsyncResult`"""
+        return background.submit(self.delete)
 
     def matches(self, kw):
         """Takes a dictionary with keyword args and returns true if all the
-        args match the model field values"""
-        matched = False
-        for k, v in kw.items():
-            field = self.__fields__[k]
-            comp = field.cast(v)
-
-            if self.get(k) == comp:
-                matched = True
+        args match the model field values.
+
+        Supports the lookups ``field=value``, ``field__in=[value1, value2]``
+        and ``field__gt``, ``field__gte``, ``field__lt``, ``field__lte``
+        for the attributes that can have a range index.
+        """
+        for lookup, expected in kw.items():
+            name, operator = parse_lookup(lookup)
+            field = self.__fields__[name]
+            if operator in RANGE_OPERATORS:
+                if not self._matches_range(field, operator, self.get(name), expected):
+                    return False
+
+                continue
+
+            if operator == 'in':
+                candidates = [field.cast(v) for v in expected]
             else:
-                matched = False
+                candidates = [field.cast(expected)]
+
+            if isinstance(field, attributes.Pointer):
+                # compare the references without retrieving the items
+                value = field.to_index_value(self._get_reference(name))
+                candidates = [field.to_index_value(c) for c in candidates]
+            else:
+                value = self.get(name)
+
+            if value not in candidates:
+                return False
+
+        return True
+
+    @staticmethod
+    def _matches_range(field, operator, value, expected):
+        if value is None or expected is None:
+            return False
+
+        score = field.to_score(value)
+        expected = field.to_score(expected)
+        if operator == 'gt':
+            return score > expected
+        elif operator == 'gte':
+            return score >= expected
+        elif operator == 'lt':
+            return score < expected
 
-        return matched
+        return score <= expected
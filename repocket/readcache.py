@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""A process-wide, read-through cache of the raw data of the items
+retrieved from redis.
+
+The cache is kept coherent through a pub/sub channel: every
+``save()``, ``delete()`` and ``append_to_bytestream()`` publishes the
+redis key of the item in the channel of the server that stores it, and
+a listener thread, subscribed to the servers of every configured
+connection pool, evicts the key from the cache of every process.
+The items are cached per server and database, see
+:py:func:`~repocket.connections.get_database`, so the same key read
+through different pools is never mixed up.
+
+::
+
+    from repocket.readcache import enable_read_cache
+
+    enable_read_cache(max_bytes=64 * 1024 * 1024, ttl=300)
+
+Processes that only write data must also publish the invalidations:
+
+::
+
+    configure.publish_invalidations()
+
+"""
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from repocket.connections import configure, get_database
+
+logger = logging.getLogger('repocket.readcache')
+
+_state = {
+    'cache': None,
+}
+
+
+class ReadCache(object):
+    """a thread-safe, memory bound cache of raw items, evicted in
+    least recently used order.
+
+    **arguments**
+
+    * ``max_bytes`` - the approximate maximum amount of bytes held by the cache, defaults to 64MB
+    * ``ttl`` - the amount of seconds an item is kept, defaults to ``60``
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        """takes a key or a tuple ``(database, key)``"""
+        if not isinstance(key, tuple):
+            key = (None, key)
+
+        return key in self.items
+
+    def get(self, key, database=None):
+        """returns the cached ``(raw_hash, strings)`` of the given key of
+        the given database, see :py:func:`~repocket.connections.get_database`,
+        or ``None``"""
+        key = (database, key)
+        with self.lock:
+            entry = self.items.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return
+
+            value, size, expires_at = entry
+            if expires_at < time.time():
+                self.size -= size
+                self.misses += 1
+                return
+
+            self.hits += 1
+            self.items[key] = entry
+            return value
+
+    def get_token(self):
+        """returns a token that must be passed to :py:meth:`put`, taken
+        before retrieving the data from redis so that data retrieved
+        concurrently with an invalidation is never stored"""
+        return self.invalidations
+
+    def put(self, key, value, token, database=None):
+        """stores the ``(raw_hash, strings)`` of the given key of the
+        given database, unless any key was invalidated since the token
+        was taken"""
+        raw, strings = value
+        size = len(key) + sum([len(k) + len(v) for k, v in raw.items() + strings.items()])
+        if size > self.max_bytes:
+            return
+
+        key = (database, key)
+        with self.lock:
+            if token != self.invalidations:
+                return
+
+            self._remove(key)
+            self.items[key] = (value, size, time.time() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self.items.popitem(last=False)
+                self.size -= evicted_size
+
+    def invalidate(self, key, database=None):
+        """evicts the given key of the given database"""
+        with self.lock:
+            self.invalidations += 1
+            self._remove((database, key))
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.items.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.items.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def stats(self):
+        """returns a dict with the ``hits``, ``misses``, ``size`` (in
+        items), ``bytes`` and ``invalidations``"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.items),
+            'bytes': self.size,
+            'invalidations': self.invalidations,
+        }
+
+
+class InvalidationListener(threading.Thread):
+    """daemon thread that evicts the keys published in the
+    invalidation channel from the given cache"""
+    def __init__(self, cache, channel, reconnect_interval=1, poll_interval=0.2):
+        super(InvalidationListener, self).__init__(name='repocket-invalidation-listener')
+        self.daemon = True
+        self.cache = cache
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self.poll_interval = poll_interval
+        self.subscribed = threading.Event()
+        # the databases whose invalidations are received
+        self.databases = frozenset()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                self.listen()
+            except Exception:
+                # without the subscription there is no way to know
+                # what changed in the meantime
+                self.subscribed.clear()
+                self.cache.clear()
+                if self.running:
+                    logger.warning('invalidation listener disconnected: %s', sys.exc_info()[1])
+                    time.sleep(self.reconnect_interval)
+
+    def get_servers(self):
+        """returns a list of tuples with a client of every server of the
+        configured connection pools and its databases"""
+        servers = OrderedDict()
+        for alias in sorted(configure.settings) or [configure.default_alias]:
+            connection = configure.get_connection(alias)
+            database = get_database(connection)
+            address = database and database[0]
+            servers.setdefault(address, (connection, set()))[1].add(database)
+
+        return servers.values()
+
+    def listen(self):
+        # every model publishes in the server that stores it
+        servers = self.get_servers()
+        aliases = sorted(configure.settings)
+        subscriptions = [(c.pubsub(ignore_subscribe_messages=True), databases) for c, databases in servers]
+        timeout = self.poll_interval / len(subscriptions)
+        try:
+            for pubsub, _ in subscriptions:
+                pubsub.subscribe(self.channel)
+
+            # anything cached before subscribing might be stale
+            self.cache.clear()
+            self.databases = frozenset().union(*[databases for _, databases in subscriptions])
+            self.subscribed.set()
+            while self.running and aliases == sorted(configure.settings):
+                for pubsub, databases in subscriptions:
+                    message = pubsub.get_message(timeout=timeout)
+                    if message and message['type'] == 'message':
+                        for database in databases:
+                            self.cache.invalidate(message['data'], database)
+        finally:
+            for pubsub, _ in subscriptions:
+                pubsub.close()
+
+    def stop(self):
+        """stops listening within ``poll_interval`` seconds"""
+        self.running = False
+
+
+def get_read_cache():
+    """returns the :py:class:`ReadCache` in use, if any"""
+    return _state['cache']
+
+
+def enable_read_cache(max_bytes=64 * 1024 * 1024, ttl=60, channel=None, wait=5):
+    """enables the process-wide :py:class:`ReadCache` and starts the
+    listener thread of the invalidation channel.
+
+    **arguments**
+
+    * ``max_bytes`` - see :py:class:`ReadCache`
+    * ``ttl`` - see :py:class:`ReadCache`
+    * ``channel`` - the invalidation channel, defaults to :py:attr:`~repocket.connections.configure.invalidation_channel`
+    * ``wait`` - seconds to wait until the listener is subscribed
+    """
+    disable_read_cache()
+    configure.publish_invalidations(channel or configure.invalidation_channel)
+
+    cache = ReadCache(max_bytes=max_bytes, ttl=ttl)
+    cache.listener = InvalidationListener(cache, configure.invalidation_channel)
+    cache.listener.start()
+    if not cache.listener.subscribed.wait(wait):
+        logger.warning('the invalidation listener did not subscribe within %s seconds', wait)
+
+    _state['cache'] = cache
+    return cache
+
+
+def disable_read_cache():
+    """stops the listener thread and discards the cache"""
+    cache = _state['cache']
+    _state['cache'] = None
+    if cache is not None:
+        cache.listener.stop()
+        cache.listener.join()
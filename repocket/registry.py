@@ -2,9 +2,11 @@
 from __future__ import unicode_literals
 
 from collections import OrderedDict
-from repocket.attributes import Attribute, AutoUUID, ByteStream
+from repocket.attributes import Attribute, AutoUUID, ByteStream, Pointer, PointerDescriptor
 from repocket.errors import RepocketActiveRecordDefinitionError
+from repocket.instrumentation import instrumented_function
 from repocket.manager import ActiveRecordManager
+from repocket.serializers import build_decoder, build_encoder
 from repocket._cache import MODELS
 
 
@@ -15,6 +17,10 @@ class ActiveRecordRegistry(type):
 
         if name not in ('ActiveRecordRegistry', 'ActiveRecord'):
             ActiveRecordRegistry.configure_fields(ActiveRecordClass, members)
+            ActiveRecordClass.__encoder__ = staticmethod(instrumented_function(
+                'serialize', ActiveRecordClass, build_encoder(ActiveRecordClass)))
+            ActiveRecordClass.__decoder__ = staticmethod(instrumented_function(
+                'hydrate', ActiveRecordClass, build_decoder(ActiveRecordClass)))
             ActiveRecordClass.objects = ActiveRecordManager(ActiveRecordClass)
             ActiveRecordClass.__namespace__ = str(module_name)
             ActiveRecordClass.__compound_name__ = compound_name
@@ -26,6 +32,8 @@ class ActiveRecordRegistry(type):
     def configure_fields(ActiveRecordClass, members):
         hash_fields = OrderedDict()
         string_fields = OrderedDict()
+        indexed_fields = OrderedDict()
+        range_indexed_fields = OrderedDict()
         primary_key_attribute = None
 
         for attribute, value in members.items():
@@ -44,22 +52,42 @@ class ActiveRecordRegistry(type):
                 field_name = str(attribute)
                 string_fields[field_name] = value
                 append_method_name = 'append_{0}'.format(attribute)
-                setattr(ActiveRecordClass, append_method_name, lambda self, string_value: ActiveRecordClass.append_to_bytestream(self, field_name, string_value))
+                setattr(ActiveRecordClass, append_method_name, lambda self, string_value, field_name=field_name: ActiveRecordClass.append_to_bytestream(self, field_name, string_value))
 
             if isinstance(value, Attribute):
                 hash_fields[str(attribute)] = value
+                if value.index:
+                    if isinstance(value, ByteStream):
+                        msg = '{0}.{1} is a ByteStream and cannot be indexed'
+                        raise RepocketActiveRecordDefinitionError(msg.format(ActiveRecordClass, attribute))
+
+                    if value.index != 'range':
+                        indexed_fields[str(attribute)] = value
+                    elif value.__range_index__:
+                        range_indexed_fields[str(attribute)] = value
+                    else:
+                        msg = '{0}.{1} is a {2} and cannot have a range index'
+                        raise RepocketActiveRecordDefinitionError(msg.format(ActiveRecordClass, attribute, type(value).__name__))
+
                 members.pop(attribute, None)
                 try:
                     delattr(ActiveRecordClass, attribute)
                 except AttributeError:
                     pass
 
+            if isinstance(value, Pointer):
+                setattr(ActiveRecordClass, attribute, PointerDescriptor(str(attribute)))
+
         if primary_key_attribute is None:
             primary_key_attribute = 'id'
             hash_fields['id'] = AutoUUID()
 
         ActiveRecordClass.__fields__ = hash_fields
         ActiveRecordClass.__string_fields__ = string_fields
+        ActiveRecordClass.__mutable_fields__ = frozenset([n for n, f in hash_fields.items() if f.__mutable__])
+        ActiveRecordClass.__lazy_streams__ = frozenset([n for n, f in string_fields.items() if f.lazy])
+        ActiveRecordClass.__indexes__ = indexed_fields
+        ActiveRecordClass.__range_indexes__ = range_indexed_fields
         ActiveRecordClass.__primary_key__ = primary_key_attribute
 
         return members
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Server-side filtering: the lookups of attributes without an index
+are compared by a lua script that runs inside of redis, so that only
+the keys of the matching items travel through the network.
+
+The script is loaded once per redis server and called with
+``EVALSHA``. Each call walks a single ``SCAN`` step of the model
+keyspace, decodes the stored values, whether they were stored by the
+``envelope`` or by the ``compact`` codec, and returns the next cursor
+with the matching keys.
+
+Only the attributes whose ``__script_comparison__`` is set can be
+compared by the script, every other lookup and every value that the
+script cannot decode is compared in python once the item is retrieved:
+the script never discards an item that ``matches()`` would accept.
+
+It is enabled by default and can be turned off per manager:
+
+::
+
+    User.objects.server_side_filtering = False
+"""
+import hashlib
+
+from redis.exceptions import NoScriptError
+
+from repocket.util import RANGE_OPERATORS, parse_lookup
+
+
+# ARGV: cursor, match pattern, count, then every predicate as
+# name, comparison, operator, amount of envelope values, envelope
+# values..., amount of compact values, compact values...
+FILTER_SCRIPT = br"""
+local function decode(raw)
+    if not raw then
+        return nil, nil
+    end
+
+    local marker = string.sub(raw, 1, 1)
+    if marker == '\1' then
+        return string.sub(raw, 2), 'compact'
+    elseif marker == '\2' then
+        return nil, nil
+    end
+
+    local ok, envelope = pcall(cjson.decode, raw)
+    if ok and type(envelope) == 'table' and type(envelope.value) == 'string' then
+        return envelope.value, 'envelope'
+    end
+
+    return nil, nil
+end
+
+local function compare(predicate, raw)
+    local value, codec = decode(raw)
+    if value == nil then
+        -- cannot be decoded here, python decides
+        return true
+    end
+
+    local candidates = predicate[codec]
+    if predicate.comparison == 'number' then
+        value = tonumber(value)
+        if value == nil then
+            return true
+        end
+
+        for _, candidate in ipairs(candidates) do
+            local expected = tonumber(candidate)
+            if expected == nil then
+                return true
+            elseif predicate.operator == 'gt' then
+                return value > expected
+            elseif predicate.operator == 'gte' then
+                return value >= expected
+            elseif predicate.operator == 'lt' then
+                return value < expected
+            elseif predicate.operator == 'lte' then
+                return value <= expected
+            elseif value == expected then
+                return true
+            end
+        end
+
+        return false
+    end
+
+    for _, candidate in ipairs(candidates) do
+        if value == candidate then
+            return true
+        end
+    end
+
+    return false
+end
+
+local predicates = {}
+local names = {}
+local index = 4
+while index <= #ARGV do
+    local predicate = {name = ARGV[index], comparison = ARGV[index + 1], operator = ARGV[index + 2]}
+    index = index + 3
+    for _, codec in ipairs({'envelope', 'compact'}) do
+        local size = tonumber(ARGV[index])
+        predicate[codec] = {unpack(ARGV, index + 1, index + size)}
+        index = index + size + 1
+    end
+
+    table.insert(predicates, predicate)
+    table.insert(names, predicate.name)
+end
+
+local reply = redis.call('SCAN', ARGV[1], 'MATCH', ARGV[2], 'COUNT', ARGV[3])
+local matching = {}
+for _, key in ipairs(reply[2]) do
+    if not string.find(key, ':field:', 1, true) then
+        local values = redis.call('HMGET', key, unpack(names))
+        local matches = true
+        for position, predicate in ipairs(predicates) do
+            if not compare(predicate, values[position]) then
+                matches = false
+                break
+            end
+        end
+
+        if matches then
+            table.insert(matching, key)
+        end
+    end
+end
+
+return {reply[1], matching}
+"""
+FILTER_SCRIPT_SHA = hashlib.sha1(FILTER_SCRIPT).hexdigest()
+
+
+def compile_lookups(model, lookups):
+    """returns the ``ARGV`` of the filter script for the lookups that
+    it can compare, an empty list when none of them can be compared.
+
+    **arguments**
+
+    * ``model`` - the model class
+    * ``lookups`` - a dict with the keyword arguments of ``filter()``
+    """
+    arguments = []
+    for lookup, expected in sorted(lookups.items()):
+        name, operator = parse_lookup(lookup)
+        field = model.__fields__[name]
+        comparison = field.__script_comparison__
+        if comparison is None or name in model.__string_fields__:
+            continue
+
+        values = operator == 'in' and list(expected) or [expected]
+        if any(v is None for v in values):
+            continue
+
+        if comparison == 'number':
+            envelope = compact = [repr(field.to_score(v)) for v in values]
+        elif operator in RANGE_OPERATORS:
+            continue
+        else:
+            values = [field.cast(v) for v in values]
+            envelope = [field.to_string(v) for v in values]
+            compact = [field.pack(v) for v in values]
+
+        arguments.extend([name, comparison, operator, len(envelope)] + envelope + [len(compact)] + compact)
+
+    return arguments
+
+
+def scan_matching(conn, cursor, pattern, count, arguments):
+    """runs a single step of the filter script, returns a tuple with
+    the next cursor and the matching keys"""
+    arguments = [cursor, pattern, count] + list(arguments)
+    try:
+        cursor, keys = conn.evalsha(FILTER_SCRIPT_SHA, 0, *arguments)
+    except NoScriptError:
+        conn.script_load(FILTER_SCRIPT)
+        cursor, keys = conn.evalsha(FILTER_SCRIPT_SHA, 0, *arguments)
+
+    return int(cursor), keys
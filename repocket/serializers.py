@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Per-model functions that turn instances into redis data and back,
+built by :py:class:`~repocket.registry.ActiveRecordRegistry` once,
+when the model class is defined.
+
+The type checks, codec lookups and attribute lookups are resolved
+ahead of time, so saving an instance or hydrating it from redis only
+runs the steps its attributes need:
+
+* ``Model.__encoder__(instance, fields=None)`` returns the same dict as
+  :py:meth:`~repocket.model.ActiveRecord.to_dict`
+* ``Model.__decoder__(raw, strings, deferred, alias)`` returns the
+  instance that :py:meth:`~repocket.manager.ActiveRecordManager.build_item`
+  would build through ``Model(**data)``, casting every value once. It
+  does not call ``__init__`` but the ``__post_load__`` method of the
+  model, when declared. Models that define their own ``__init__`` are
+  still built through ``Model(**data)``, see :py:func:`build_with_init`
+
+:py:meth:`~repocket.model.ActiveRecord.to_dict` and
+``ActiveRecord.__init__`` remain the reference implementation.
+"""
+import copy
+import json
+import logging
+
+from repocket.attributes import Attribute, ByteStream, Pointer, get_decoder
+from repocket.codecs import COMPACT_V1, COMPACT_V1_NULL, CompactCodec, EnvelopeCodec, get_codec
+from repocket.compression import COMPRESSED, compress_value, decompress_value, unpack_stream
+
+logger = logging.getLogger('repocket.serializers')
+
+
+def _is_overridden(field, name):
+    return getattr(type(field), name).__func__ is not getattr(Attribute, name).__func__
+
+
+def overrides_init(Model):
+    """returns ``True`` when the model, or one of its bases, defines
+    an ``__init__`` other than the one of ``ActiveRecord``"""
+    root = [cls for cls in Model.__mro__ if isinstance(cls, type(Model))][-1]
+    return Model.__init__.__func__ is not root.__dict__['__init__']
+
+
+def build_with_init(Model, data, deferred=frozenset(), alias=None):
+    """returns a persisted instance built through ``Model(**data)``,
+    like the reference implementation, calling ``__post_load__`` too"""
+    instance = Model(**data)
+    if deferred:
+        instance._defer_fields(deferred)
+
+    if alias:
+        instance._using = alias
+
+    instance._mark_as_persisted()
+    if Model.__post_load__ is not None:
+        instance.__post_load__()
+
+    return instance
+
+
+def build_value_encoder(codec, field):
+    """returns a function that takes a python value and returns the
+    raw string stored in the hash"""
+    if isinstance(codec, CompactCodec):
+        pack = field.pack
+
+        def encode(value):
+            if value is None:
+                return COMPACT_V1_NULL
+
+            return COMPACT_V1 + pack(value)
+
+    elif isinstance(codec, EnvelopeCodec) and not _is_overridden(field, 'to_json') and not _is_overridden(field, 'to_python'):
+        module_name = type(field).__module__
+        type_name = type(field).__name__
+        to_string = field.to_string
+
+        def encode(value):
+            return json.dumps({'module': module_name, 'type': type_name, 'value': to_string(value)}, default=bytes)
+
+    else:
+        def encode(value):
+            return codec.encode(field, value)
+
+    if not field.compress:
+        return encode
+
+    def encode_and_compress(value):
+        return compress_value(field.compress, field.threshold, encode(value))
+
+    return encode_and_compress
+
+
+def build_value_decoder(field):
+    """returns a function that takes the raw string stored in the
+    hash, by any codec, and returns the python value cast once"""
+    declared_type = (type(field).__module__, type(field).__name__)
+    cast = field.cast
+    unpack = field.unpack
+
+    def decode_envelope(raw_value):
+        try:
+            data = json.loads(raw_value)
+        except Exception:
+            logger.error('Failed to deserialize value: {0}'.format(repr(raw_value)))
+            return
+
+        if (data['module'], data['type']) == declared_type:
+            return cast(data['value'])
+
+        # stored by another attribute type
+        value = get_decoder(data['module'], data['type'])(data['value'])
+        return value and cast(value)
+
+    def decode(raw_value):
+        marker = raw_value[:1]
+        if marker == COMPRESSED:
+            raw_value = decompress_value(raw_value)
+            marker = raw_value[:1]
+
+        if marker == COMPACT_V1:
+            return unpack(raw_value[1:])
+
+        if marker == COMPACT_V1_NULL:
+            return
+
+        return decode_envelope(raw_value)
+
+    return decode
+
+
+def build_encoder(Model):
+    """returns the ``__encoder__`` of the given model class"""
+    codec = get_codec(Model.__codec__)
+    steps = []
+    for name, field in Model.__fields__.items():
+        is_stream = isinstance(field, ByteStream)
+        is_pointer = isinstance(field, Pointer)
+        steps.append((name, field, is_stream, is_pointer, build_value_encoder(codec, field)))
+
+    def encode(instance, fields=None):
+        data = {
+            'hash': {},
+            'strings': {},
+        }
+        for name, field, is_stream, is_pointer, encode_value in steps:
+            if fields is not None and name not in fields:
+                continue
+
+            if is_stream:
+                data['strings'][name] = getattr(instance, name, field.get_empty_value())
+                continue
+
+            if is_pointer:
+                # serializing a pointer does not require resolving it
+                value = instance._get_reference(name)
+            else:
+                value = getattr(instance, name, field.get_empty_value())
+
+            try:
+                data['hash'][name] = encode_value(value)
+            except Exception as e:
+                logger.error('Failed to serialize field {0}.{1} of type {2} with value: {3} - {4}'.format(
+                    Model.__name__,
+                    name,
+                    type(value),
+                    value,
+                    e
+                ))
+                data['hash'][name] = field.get_empty_value()
+
+        return data
+
+    return encode
+
+
+def build_decoder(Model):
+    """returns the ``__decoder__`` of the given model class"""
+    string_fields = Model.__string_fields__
+    hash_steps = [(name, field, build_value_decoder(field)) for name, field in Model.__fields__.items() if name not in string_fields]
+    lazy_streams = Model.__lazy_streams__
+    mutable_fields = Model.__mutable_fields__
+    post_load = Model.__post_load__
+    with_init = overrides_init(Model)
+
+    def decode(raw, strings=None, deferred=frozenset(), alias=None):
+        if lazy_streams:
+            deferred = deferred.union(lazy_streams)
+
+        if deferred:
+            # shared by all the instances built with the same fields
+            deferred = frozenset(deferred)
+
+        if with_init:
+            # the model prepares its own state in __init__
+            values = {}
+        else:
+            instance = Model.__new__(Model)
+            values = instance.__dict__
+
+        for name, field, decode_value in hash_steps:
+            if name in deferred:
+                continue
+
+            raw_value = raw.get(name)
+            try:
+                value = raw_value and decode_value(raw_value)
+            except TypeError as e:
+                logger.error('Failed to deserialize field {0}.{1} because: {2}'.format(Model.__name__, name, str(e)))
+                raise
+
+            values[name] = value or field.get_empty_value()
+
+        strings = strings or {}
+        for name, field in string_fields.items():
+            if name not in deferred:
+                value = strings.get(name)
+                values[name] = value and unpack_stream(value) or field.get_empty_value()
+
+        if with_init:
+            return build_with_init(Model, values, deferred, alias)
+
+        if deferred:
+            values['_deferred_fields'] = deferred
+
+        if alias:
+            values['_using'] = alias
+
+        if mutable_fields:
+            # see ActiveRecord.get_dirty_fields()
+            values['_snapshots'] = dict([(name, copy.deepcopy(values[name])) for name in mutable_fields if name in values])
+
+        values['_persisted'] = True
+        if post_load is not None:
+            post_load(instance)
+
+        return instance
+
+    return decode
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Client-side sharding: the records of a connection alias are spread
+across many redis nodes by consistent hashing of their redis hash key.
+
+Every node is a connection pool configured with its own alias, then
+the nodes are grouped under the alias used by the models:
+
+::
+
+    configure.connection_pool(hostname='redis-a', alias='node-a')
+    configure.connection_pool(hostname='redis-b', alias='node-b')
+    configure.shards(['node-a', 'node-b'])
+
+All the keys of a record, including its ``ByteStream`` keys and its
+entries in the secondary indexes, are stored in the node of its hash
+key. ``all()`` and ``filter()`` query every node in parallel and merge
+the results.
+
+After adding a node, the records that now belong to another node are
+moved in the background:
+
+::
+
+    configure.shards(['node-a', 'node-b', 'node-c'])
+    Rebalancer().start()
+
+The progress is stored in each node, so a rebalancer that was stopped
+or crashed resumes from where it stopped.
+
+Records are read from and written to the node of the new ring right
+away, so until the rebalancer moves a record, ``get()`` and ``filter()``
+do not find it and a ``save()`` stores a new version in the new node,
+which the rebalancer keeps instead of the old one. Add the node and
+run the rebalancer before sending traffic to it, for example during a
+maintenance window, when the records must always be found.
+"""
+import bisect
+import hashlib
+import logging
+import threading
+
+from redis.exceptions import ResponseError
+
+from repocket._cache import MODELS
+
+logger = logging.getLogger('repocket.sharding')
+
+
+def get_routing_key(key):
+    """returns the part of the key used to choose the node: the
+    content of the first ``{hash tag}``, if any, otherwise the whole
+    key, just like redis cluster does"""
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+
+    return key
+
+
+class HashRing(object):
+    """a consistent hash ring of node aliases.
+
+    **arguments**
+
+    * ``nodes`` - a list with the aliases of the nodes
+    * ``replicas`` - the amount of points of each node in the ring, defaults to ``160``
+    """
+    def __init__(self, nodes, replicas=160):
+        if not nodes:
+            raise ValueError('a hash ring needs at least one node')
+
+        self.nodes = list(nodes)
+        self.replicas = replicas
+        self.ring = {}
+        for node in self.nodes:
+            for index in range(replicas):
+                self.ring[self._hash('{0}-{1}'.format(node, index))] = node
+
+        self.points = sorted(self.ring)
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(value).hexdigest()[:8], 16)
+
+    def get_node(self, key):
+        """returns the alias of the node that stores the given key"""
+        point = self._hash(get_routing_key(key))
+        position = bisect.bisect(self.points, point) % len(self.points)
+        return self.ring[self.points[position]]
+
+
+class Rebalancer(threading.Thread):
+    """daemon thread that moves every record to the node where the
+    ring of the given alias expects it, SCAN batch by SCAN batch.
+
+    The SCAN cursor of every node is saved in the node itself after
+    each batch, and removed when the node is done.
+
+    **arguments**
+
+    * ``using`` - the sharded connection alias, defaults to ``default``
+    * ``batch_size`` - the ``COUNT`` hint of each ``SCAN`` call, defaults to ``100``
+    * ``timeout`` - the milliseconds ``MIGRATE`` waits for the target node, defaults to ``5000``
+    """
+    checkpoint_key = b'repocket-rebalance:cursor'
+
+    def __init__(self, using=None, batch_size=100, timeout=5000):
+        super(Rebalancer, self).__init__(name='repocket-rebalancer')
+        self.daemon = True
+        self.using = using
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.moved = 0
+        self.running = True
+
+    def run(self):
+        try:
+            self.rebalance()
+        except Exception:
+            logger.exception('rebalancing %s stopped, run it again to resume', self.using)
+
+    def stop(self):
+        """stops after the current batch, the next rebalancer resumes from it"""
+        self.running = False
+
+    def rebalance(self):
+        """moves the misplaced records of every node, synchronously"""
+        from repocket.connections import configure
+
+        ring = configure.get_ring(self.using)
+        for node in ring.nodes:
+            source = configure.get_connection(node)
+            cursor = int(source.get(self.checkpoint_key) or 0)
+            while self.running:
+                cursor, keys = source.scan(cursor, match=b'repocket:*', count=self.batch_size)
+                for key in keys:
+                    target = ring.get_node(key)
+                    if target != node and b':field:' not in key:
+                        self.move(key, source, configure.get_connection(target))
+
+                if cursor == 0:
+                    source.delete(self.checkpoint_key)
+                    break
+
+                source.set(self.checkpoint_key, cursor)
+
+    def move(self, key, source, target):
+        """moves a single record, with its strings and index entries,
+        from the source to the target connection.
+
+        Every key is moved atomically, with ``MOVE`` when both nodes
+        are databases of the same server or ``MIGRATE`` otherwise, and
+        a key that already exists in the target is never replaced: it
+        was written through the new ring after the node was added, so
+        the copy left in the source is stale and gets deleted.
+        """
+        try:
+            _, namespace, model_name, primary_key = key.split(b':')
+        except ValueError:
+            return
+
+        Model = MODELS.get(b'.'.join([namespace, model_name]))
+        if Model is None:
+            logger.warning('cannot move %s, the model is not available', key)
+            return
+
+        instance = Model.objects.get_item_from_redis_key(key, connection=source)
+        if instance is None:
+            return
+
+        stored_index_keys = instance._get_stored_index_keys(source)
+        moved = self.transfer(key, source, target)
+        if moved:
+            # the strings of a record only exist along with its hash
+            for name in Model.__string_fields__.keys():
+                field_key = instance._calculate_key_for_field(name)
+                if not self.transfer(field_key, source, target):
+                    source.delete(field_key)
+
+            instance = Model.objects.get_item_from_redis_key(key, connection=target)
+            if instance is not None:
+                pipeline = target.pipeline()
+                instance._update_indexes(pipeline, [])
+                pipeline.execute()
+        else:
+            logger.info('%s was written to its new node during the rebalance, keeping that version', key)
+            source.delete(*[key] + [instance._calculate_key_for_field(n) for n in Model.__string_fields__.keys()])
+
+        pipeline = source.pipeline()
+        instance._remove_from_indexes(pipeline, stored_index_keys)
+        pipeline.execute()
+        self.moved += moved
+
+    def transfer(self, key, source, target):
+        """moves a single key atomically, returns ``False`` when the
+        source does not have it or the target already has it"""
+        source_settings = source.connection_pool.connection_kwargs
+        target_settings = target.connection_pool.connection_kwargs
+        if get_server_address(source_settings) == get_server_address(target_settings):
+            return bool(source.move(key, target_settings.get('db', 0)))
+
+        if 'path' in target_settings:
+            raise ValueError('cannot MIGRATE to the unix socket {0}, configure the node with a hostname'.format(
+                target_settings['path']))
+
+        arguments = [target_settings['host'], target_settings['port'], key, target_settings.get('db', 0), self.timeout]
+        if target_settings.get('password'):
+            arguments.extend(['AUTH', target_settings['password']])
+
+        try:
+            return source.execute_command('MIGRATE', *arguments) == b'OK'
+        except ResponseError as e:
+            if 'BUSYKEY' in str(e):
+                return False
+
+            raise
+
+
+def get_server_address(connection_kwargs):
+    """returns the address of the redis server of the given connection
+    settings, regardless of the database"""
+    return connection_kwargs.get('path') or (connection_kwargs.get('host'), connection_kwargs.get('port'))
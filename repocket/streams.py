@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""File-like access to the contents of
+:py:class:`~repocket.attributes.ByteStream` attributes, without
+holding them in memory.
+
+::
+
+    class Build(ActiveRecord):
+        stdout = attributes.ByteStream(lazy=True)
+
+    build = Build.objects.get(id=build_id)
+    with build.open_stream('stdout', chunk_size=1024 * 1024) as stream:
+        for chunk in iter(lambda: stream.read(stream.chunk_size), b''):
+            sys.stdout.write(chunk)
+
+Every read is a ``GETRANGE`` of at most ``chunk_size`` bytes, so even
+multi-megabyte streams can be consumed with a constant amount of
+memory, for example with :py:meth:`~StreamReader.readinto` and a
+preallocated ``bytearray``. Wrap the reader in
+:py:class:`io.BufferedReader` to read it line by line.
+
+Streams stored in compressed frames, see :py:mod:`repocket.compression`,
+are retrieved and decompressed one frame at a time instead.
+"""
+import io
+
+from repocket.compression import (
+    DECOMPRESSORS, FRAME_HEADER, STREAM_HEADER_SIZE, STREAM_MAGIC, UNCOMPRESSED,
+    is_framed, parse_frame_header,
+)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class StreamReader(io.RawIOBase):
+    """a read-only, seekable file backed by a redis string.
+
+    **arguments**
+
+    * ``connection`` - the redis connection that stores the key
+    * ``key`` - the redis key of the string
+    * ``chunk_size`` - the maximum amount of bytes retrieved by each ``GETRANGE``, defaults to ``64KB``
+    """
+    def __init__(self, connection, key, chunk_size=DEFAULT_CHUNK_SIZE):
+        super(StreamReader, self).__init__()
+        self.connection = connection
+        self.key = key
+        self.chunk_size = chunk_size
+        self.position = 0
+        self._framed = None
+        self._frame = None
+        self._frame_offset = len(STREAM_MAGIC)
+        self._frame_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _is_framed(self):
+        if self._framed is None:
+            pipeline = self.connection.pipeline(transaction=False)
+            pipeline.getrange(self.key, 0, STREAM_HEADER_SIZE - 1)
+            pipeline.strlen(self.key)
+            self._framed = is_framed(*pipeline.execute())
+
+        return self._framed
+
+    def _iter_frame_headers(self, offset=len(STREAM_MAGIC), start=0):
+        """yields a tuple with the stored offset, the header and the
+        original offset of every frame, reading only the headers"""
+        while True:
+            raw_header = self.connection.getrange(self.key, offset, offset + FRAME_HEADER.size - 1)
+            if not raw_header:
+                return
+
+            header = parse_frame_header(raw_header)
+            if header is None:
+                # appended without frames
+                size = self.connection.strlen(self.key) - offset
+                yield offset, (None, size, size), start
+                return
+
+            yield offset, header, start
+            offset += FRAME_HEADER.size + header[1]
+            start += header[2]
+
+    def _get_frame(self):
+        """returns the decompressed frame that contains the current
+        position, ``None`` at the end of the stream"""
+        if self._frame is not None and self._frame_start <= self.position < self._frame_start + len(self._frame):
+            return self._frame
+
+        if self._frame is not None and self.position >= self._frame_start:
+            # reading forward, skip the frames before the current one
+            headers = self._iter_frame_headers(self._frame_offset, self._frame_start)
+        else:
+            headers = self._iter_frame_headers()
+
+        for offset, (identifier, stored_size, size), start in headers:
+            if self.position >= start + size:
+                continue
+
+            self._frame_offset = offset
+            if identifier is None:
+                stored = self.connection.getrange(self.key, offset, -1)
+                identifier = UNCOMPRESSED
+            else:
+                offset += FRAME_HEADER.size
+                stored = self.connection.getrange(self.key, offset, offset + stored_size - 1)
+
+            self._frame = DECOMPRESSORS[identifier](stored)
+            self._frame_start = start
+            return self._frame
+
+    def size(self):
+        """returns the current length of the stream, with ``STRLEN`` or
+        by reading the header of every frame"""
+        if self._is_framed():
+            return sum([header[2] for _, header, _ in self._iter_frame_headers()])
+
+        return self.connection.strlen(self.key)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size()
+
+        self.position = max(offset, 0)
+        return self.position
+
+    def _read_chunk(self, size):
+        size = min(size, self.chunk_size)
+        if self._is_framed():
+            frame = self._get_frame()
+            if frame is None:
+                return b''
+
+            start = self.position - self._frame_start
+            chunk = frame[start:start + size]
+        else:
+            chunk = self.connection.getrange(self.key, self.position, self.position + size - 1)
+
+        self.position += len(chunk)
+        return chunk
+
+    def read(self, size=-1):
+        """reads at most ``chunk_size`` bytes, or everything left when
+        ``size`` is negative"""
+        if size is None or size < 0:
+            return self.readall()
+
+        if size == 0:
+            return b''
+
+        return self._read_chunk(size)
+
+    def readinto(self, buffer):
+        """fills the given ``bytearray`` or ``memoryview`` chunk by
+        chunk, returns the amount of bytes read, ``0`` at the end of
+        the stream"""
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            chunk = self._read_chunk(len(view) - filled)
+            if not chunk:
+                break
+
+            view[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+
+        return filled
+
+    def readall(self):
+        chunks = []
+        while True:
+            chunk = self._read_chunk(self.chunk_size)
+            if not chunk:
+                return b''.join(chunks)
+
+            chunks.append(chunk)
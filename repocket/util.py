@@ -1,3 +1,7 @@
+RANGE_OPERATORS = ('gt', 'gte', 'lt', 'lte')
+LOOKUP_OPERATORS = ('exact', 'in') + RANGE_OPERATORS
+
+
 def is_null(value):
     if value is None:
         return True
@@ -6,3 +10,23 @@ def is_null(value):
         return True
 
     return False
+
+
+def parse_lookup(lookup):
+    """splits a ``filter()`` keyword argument into the field name and
+    the lookup operator, for example:
+
+    ::
+
+        >>> parse_lookup('email')
+        ('email', 'exact')
+        >>> parse_lookup('email__in')
+        ('email', 'in')
+        >>> parse_lookup('created_at__gte')
+        ('created_at', 'gte')
+    """
+    name, _, operator = lookup.rpartition('__')
+    if name and operator in LOOKUP_OPERATORS:
+        return name, operator
+
+    return lookup, 'exact'
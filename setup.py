@@ -45,7 +45,7 @@ setup(
     author='Gabriel Falcao',
     author_email='gabriel@nacaolivre.org',
     url='https://repocket.readthedocs.io',
-    packages=find_packages(exclude=['*tests*']),
+    packages=find_packages(exclude=['*tests*', 'benchmarks*']),
     install_requires=requirements,
     zip_safe=False,
 )
@@ -3,8 +3,12 @@
 from __future__ import unicode_literals
 import uuid
 from datetime import datetime
+from mock import patch
+from redis.client import BasePipeline, StrictRedis
 from repocket.model import ActiveRecord
-from repocket import attributes
+from repocket import attributes, save_many
+from repocket.attributes import Reference
+from repocket.identity import identity_map
 
 from .helpers import clean_slate
 
@@ -312,3 +316,500 @@ def test_delete_user(context):
     deleted_keys.should.equal(1)
 
     User.objects.all().should.be.empty
+
+
+@clean_slate
+def test_object_manager_iterator(context):
+    ('ActiveRecord.objects.iterator() should lazily yield all the saved items of the same kind')
+
+    # Given 5 blog posts
+    for index in range(5):
+        BlogPost(title='post {0}'.format(index), body='content').save()
+
+    # When I call objects.iterator() with a small batch size
+    results = BlogPost.objects.iterator(batch_size=2)
+
+    # Then it should be a generator
+    results.should.be.a('types.GeneratorType')
+
+    # And it should yield every post once, skipping the ByteStream keys
+    posts = list(results)
+    posts.should.have.length_of(5)
+    sorted([p.title for p in posts]).should.equal(['post 0', 'post 1', 'post 2', 'post 3', 'post 4'])
+    set([p.body for p in posts]).should.equal({'content'})
+
+
+@clean_slate
+def test_object_manager_hydrates_items_in_pipelined_batches(context):
+    ('ActiveRecord.objects.get_items_from_redis_keys() should use a single pipeline per batch of keys')
+
+    # Given 5 blog posts
+    keys = [BlogPost(title='post {0}'.format(i), body='body {0}'.format(i)).save()['hash'] for i in range(5)]
+
+    # When I retrieve them in batches of 2
+    with patch.object(BasePipeline, 'execute', autospec=True, side_effect=BasePipeline.execute) as execute:
+        posts = BlogPost.objects.get_items_from_redis_keys(keys, batch_size=2)
+
+    # Then it should have executed 3 pipelines
+    execute.call_count.should.equal(3)
+
+    # And the hashes and ByteStream fields should be loaded
+    [(p.title, p.body) for p in posts].should.equal([('post {0}'.format(i), 'body {0}'.format(i)) for i in range(5)])
+
+
+@clean_slate
+def test_object_manager_skips_missing_keys(context):
+    ('ActiveRecord.objects.get_items_from_redis_keys() should skip the keys that do not exist')
+
+    # Given a user
+    user = User.create(email='foo@bar.com')
+
+    # When I retrieve it along with a missing key
+    results = User.objects.get_items_from_redis_keys([
+        'repocket:tests.functional.test_active_record:User:missing',
+        user._calculate_hash_key(),
+    ])
+
+    # Then only the existing user should be returned
+    results.should.equal([user])
+
+
+@clean_slate
+def test_object_manager_bulk_create(context):
+    ('ActiveRecord.objects.bulk_create() should persist all the instances with one pipeline per batch')
+
+    # Given 5 unsaved blog posts
+    posts = [BlogPost(title='post {0}'.format(i), body='body {0}'.format(i)) for i in range(5)]
+
+    # When I call bulk_create with batches of 2
+    with patch.object(BasePipeline, 'execute', autospec=True, side_effect=BasePipeline.execute) as execute:
+        results = BlogPost.objects.bulk_create(posts, batch_size=2)
+
+    # Then it should have executed 3 pipelines
+    execute.call_count.should.equal(3)
+
+    # And it should return the instances with their primary keys
+    results.should.equal(posts)
+    [p.id for p in results].should_not.contain(None)
+
+    # And they should be stored in redis
+    stored = BlogPost.objects.get(id=posts[3].id)
+    stored.title.should.equal('post 3')
+    stored.body.should.equal('body 3')
+
+
+@clean_slate
+def test_object_manager_bulk_create_wrong_model(context):
+    ('ActiveRecord.objects.bulk_create() should refuse instances of other models')
+
+    BlogPost.objects.bulk_create.when.called_with([User()]).should.throw(TypeError)
+
+
+@clean_slate
+def test_save_many_without_transaction(context):
+    ('repocket.save_many() should persist instances of different models')
+
+    # Given a user and a blog post
+    user = User(email='foo@bar.com')
+    post = BlogPost(title='hello', body='world')
+
+    # When I call save_many without transactions
+    keys = save_many([user, post], transaction=False)
+
+    # Then it should return the keys of each instance
+    keys.should.equal([
+        {'hash': user._calculate_hash_key(), 'strings': {}},
+        {'hash': post._calculate_hash_key(), 'strings': {'body': post._calculate_key_for_field('body')}},
+    ])
+
+    # And both should be stored
+    User.objects.get(id=user.id).should.equal(user)
+    BlogPost.objects.get(id=post.id).title.should.equal('hello')
+
+
+class CompactUser(ActiveRecord):
+    __codec__ = 'compact'
+
+    id = attributes.AutoUUID()
+    email = attributes.Unicode()
+    score = attributes.Integer()
+    github_metadata = attributes.JSON()
+
+
+@clean_slate
+def test_save_with_compact_codec(context):
+    ('Models declared with __codec__ = "compact" should store the raw values')
+
+    # Given that I save a compact user
+    user = CompactUser.create(
+        id='295decfd-deb5-11e5-88db-6c4008a70392',
+        email='foo@bar.com',
+        score=42,
+        github_metadata={'yay': 'this is json baby!'},
+    )
+
+    # Then the hash should contain the raw values prefixed by the codec version
+    result = context.connection.hgetall(user._calculate_hash_key())
+    result.should.equal({
+        'id': b'\x01' + uuid.UUID('295decfd-deb5-11e5-88db-6c4008a70392').bytes,
+        'email': b'\x01foo@bar.com',
+        'score': b'\x0142',
+        'github_metadata': b'\x01{"yay": "this is json baby!"}',
+    })
+
+    # And it should be retrieved intact
+    CompactUser.objects.get(id=user.id).should.equal(user)
+
+
+@clean_slate
+def test_compact_codec_reads_envelope_values(context):
+    ('Models using the compact codec should still read hashes stored with the envelope codec')
+
+    # Given a hash stored with the envelope codec
+    key = 'repocket:tests.functional.test_active_record:CompactUser:295decfd-deb5-11e5-88db-6c4008a70392'
+    context.connection.hmset(key, {
+        'id': '{"type": "AutoUUID", "value": "295decfd-deb5-11e5-88db-6c4008a70392", "module": "repocket.attributes"}',
+        'email': '{"type": "Unicode", "value": "foo@bar.com", "module": "repocket.attributes"}',
+    })
+
+    # When I retrieve it
+    user = CompactUser.objects.get(id='295decfd-deb5-11e5-88db-6c4008a70392')
+
+    # Then the values should be decoded
+    user.email.should.equal('foo@bar.com')
+    user.id.should.equal(uuid.UUID('295decfd-deb5-11e5-88db-6c4008a70392'))
+
+
+@clean_slate
+def test_pointer_is_resolved_lazily(context):
+    ('Retrieving an item should not retrieve its references until they are accessed')
+
+    # Given a post with an author
+    author = User.create(email='foo@bar.com')
+    post = BlogPost.create(title='hello', author=author)
+
+    # When I retrieve the post
+    result = BlogPost.objects.get(id=post.id)
+
+    # Then the author should not be retrieved yet
+    result._get_reference('author').should.be.a(Reference)
+
+    # And it should be retrieved when accessed
+    result.author.should.be.a(User)
+    result.author.should.equal(author)
+    result._get_reference('author').should.be.a(User)
+
+
+@clean_slate
+def test_prefetch_retrieves_each_reference_once(context):
+    ('ResultSet.prefetch() should retrieve all the distinct references in a single pipeline')
+
+    # Given 2 authors with 3 posts
+    foo = User.create(email='foo@bar.com')
+    bar = User.create(email='bar@foo.com')
+    BlogPost.create(title='one', author=foo)
+    BlogPost.create(title='two', author=foo)
+    BlogPost.create(title='three', author=bar)
+
+    posts = BlogPost.objects.all()
+
+    # When I prefetch the authors
+    with patch.object(User.objects, 'get_items_from_redis_keys', wraps=User.objects.get_items_from_redis_keys) as get_items:
+        result = posts.prefetch('author')
+
+    # Then it should return the same result set
+    result.should.be(posts)
+
+    # And it should have retrieved the 2 distinct authors at once
+    get_items.call_count.should.equal(1)
+    get_items.call_args[0][0].should.have.length_of(2)
+
+    # And every post should have its author
+    dict([(p.title, p._get_reference('author').email) for p in posts]).should.equal({
+        'one': 'foo@bar.com',
+        'two': 'foo@bar.com',
+        'three': 'bar@foo.com',
+    })
+
+    # And no post should have changed
+    [p.get_dirty_fields() for p in posts].should.equal([set(), set(), set()])
+
+
+@clean_slate
+def test_filter_by_pointer_does_not_retrieve_references(context):
+    ('ActiveRecord.objects.filter() should compare pointers without retrieving them')
+
+    # Given 2 authors with 3 posts
+    foo = User.create(email='foo@bar.com')
+    bar = User.create(email='bar@foo.com')
+    BlogPost.create(title='one', author=foo)
+    BlogPost.create(title='two', author=bar)
+
+    # When I filter posts by author
+    with patch.object(User.objects, 'get', wraps=User.objects.get) as get:
+        results = BlogPost.objects.filter(author=foo)
+
+    # Then it should find the post
+    [p.title for p in results].should.equal(['one'])
+
+    # And no author should be retrieved
+    get.called.should.be.false
+
+
+@clean_slate
+def test_identity_map_context(context):
+    ('ActiveRecord.objects.get() should return the same instance within an identity map context')
+
+    # Given a saved user
+    user_id = User.create(email='foo@bar.com').id
+
+    with identity_map() as items:
+        # When I retrieve it twice
+        user1 = User.objects.get(id=user_id)
+        with patch.object(BasePipeline, 'execute', autospec=True, side_effect=BasePipeline.execute) as execute:
+            user2 = User.objects.get(id=user_id)
+
+        # Then it should be the same instance, without a round-trip
+        user2.should.be(user1)
+        execute.called.should.be.false
+        items.stats()['hits'].should.equal(1)
+
+        # And deleting it should evict it
+        user1.delete()
+        User.objects.get(id=user_id).should.be.none
+
+    # And outside of the context the instances should be new
+    User.objects.get(id=user_id).should.be.none
+
+
+@clean_slate
+def test_identity_map_per_model(context):
+    ('ActiveRecord.objects.use_identity_map() should keep the saved and retrieved items of a model')
+
+    items = User.objects.use_identity_map(max_size=10)
+    try:
+        # Given a saved user
+        user = User.create(email='foo@bar.com')
+
+        # Then retrieving it should return the saved instance
+        User.objects.get(id=user.id).should.be(user)
+        User.objects.all().should.equal([user])
+        User.objects.all()[0].should.be(user)
+        items.stats()['hits'].should.equal(3)
+    finally:
+        User.objects.use_identity_map(max_size=0).should.be.none
+
+
+@clean_slate
+def test_only_retrieves_the_given_fields(context):
+    ('ActiveRecord.objects.only() should retrieve only the given fields and defer the others')
+
+    # Given a blog post
+    author = User.create(email='foo@bar.com')
+    post = BlogPost.create(title='hello', body='a very long body', author=author, created_at=datetime(2015, 2, 25))
+
+    # When I retrieve it with only the title
+    results = BlogPost.objects.only('title').all()
+
+    # Then the title and id should be loaded
+    result = results[0]
+    result.__dict__.should.have.key('title').being.equal('hello')
+    result.__dict__.should.have.key('id').being.equal(post.id)
+
+    # And the other fields should be deferred
+    result.get_deferred_fields().should.equal({'author', 'created_at', 'body'})
+    result.__dict__.should_not.have.key('body')
+
+    # And they should be retrieved when accessed
+    result.body.should.equal('a very long body')
+    result.created_at.should.equal(datetime(2015, 2, 25))
+    result.author.should.equal(author)
+    result.get_deferred_fields().should.be.empty
+    result.should.equal(post)
+
+
+@clean_slate
+def test_defer_skips_the_given_fields(context):
+    ('ActiveRecord.objects.defer() should not retrieve the given fields')
+
+    # Given a blog post
+    post = BlogPost.create(title='hello', body='a very long body')
+
+    # When I retrieve it deferring the body
+    result = BlogPost.objects.defer('body').get(post.id)
+
+    # Then the body should be deferred
+    result.get_deferred_fields().should.equal({'body'})
+    result.title.should.equal('hello')
+
+    # And retrieved when accessed
+    result.body.should.equal('a very long body')
+
+
+@clean_slate
+def test_only_with_filter(context):
+    ('ActiveRecord.objects.only().filter() should retrieve the filtered fields')
+
+    # Given 2 blog posts
+    BlogPost.create(title='hello', body='first body')
+    BlogPost.create(title='world', body='second body')
+
+    # When I filter them by title while deferring everything else
+    results = BlogPost.objects.only('id').filter(title='world')
+
+    # Then the result should contain the matching post
+    results.should.have.length_of(1)
+    results[0].get_deferred_fields().should.equal({'author', 'created_at', 'body'})
+    results[0].body.should.equal('second body')
+
+
+@clean_slate
+def test_only_invalid_field(context):
+    ('ActiveRecord.objects.only() should not accept unknown fields')
+
+    BlogPost.objects.only.when.called_with('subtitle').should.throw(AttributeError)
+
+
+@clean_slate
+def test_save_writes_only_dirty_fields(context):
+    ('ActiveRecord.save() should only write the attributes that changed since retrieved')
+
+    # Given a blog post retrieved from redis
+    post = BlogPost.create(title='hello', body='first body')
+    result = BlogPost.objects.get(post.id)
+    result.get_dirty_fields().should.be.empty
+
+    # And the body and created_at were changed by someone else
+    post.body = 'changed body'
+    post.created_at = datetime(2015, 2, 25)
+    post.save()
+
+    # When I change the title of the retrieved post and save it
+    result.title = 'world'
+    result.get_dirty_fields().should.equal({'title'})
+    result.save()
+
+    # Then the title should be written
+    stored = BlogPost.objects.get(post.id)
+    stored.title.should.equal('world')
+
+    # And the other attributes should be kept
+    stored.body.should.equal('changed body')
+    stored.created_at.should.equal(datetime(2015, 2, 25))
+
+    # And the retrieved post should be clean again
+    result.get_dirty_fields().should.be.empty
+
+
+@clean_slate
+def test_save_writes_mutable_values_changed_in_place(context):
+    ('ActiveRecord.save() should write the JSON values that were changed in place')
+
+    # Given a user with metadata
+    user = CompactUser(email='foo@bar.com', github_metadata={'a': 1})
+    user.save()
+    user.get_dirty_fields().should.be.empty
+
+    # When I change the metadata in place and save it
+    user.github_metadata['b'] = 2
+    user.get_dirty_fields().should.equal({'github_metadata'})
+    user.save()
+
+    # Then the change should be stored
+    stored = CompactUser.objects.get(user.id)
+    stored.github_metadata.should.equal({'a': 1, 'b': 2})
+    stored.get_dirty_fields().should.be.empty
+
+    # And changes to a retrieved item should be stored too
+    stored.github_metadata['c'] = 3
+    stored.save()
+    CompactUser.objects.get(user.id).github_metadata.should.equal({'a': 1, 'b': 2, 'c': 3})
+
+
+@clean_slate
+def test_save_after_delete_writes_every_field(context):
+    ('ActiveRecord.save() should store the whole item again after it was deleted')
+
+    # Given a user retrieved from redis
+    user_id = CompactUser.create(email='foo@bar.com', github_metadata={'a': 1}).id
+    user = CompactUser.objects.get(user_id)
+
+    # When I delete it and save it again
+    user.delete()
+    user.is_persisted().should.be.false
+    user.save()
+
+    # Then every field should be stored
+    stored = CompactUser.objects.get(user.id)
+    stored.email.should.equal('foo@bar.com')
+    stored.github_metadata.should.equal({'a': 1})
+
+
+@clean_slate
+def test_save_without_changes_does_not_write(context):
+    ('ActiveRecord.save() should not write anything when nothing changed')
+
+    # Given a blog post retrieved from redis
+    post = BlogPost.create(title='hello', body='first body')
+    result = BlogPost.objects.get(post.id)
+
+    # When I save it without changes
+    with patch.object(StrictRedis, 'hmset') as hmset:
+        result.save()
+
+    # Then no hash should be written
+    hmset.called.should.be.false
+
+
+@clean_slate
+def test_save_force_writes_all_fields(context):
+    ('ActiveRecord.save(force=True) should write all the attributes')
+
+    # Given a blog post retrieved from redis
+    post = BlogPost.create(title='hello', body='first body')
+    result = BlogPost.objects.get(post.id)
+
+    # And the body was changed by someone else
+    post.body = 'changed body'
+    post.save()
+
+    # When I force saving the retrieved post
+    result.save(force=True)
+
+    # Then the body should be overwritten
+    BlogPost.objects.get(post.id).body.should.equal('first body')
+
+
+@clean_slate
+def test_background_get_save_and_delete(context):
+    ('ActiveRecord.asave(), objects.aget() and adelete() should run in the background')
+
+    # Given a user saved in the background
+    user = User(email='foo@bar.com')
+    user.asave().get(timeout=5)
+
+    # When I retrieve it in the background
+    result = User.objects.aget(user.id).get(timeout=5)
+
+    # Then it should be the same user
+    result.should.equal(user)
+
+    # And when I delete it in the background
+    user.adelete().get(timeout=5)
+
+    # Then it should be gone
+    User.objects.get(user.id).should.be.none
+
+
+@clean_slate
+def test_background_all(context):
+    ('ActiveRecord.objects.aall() should yield all the items')
+
+    # Given 5 users
+    users = [User.create(email='user{0}@bar.com'.format(i)) for i in range(5)]
+
+    # When I iterate them in batches of 2
+    results = list(User.objects.aall(batch_size=2))
+
+    # Then all of them should be yielded
+    sorted(results, key=lambda u: u.email).should.equal(users)
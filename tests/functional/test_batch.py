@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import weakref
+from array import array
+from mock import patch
+from repocket.model import ActiveRecord
+from repocket.manager import ActiveRecordManager
+from repocket.batch import RecordBatch
+from repocket import attributes
+
+from .helpers import clean_slate
+
+
+class Measurement(ActiveRecord):
+    id = attributes.AutoUUID()
+    sensor = attributes.Unicode(index=True)
+    value = attributes.Float()
+    position = attributes.Integer()
+
+
+@clean_slate
+def test_as_batch_stores_the_matching_items(context):
+    ('QuerySet#as_batch() should store only the selected attributes of the matching items')
+
+    # Given measurements of 2 sensors
+    for i in range(10):
+        Measurement.create(sensor=i % 2 and 'north' or 'south', value=float(i), position=i)
+
+    # When I retrieve the values of the north sensor as a batch
+    batch = Measurement.objects.filter(sensor='north').as_batch('value')
+
+    # Then the batch should have the values of the matching items
+    batch.should.be.a(RecordBatch)
+    sorted(batch.column('value')).should.equal([1.0, 3.0, 5.0, 7.0, 9.0])
+    batch.column('value').should.be.an(array)
+
+    # And the rows can be turned back into instances
+    item = batch[0]
+    item.sensor.should.equal('north')
+    item.position.should.equal(int(item.value))
+
+    # And the manager can store every item
+    len(Measurement.objects.as_batch()).should.equal(10)
+
+
+@clean_slate
+def test_as_batch_streams_the_items(context):
+    ('QuerySet#as_batch() should not keep more than a batch of instances alive')
+
+    # Given 60 measurements
+    for i in range(60):
+        Measurement.create(sensor='north', value=float(i), position=i)
+
+    # And a decoder that tracks the instances alive
+    alive = weakref.WeakSet()
+    peaks = []
+
+    def decode(*args):
+        item = decode.original(*args)
+        alive.add(item)
+        peaks.append(len(alive))
+        return item
+
+    decode.original = Measurement.__decoder__
+
+    # When I store all of them as a batch, 5 per round-trip
+    with patch.object(Measurement, '__decoder__', side_effect=decode):
+        batch = ActiveRecordManager(Measurement, batch_size=5).as_batch('value')
+
+    # Then every item should be stored
+    sorted(batch.column('value')).should.equal([float(i) for i in range(60)])
+
+    # And only the instances of a batch should have been alive at a time
+    max(peaks).should.be.lower_than(20)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import json
+import os
+import tempfile
+from mock import patch
+from repocket import configure
+from benchmarks.fixtures import BlogPost
+from benchmarks.runner import main
+from benchmarks.suite import BENCHMARKS, Run, run_benchmarks
+
+from .helpers import clean_slate
+
+
+@clean_slate
+def test_run_benchmarks_reports_every_benchmark(context):
+    ('run_benchmarks() should report the throughput, latency, round trips and memory of every benchmark')
+
+    # Given a run with 30 rows
+    run = Run(30, sample=10, repeat=2)
+
+    # When I run the benchmarks
+    results = run_benchmarks(run)
+
+    # Then every benchmark should be reported
+    sorted(results.keys()).should.equal(sorted([name for name, _, _, _, _ in BENCHMARKS]))
+    results['get'].should.have.key('operations').being.equal(10)
+    results['get'].should.have.key('round_trips_per_op').being.equal(1.0)
+    results['all'].should.have.key('operations').being.equal(2)
+    results['all'].should.have.key('items_per_operation').being.equal(30)
+
+    for result in results.values():
+        result['ops_per_sec'].should.be.greater_than(0)
+        result['p99_ms'].should.be.greater_than_or_equal_to(result['p50_ms'])
+
+    # And the serialization benchmarks should not count round trips
+    results['model.encode']['round_trips_per_op'].should.be.none
+
+
+@clean_slate
+def test_run_benchmarks_populates_redis_for_the_queries(context):
+    ('run_benchmarks() should store the rows when only the query benchmarks are selected')
+
+    # When I run only the get() benchmark
+    results = run_benchmarks(Run(5), ['get'])
+
+    # Then the posts should have been stored
+    results.keys().should.equal(['get'])
+    BlogPost.objects.count().should.equal(5)
+
+
+@clean_slate
+def test_main_saves_and_compares_json_reports(context):
+    ('python -m benchmarks should save the results as JSON and compare two reports')
+
+    # Given a temporary file
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as fd:
+        path = fd.name
+
+    # And the connection settings, which main() replaces
+    connections = patch.multiple(
+        configure, pool=configure.pool, pools=dict(configure.pools), clients=dict(configure.clients),
+        settings=dict(configure.settings), rings=dict(configure.rings), pid=configure.pid)
+
+    try:
+        # When I run the benchmarks of 2 sizes
+        with connections:
+            main(['--rows', '5,10', '--db', '0', '--force', '--benchmark', 'count', '--output', path]).should.equal(0)
+
+        # Then the report should have a run per size
+        with open(path) as fd:
+            report = json.load(fd)
+
+        report.should.have.key('backend').being.equal('redis')
+        [r['rows'] for r in report['runs']].should.equal([5, 10])
+        report['runs'][0]['benchmarks'].keys().should.equal(['count'])
+
+        # And comparing the report with itself finds no regressions
+        main(['--compare', path, path]).should.equal(0)
+    finally:
+        os.remove(path)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import io
+from repocket.model import ActiveRecord
+from repocket.compression import COMPRESSED, STREAM_MAGIC
+from repocket import attributes
+
+from .helpers import clean_slate
+
+
+class Repository(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+    readme = attributes.Unicode(compress='zlib', threshold=256)
+    log = attributes.ByteStream(compress='zlib', threshold=256)
+
+
+class Release(ActiveRecord):
+    __codec__ = 'compact'
+
+    id = attributes.AutoUUID()
+    metadata = attributes.JSON(compress='bz2', threshold=256)
+
+
+@clean_slate
+def test_large_values_are_compressed(context):
+    ('Attributes declared with compress should store the large values compressed')
+
+    # Given a repository with a large readme and log
+    readme = '# repocket\n' * 100
+    repository = Repository.create(name='repocket', readme=readme, log=b'cloned\n' * 100)
+
+    # Then the readme should be compressed
+    key = repository._calculate_hash_key()
+    context.connection.hget(key, 'readme')[:1].should.equal(COMPRESSED)
+    context.connection.hget(key, 'name')[:1].should.equal(b'{')
+
+    # And the log should be stored in frames
+    stored = context.connection.get(repository._calculate_key_for_field('log'))
+    stored[:len(STREAM_MAGIC)].should.equal(STREAM_MAGIC)
+    len(stored).should.be.lower_than(100)
+
+    # And the values should be decoded when retrieved
+    result = Repository.objects.get(repository.id)
+    result.readme.should.equal(readme)
+    result.log.should.equal(b'cloned\n' * 100)
+
+
+@clean_slate
+def test_large_json_values_are_compressed(context):
+    ('JSON attributes declared with compress should store the large values compressed with any codec')
+
+    metadata = {'topics': ['redis', 'python'] * 100}
+    release = Release.create(metadata=metadata)
+
+    context.connection.hget(release._calculate_hash_key(), 'metadata')[:2].should.equal(COMPRESSED + b'b')
+    Release.objects.get(release.id).metadata.should.equal(metadata)
+
+
+@clean_slate
+def test_appending_to_a_compressed_stream(context):
+    ('ActiveRecord#append_to_bytestream() should append compressed frames to streams stored before the compression')
+
+    # Given a log stored without compression
+    repository = Repository.create(name='repocket')
+    log_key = repository._calculate_key_for_field('log')
+    context.connection.set(log_key, b'stored before\n')
+
+    # When I append small and large chunks
+    repository.append_log(b'small\n')
+    repository.append_log(b'fetched\n' * 1000)
+
+    # Then the stream should be stored in frames
+    stored = context.connection.get(log_key)
+    stored[:len(STREAM_MAGIC)].should.equal(STREAM_MAGIC)
+    len(stored).should.be.lower_than(200)
+
+    # And it should be retrieved as a whole
+    expected = b'stored before\nsmall\n' + b'fetched\n' * 1000
+    Repository.objects.get(repository.id).log.should.equal(expected)
+
+    # And it should be readable as a file, frame by frame
+    stream = repository.open_stream('log', chunk_size=10)
+    stream.size().should.equal(len(expected))
+    stream.read(100).should.equal(b'stored bef')
+    stream.seek(14)
+    stream.read(6).should.equal(b'small\n')
+    stream.seek(-8, io.SEEK_END)
+    stream.read().should.equal(b'fetched\n')
+    stream.seek(0)
+    stream.read().should.equal(expected)
+
+
+@clean_slate
+def test_streams_starting_with_the_magic_bytes(context):
+    ('ByteStream attributes stored without frames should be read as they are even when they start with the magic bytes')
+
+    # Given a log stored without compression that starts with the magic bytes
+    repository = Repository.create(name='repocket')
+    log_key = repository._calculate_key_for_field('log')
+    contents = STREAM_MAGIC + b'\x00\x00\x00\x00 raw bytes'
+    context.connection.set(log_key, contents)
+
+    # Then it should be retrieved untouched
+    Repository.objects.get(repository.id).log.should.equal(contents)
+    stream = repository.open_stream('log')
+    stream.size().should.equal(len(contents))
+    stream.read().should.equal(contents)
+
+    # And appending compressed frames should keep it as the first frame
+    repository.append_log(b'fetched\n' * 1000)
+    Repository.objects.get(repository.id).log.should.equal(contents + b'fetched\n' * 1000)
+
+
+@clean_slate
+def test_small_values_are_not_compressed(context):
+    ('Attributes declared with compress should store the values below the threshold as usual')
+
+    repository = Repository.create(name='repocket', readme='# repocket')
+    context.connection.hget(repository._calculate_hash_key(), 'readme')[:1].should.equal(b'{')
+    Repository.objects.get(repository.id).readme.should.equal('# repocket')
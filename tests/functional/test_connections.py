@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from mock import patch
+from sure import scenario
+from repocket import configure
+from repocket.model import ActiveRecord
+from repocket.identity import identity_map
+from repocket import attributes
+
+from .helpers import prepare_redis, sweep_redis
+
+
+class Session(ActiveRecord):
+    __using__ = 'sessions'
+
+    id = attributes.AutoUUID()
+    token = attributes.Bytes()
+
+
+class Note(ActiveRecord):
+    id = attributes.AutoUUID()
+    text = attributes.Unicode()
+
+
+def prepare_sessions(context):
+    configure.connection_pool(db=1, alias='sessions', max_connections=10)
+    context.sessions = configure.get_connection('sessions')
+    context.sessions.flushdb()
+
+
+def sweep_sessions(context):
+    context.sessions.flushdb()
+
+
+with_sessions = scenario([prepare_redis, prepare_sessions], [sweep_sessions, sweep_redis])
+
+
+@with_sessions
+def test_get_connection_reuses_the_client(context):
+    ('configure.get_connection() should return the same client for the same alias')
+
+    configure.get_connection().should.be(configure.get_connection())
+    configure.get_connection('sessions').should_not.be(configure.get_connection())
+
+
+@with_sessions
+def test_get_connection_unknown_alias(context):
+    ('configure.get_connection() should not accept unknown aliases')
+
+    configure.get_connection.when.called_with('cache').should.throw(KeyError)
+
+
+def test_get_connection_without_configuration():
+    ('configure.get_connection() should connect to the local redis when no pool was configured')
+
+    with patch.multiple(configure, pool=None, pools={}, clients={}, settings={}, rings={}):
+        connection = configure.get_connection()
+        connection.ping().should.be.true
+        connection.connection_pool.connection_kwargs.should.have.key('host').being.equal('localhost')
+        connection.connection_pool.connection_kwargs.should.have.key('db').being.equal(0)
+        configure.get_connection().should.be(connection)
+
+
+@with_sessions
+def test_model_using_alias(context):
+    ('ActiveRecord.__using__ should store the items in the given connection pool')
+
+    # Given a saved session
+    session = Session.create(token=b'abc')
+
+    # Then it should be stored in the sessions db only
+    context.sessions.exists(session._calculate_hash_key()).should.be.true
+    context.connection.exists(session._calculate_hash_key()).should.be.false
+
+    # And retrieved from it
+    Session.objects.get(session.id).should.equal(session)
+
+
+@with_sessions
+def test_manager_using_alias(context):
+    ('ActiveRecord.objects.using() should read from the given connection pool')
+
+    # Given a note stored in the sessions db
+    note = Note(text='hello')
+    note._using = 'sessions'
+    note.save()
+
+    # When I retrieve it through the sessions alias
+    result = Note.objects.using('sessions').get(note.id)
+
+    # Then it should be found
+    result.text.should.equal('hello')
+    Note.objects.get(note.id).should.be.none
+
+    # And saving it again should write to the same pool
+    result.text = 'world'
+    result.save()
+    Note.objects.using('sessions').get(note.id).text.should.equal('world')
+
+
+@with_sessions
+def test_identity_map_keeps_the_pools_apart(context):
+    ('identity_map() should keep the same key of different connection pools apart')
+
+    # Given the same note stored in 2 pools
+    Note.create(id='8a7ac1e2-1b1f-4b2e-9e1e-0d6e8a1c2f3b', text='default')
+    note = Note(id='8a7ac1e2-1b1f-4b2e-9e1e-0d6e8a1c2f3b', text='sessions')
+    note._using = 'sessions'
+    note.save()
+
+    with identity_map():
+        # When I retrieve it through both pools
+        default = Note.objects.get(note.id)
+        sessions = Note.objects.using('sessions').get(note.id)
+
+        # Then each pool should return its own item
+        default.text.should.equal('default')
+        sessions.text.should.equal('sessions')
+        Note.objects.using('sessions').get(note.id).should.be(sessions)
+        Note.objects.get(note.id).should.be(default)
+
+
+@with_sessions
+def test_stats(context):
+    ('configure.stats() should count the connections of the pool')
+
+    # Given that I use the sessions pool
+    Session.create(token=b'abc')
+
+    # Then the stats should reflect it
+    configure.stats('sessions').should.equal({
+        'created': 1,
+        'in_use': 0,
+        'idle': 1,
+        'max_connections': 10,
+    })
+
+
+@with_sessions
+def test_pools_are_recreated_after_fork(context):
+    ('configure.get_connection() should use new pools in a child process')
+
+    # Given a client of the parent process
+    Session.create(token=b'abc')
+    parent = configure.get_connection('sessions')
+
+    # When the process id changes
+    with patch('repocket.connections.os.getpid', return_value=-1):
+        child = configure.get_connection('sessions')
+
+        # Then the pool should be new
+        child.should_not.be(parent)
+        configure.stats('sessions')['created'].should.equal(0)
+
+        # And usable
+        child.ping().should.be.true
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from datetime import datetime
+from mock import patch
+
+import redis
+from repocket.model import ActiveRecord
+from repocket.manager import ActiveRecordManager
+from repocket import attributes
+
+from .helpers import clean_slate
+
+
+class Customer(ActiveRecord):
+    id = attributes.AutoUUID()
+    email = attributes.Unicode(index=True)
+    house_name = attributes.Unicode(index=True)
+    name = attributes.Unicode()
+
+
+@clean_slate
+def test_save_adds_primary_key_to_index(context):
+    ('ActiveRecord.save() should add the primary key to the set of every indexed attribute')
+
+    # Given that I save a customer
+    harry = Customer.create(email='harry@hogwards.uk', house_name='Gryffindor', name='Harry')
+
+    # Then the index sets should contain its id
+    key = Customer._calculate_index_key('email', 'harry@hogwards.uk')
+    context.connection.smembers(key).should.equal({str(harry.id)})
+
+    key = Customer._calculate_index_key('house_name', 'Gryffindor')
+    context.connection.smembers(key).should.equal({str(harry.id)})
+
+
+@clean_slate
+def test_save_moves_primary_key_between_index_sets(context):
+    ('ActiveRecord.save() should remove the primary key from the index of the previous value')
+
+    # Given a saved customer
+    harry = Customer.create(email='harry@hogwards.uk', house_name='Slytherin')
+
+    # When I change an indexed value and save it again
+    harry.house_name = 'Gryffindor'
+    harry.save()
+
+    # Then the previous index should be empty
+    context.connection.smembers(
+        Customer._calculate_index_key('house_name', 'Slytherin')).should.be.empty
+
+    # And the new index should contain the id
+    context.connection.smembers(
+        Customer._calculate_index_key('house_name', 'Gryffindor')).should.equal({str(harry.id)})
+
+
+@clean_slate
+def test_delete_removes_primary_key_from_index(context):
+    ('ActiveRecord.delete() should remove the primary key from the index sets')
+
+    # Given a saved customer
+    harry = Customer.create(email='harry@hogwards.uk', house_name='Gryffindor')
+
+    # When I delete it
+    harry.delete()
+
+    # Then the index sets should be gone
+    context.connection.keys('repocket-index:*').should.be.empty
+
+
+@clean_slate
+def test_filter_by_indexed_attribute(context):
+    ('ActiveRecord.objects.filter() should find the items through the index sets')
+
+    # Given 3 customers
+    Customer.create(email='harry@hogwards.uk', house_name='Gryffindor', name='Harry')
+    Customer.create(email='ron@hogwards.uk', house_name='Gryffindor', name='Ron')
+    Customer.create(email='draco@hogwards.uk', house_name='Slytherin', name='Draco')
+
+    # When I filter by an indexed attribute
+    results = Customer.objects.filter(house_name='Gryffindor')
+
+    # Then it should return the 2 matching items
+    sorted([c.name for c in results]).should.equal(['Harry', 'Ron'])
+
+    # And indexed lookups can be combined with any other attribute
+    results = Customer.objects.filter(house_name='Gryffindor', name='Ron')
+    [c.email for c in results].should.equal(['ron@hogwards.uk'])
+
+
+@clean_slate
+def test_filter_by_indexed_attribute_with_in_lookup(context):
+    ('ActiveRecord.objects.filter() should support the __in lookup on indexed attributes')
+
+    # Given 3 customers
+    Customer.create(email='harry@hogwards.uk', house_name='Gryffindor', name='Harry')
+    Customer.create(email='ron@hogwards.uk', house_name='Gryffindor', name='Ron')
+    Customer.create(email='draco@hogwards.uk', house_name='Slytherin', name='Draco')
+
+    # When I filter with the __in lookup
+    results = Customer.objects.filter(email__in=['harry@hogwards.uk', 'draco@hogwards.uk'])
+
+    # Then it should return the 2 matching items
+    sorted([c.name for c in results]).should.equal(['Draco', 'Harry'])
+
+    # And an empty __in lookup should not match anything
+    Customer.objects.filter(email__in=[]).should.be.empty
+
+
+@clean_slate
+def test_reindex(context):
+    ('ActiveRecord.objects.reindex() should rebuild the index sets of the existing items')
+
+    # Given 2 customers
+    harry = Customer.create(email='harry@hogwards.uk', house_name='Gryffindor')
+    ron = Customer.create(email='ron@hogwards.uk', house_name='Gryffindor')
+
+    # And that the index sets were lost
+    context.connection.delete(*context.connection.keys('repocket-index:*'))
+
+    # When I call reindex
+    Customer.objects.reindex()
+
+    # Then the index sets should be back
+    key = Customer._calculate_index_key('house_name', 'Gryffindor')
+    context.connection.smembers(key).should.equal({str(harry.id), str(ron.id)})
+
+
+@clean_slate
+def test_reindex_in_batches(context):
+    ('ActiveRecord.objects.reindex() should rebuild the indexes in batches and drop the stale ones')
+
+    # Given 5 customers
+    customers = [Customer.create(email='{0}@hogwards.uk'.format(i), house_name='Gryffindor') for i in range(5)]
+
+    # And a stale index entry
+    stale_key = Customer._calculate_index_key('house_name', 'Hufflepuff')
+    context.connection.sadd(stale_key, str(customers[0].id))
+
+    # When I reindex 2 customers at a time
+    ActiveRecordManager(Customer, batch_size=2).reindex()
+
+    # Then the index sets should hold the stored values only
+    key = Customer._calculate_index_key('house_name', 'Gryffindor')
+    context.connection.smembers(key).should.equal(set([str(c.id) for c in customers]))
+    context.connection.exists(stale_key).should.be.false
+
+    # And the temporary keys should be gone
+    context.connection.keys('repocket-reindex:*').should.be.empty
+
+
+@clean_slate
+def test_filter_ignores_stale_index_entries(context):
+    ('ActiveRecord.objects.filter() should not return the items that no longer match a stale index entry')
+
+    # Given a customer in Gryffindor
+    harry = Customer.create(email='harry@hogwards.uk', house_name='Gryffindor')
+
+    # And a stale index entry left by concurrent saves
+    context.connection.sadd(Customer._calculate_index_key('house_name', 'Slytherin'), str(harry.id))
+
+    # Then filtering by the stale value should not return it
+    Customer.objects.filter(house_name='Slytherin').should.be.empty
+    Customer.objects.filter(house_name='Gryffindor').should.equal([harry])
+
+
+@clean_slate
+def test_bulk_create_updates_indexes(context):
+    ('ActiveRecord.objects.bulk_create() should keep the index sets up-to-date')
+
+    # Given a saved customer
+    harry = Customer.create(email='harry@hogwards.uk', house_name='Slytherin')
+
+    # When I bulk create it again with a new house along with a new customer
+    harry.house_name = 'Gryffindor'
+    Customer.objects.bulk_create([harry, Customer(email='ron@hogwards.uk', house_name='Gryffindor')])
+
+    # Then the index should reflect the new values
+    sorted(c.email for c in Customer.objects.filter(house_name='Gryffindor')).should.equal([
+        'harry@hogwards.uk',
+        'ron@hogwards.uk',
+    ])
+    Customer.objects.filter(house_name='Slytherin').should.be.empty
+
+
+@clean_slate
+def test_save_only_updates_indexes_of_dirty_fields(context):
+    ('ActiveRecord.save() should keep the indexes of the attributes that did not change')
+
+    # Given a customer retrieved from redis
+    harry = Customer.create(email='harry@hogwards.uk', house_name='Slytherin')
+    result = Customer.objects.get(harry.id)
+
+    # When I change only the house name
+    result.house_name = 'Gryffindor'
+    result.save()
+
+    # Then the email index is kept
+    Customer.objects.filter(email='harry@hogwards.uk').should.equal([result])
+
+    # And the house name index moved
+    Customer.objects.filter(house_name='Slytherin').should.be.empty
+    Customer.objects.filter(house_name='Gryffindor').should.equal([result])
+
+
+class Score(ActiveRecord):
+    id = attributes.AutoUUID()
+    player = attributes.Unicode(index=True)
+    points = attributes.Integer(index='range')
+    played_at = attributes.DateTime(index='range')
+
+
+@clean_slate
+def test_range_index_lookups(context):
+    ('ActiveRecord.objects.filter() should use the sorted sets for range lookups')
+
+    # Given 5 scores
+    scores = [
+        Score.create(player='harry' if i % 2 else 'ron', points=i * 10, played_at=datetime(2015, 2, 25, i))
+        for i in reversed(range(5))
+    ]
+
+    # When I filter by a range
+    results = Score.objects.filter(points__gte=10, points__lt=40)
+
+    # Then the matching scores should be returned in order
+    [r.points for r in results].should.equal([10, 20, 30])
+
+    # And range lookups can be combined with other indexes
+    results = Score.objects.filter(player='harry', played_at__gt=datetime(2015, 2, 25, 1))
+    [r.points for r in results].should.equal([30])
+
+    # And exact lookups use the sorted set as well
+    Score.objects.filter(points=40).should.equal([scores[0]])
+
+
+@clean_slate
+def test_range_index_is_updated_on_save_and_delete(context):
+    ('ActiveRecord.save() and delete() should keep the sorted sets up-to-date')
+
+    # Given a saved score
+    score = Score.create(player='harry', points=10)
+    key = Score._calculate_range_index_key('points')
+    context.connection.zscore(key, str(score.id)).should.equal(10.0)
+
+    # When I change the points
+    score.points = 50
+    score.save()
+
+    # Then the score should be updated
+    context.connection.zscore(key, str(score.id)).should.equal(50.0)
+
+    # And deleting removes it
+    score.delete()
+    context.connection.zcard(key).should.equal(0)
+
+
+@clean_slate
+def test_order_by_with_slicing(context):
+    ('ActiveRecord.objects.order_by() should retrieve only the items of the slice')
+
+    # Given 10 scores
+    for i in range(10):
+        Score.create(player='harry', points=i)
+
+    # When I order them
+    ordered = Score.objects.order_by('points')
+    descending = Score.objects.order_by('-points')
+
+    # Then slices should be retrieved in order
+    [s.points for s in ordered[2:5]].should.equal([2, 3, 4])
+    [s.points for s in descending[:3]].should.equal([9, 8, 7])
+    [s.points for s in ordered[8:]].should.equal([8, 9])
+    ordered[12:20].should.be.empty
+
+    # And single items as well
+    descending[0].points.should.equal(9)
+    ordered.__getitem__.when.called_with(10).should.throw(IndexError)
+
+    # And all() should follow the order
+    [s.points for s in descending.all()].should.equal(range(9, -1, -1))
+
+
+@clean_slate
+def test_page_with_cursors(context):
+    ('ActiveRecord.objects.order_by().page() should walk the items with opaque cursors')
+
+    # Given 7 scores, 2 of them with the same points
+    for points in [1, 2, 3, 3, 4, 5, 6]:
+        Score.create(player='harry', points=points)
+
+    # When I retrieve all the pages of 2 items
+    ordered = Score.objects.order_by('-points')
+    pages = [ordered.page(size=2)]
+    while pages[-1].next_cursor:
+        pages.append(ordered.page(after=pages[-1].next_cursor, size=2))
+
+    # Then every item should be returned once, in order
+    [[s.points for s in page] for page in pages].should.equal([[6, 5], [4, 3], [3, 2], [1]])
+    len(set([s.id for page in pages for s in page])).should.equal(7)
+
+
+@clean_slate
+def test_page_within_many_ties(context):
+    ('ActiveRecord.objects.order_by().page() should read the items with the same score a page at a time')
+
+    # Given 10 scores with the same points
+    for i in range(10):
+        Score.create(player='harry', points=7)
+
+    Score.create(player='harry', points=8)
+    ordered = Score.objects.order_by('points')
+
+    # When I retrieve all the pages of 3 items
+    # And I delete the last item of the first page before the next one
+    first = ordered.page(size=3)
+    first[-1].delete()
+    with patch('redis.Redis.zrangebyscore', autospec=True, side_effect=redis.Redis.zrangebyscore) as zrangebyscore:
+        pages = [first, ordered.page(after=first.next_cursor, size=3)]
+        while pages[-1].next_cursor:
+            pages.append(ordered.page(after=pages[-1].next_cursor, size=3))
+
+    # Then every item should be returned once, in order
+    [[s.points for s in page] for page in pages].should.equal([[7, 7, 7], [7, 7, 7], [7, 7, 7], [7, 8]])
+    len(set([s.id for page in pages for s in page])).should.equal(11)
+
+    # And only the page after the deleted item should have read the
+    # ties by score, a page at a time, the others start at the rank of the cursor
+    [c[1]['num'] for c in zrangebyscore.call_args_list].should.equal([4, 4])
+
+
+@clean_slate
+def test_background_all_keeps_the_ordering(context):
+    ('ActiveRecord.objects.order_by().aall() should yield the items in order')
+
+    # Given 5 scores
+    for points in [3, 1, 4, 5, 2]:
+        Score.create(player='harry', points=points)
+
+    # When I iterate them in the background, 2 per page
+    results = Score.objects.order_by('-points').aall(batch_size=2)
+
+    # Then they should be yielded in order
+    [s.points for s in results].should.equal([5, 4, 3, 2, 1])
+
+
+@clean_slate
+def test_page_with_invalid_cursor(context):
+    ('ActiveRecord.objects.order_by().page() should not accept cursors of another ordering')
+
+    Score.create(player='harry', points=1)
+    Score.create(player='harry', points=2)
+    cursor = Score.objects.order_by('points').page(size=1).next_cursor
+
+    Score.objects.order_by('-points').page.when.called_with(after=cursor).should.throw(ValueError)
+    Score.objects.order_by('points').page.when.called_with(after='garbage').should.throw(ValueError)
+
+
+def test_order_by_requires_range_index():
+    ('ActiveRecord.objects.order_by() should only accept attributes with a range index')
+
+    Score.objects.order_by.when.called_with('player').should.throw(AttributeError)
+    Score.objects.__getitem__.when.called_with(slice(0, 2)).should.throw(TypeError)
+
+
+def test_range_lookups_require_a_scored_attribute():
+    ('ActiveRecord.objects.filter() should reject range lookups on attributes that cannot be scored')
+
+    # When I filter a unicode attribute by a range
+    # Then it should fail before querying redis
+    Customer.objects.filter.when.called_with(name__gt='a').should.throw(ValueError, 'name__gt')
+    Customer.objects.count.when.called_with(name__lte='a').should.throw(ValueError, 'name__lte')
+
+    # And the scored attributes should still accept them
+    Score.objects.filter(points__gt=1).lookups.should.equal({'points__gt': 1})
+
+
+@clean_slate
+def test_result_set_order_by(context):
+    ('ResultSet#order_by() should sort the items in python')
+
+    Customer.create(email='harry@hogwards.uk', house_name='Gryffindor', name='Harry')
+    Customer.create(email='ron@hogwards.uk', house_name='Gryffindor', name='Ron')
+
+    results = Customer.objects.filter(house_name='Gryffindor').order_by('-name')
+    [c.name for c in results].should.equal(['Ron', 'Harry'])
+
+
+@clean_slate
+def test_count_and_exists(context):
+    ('ActiveRecord.objects.count() and exists() should not retrieve the items')
+
+    # Given 5 scores
+    scores = [Score.create(player='harry' if i % 2 else 'ron', points=i) for i in range(5)]
+    scores[0].delete()
+
+    # When I count them, no item should be built
+    with patch.object(Score.objects.__class__, 'build_item') as build_item:
+        Score.objects.count().should.equal(4)
+        Score.objects.count(player='harry').should.equal(2)
+        Score.objects.count(points__gte=2).should.equal(3)
+        Score.objects.count(player='ron', points__gte=2).should.equal(2)
+        Score.objects.count(player__in=['harry', 'ron']).should.equal(4)
+        Score.objects.exists(scores[1].id).should.be.true
+        Score.objects.exists(scores[0].id).should.be.false
+
+    build_item.called.should.be.false
+
+    # And lookups of attributes without index still work
+    Score.objects.count(player='ron', played_at=None).should.equal(2)
+
+
+@clean_slate
+def test_reindex_builds_the_membership_set(context):
+    ('ActiveRecord.objects.reindex() should rebuild the membership set')
+
+    # Given 3 scores whose indexes were lost
+    for i in range(3):
+        Score.create(player='harry', points=i)
+
+    for key in context.connection.keys('repocket-index:*'):
+        context.connection.delete(key)
+
+    Score.objects.count().should.equal(0)
+
+    # When I reindex
+    Score.objects.reindex()
+
+    # Then they should be counted
+    Score.objects.count().should.equal(3)
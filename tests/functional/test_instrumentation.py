@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from repocket.model import ActiveRecord
+from repocket import attributes, instrumentation, save_many
+
+from .helpers import clean_slate
+
+
+class Spell(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+    house = attributes.Unicode(index=True)
+    power = attributes.Integer()
+
+
+def collect(operations, name):
+    return [o for o in operations if o.name == name]
+
+
+@clean_slate
+def test_save_and_get_report_commands_and_bytes(context):
+    ('save() and get() should report the redis commands, pipelines and bytes of the call')
+
+    operations = []
+    with instrumentation.collect_stats(operations.append):
+        # When I save and retrieve a spell
+        spell = Spell.create(name='Lumos', house='Gryffindor', power=1)
+        Spell.objects.get(id=spell.id)
+
+    # Then save() should report the command that reads the indexed
+    # values and a single pipeline
+    save, = collect(operations, 'save')
+    save.model.should.be(Spell)
+    save.round_trips.should.equal(2)
+    save.pipelines.should.have.length_of(1)
+    save.commands.should.equal(save.pipelines[0] + 1)
+    save.bytes_sent.should.be.greater_than(len('Lumos'))
+    save.error.should.be.none
+
+    # And it should include the serialization
+    collect(operations, 'serialize').should.have.length_of(1)
+
+    # And get() should report the bytes received
+    get, = collect(operations, 'get')
+    get.commands.should.be.greater_than(0)
+    get.bytes_received.should.be.greater_than(len('Lumos'))
+    collect(operations, 'hydrate').should.have.length_of(1)
+
+
+@clean_slate
+def test_filter_and_all_report_a_single_operation(context):
+    ('iterating all() and filter() should report a single operation with the retrieved items')
+
+    # Given 6 spells
+    save_many([Spell(name='spell {0}'.format(i), house=i % 2 and 'Slytherin' or 'Gryffindor', power=i) for i in range(6)])
+
+    with instrumentation.collect_stats() as stats:
+        # When I retrieve them
+        list(Spell.objects.all())
+        list(Spell.objects.filter(house='Slytherin'))
+        Spell.objects.filter(house='Slytherin').first()
+
+    # Then the stats should have the items and commands of each query
+    spell = stats.snapshot()[Spell.__compound_name__]
+    spell['all']['counters']['calls'].should.equal(1)
+    spell['all']['counters']['items'].should.equal(6)
+    spell['all']['counters']['commands'].should.be.greater_than(0)
+    spell['filter']['counters']['calls'].should.equal(2)
+    spell['filter']['counters']['items'].should.equal(4)
+    spell['filter']['counters']['bytes_received'].should.be.greater_than(0)
+    spell['hydrate']['counters']['calls'].should.equal(10)
+
+
+@clean_slate
+def test_delete_reports_errors(context):
+    ('delete() should report the redis commands it issues')
+
+    spell = Spell.create(name='Nox')
+    with instrumentation.collect_stats() as stats:
+        spell.delete()
+
+    stats.snapshot()[Spell.__compound_name__]['delete']['counters']['commands'].should.be.greater_than(0)
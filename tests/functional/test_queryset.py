@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from mock import patch
+from repocket.model import ActiveRecord
+from repocket.manager import QuerySet, ActiveRecordManager
+from repocket import attributes
+
+from .helpers import clean_slate
+
+
+class Wizard(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+    house = attributes.Unicode(index=True)
+    level = attributes.Integer(index='range')
+
+
+def create_wizards():
+    return [
+        Wizard.create(name='Harry', house='Gryffindor', level=7),
+        Wizard.create(name='Ron', house='Gryffindor', level=5),
+        Wizard.create(name='Hermione', house='Gryffindor', level=9),
+        Wizard.create(name='Draco', house='Slytherin', level=6),
+        Wizard.create(name='Luna', house='Ravenclaw', level=8),
+    ]
+
+
+def names(wizards):
+    return [w.name for w in wizards]
+
+
+@clean_slate
+def test_queryset_is_lazy(context):
+    ('ActiveRecord.objects.filter() should not touch redis until evaluated')
+
+    create_wizards()
+
+    # When I chain a query
+    with patch.object(ActiveRecordManager, 'get_items_from_redis_keys') as get_items:
+        query = Wizard.objects.filter(house='Gryffindor').order_by('-level').filter(level__gt=5)
+
+    # Then nothing should be retrieved
+    get_items.called.should.be.false
+    query.should.be.a(QuerySet)
+
+    # And the items should be retrieved when iterated
+    names(query).should.equal(['Hermione', 'Harry'])
+
+
+@clean_slate
+def test_queryset_caches_the_results(context):
+    ('QuerySet should evaluate only once')
+
+    create_wizards()
+    query = Wizard.objects.filter(house='Gryffindor')
+
+    with patch.object(ActiveRecordManager, 'get_items_from_redis_keys', wraps=Wizard.objects.get_items_from_redis_keys) as get_items:
+        len(query).should.equal(3)
+        list(query).should.have.length_of(3)
+        query[0].should.be.a(Wizard)
+
+    get_items.call_count.should.equal(1)
+
+
+@clean_slate
+def test_queryset_first_and_slices_retrieve_only_their_items(context):
+    ('QuerySet.first() and slices should only retrieve the items they return')
+
+    create_wizards()
+
+    with patch.object(ActiveRecordManager, 'build_item', wraps=Wizard.objects.build_item) as build_item:
+        Wizard.objects.order_by('level').first().name.should.equal('Ron')
+        build_item.call_count.should.equal(1)
+
+        names(Wizard.objects.filter(house='Gryffindor').order_by('-level')[1:3]).should.equal(['Harry', 'Ron'])
+        build_item.call_count.should.equal(3)
+
+        Wizard.objects.all()[:2].should.have.length_of(2)
+        build_item.call_count.should.equal(5)
+
+
+@clean_slate
+def test_queryset_count_and_exists(context):
+    ('QuerySet.count() should use the indexes')
+
+    create_wizards()
+
+    with patch.object(ActiveRecordManager, 'build_item') as build_item:
+        Wizard.objects.filter(house='Gryffindor').count().should.equal(3)
+        Wizard.objects.filter(house='Gryffindor', level__gte=7).count().should.equal(2)
+        Wizard.objects.all()[1:].count().should.equal(4)
+        Wizard.objects.all()[1:3].count().should.equal(2)
+
+    build_item.called.should.be.false
+
+    Wizard.objects.filter(house='Hufflepuff').exists().should.be.false
+    Wizard.objects.filter(name='Luna').exists().should.be.true
+
+
+@clean_slate
+def test_queryset_empty_and_nested_slices(context):
+    ('QuerySet slices that stop at 0 or past the end should be empty')
+
+    create_wizards()
+
+    # When I take slices that stop at 0
+    # Then they should be empty
+    list(Wizard.objects.all()[:0]).should.be.empty
+    list(Wizard.objects.filter(house='Gryffindor')[0:0]).should.be.empty
+    list(Wizard.objects.all()[1:3][:0]).should.be.empty
+    list(Wizard.objects.all()[:0][:2]).should.be.empty
+    Wizard.objects.all()[:0].count().should.equal(0)
+
+    # And nested slices past the end should count nothing
+    Wizard.objects.all()[1:3][5:].count().should.equal(0)
+    list(Wizard.objects.all()[1:3][5:]).should.be.empty
+    Wizard.objects.all()[1:4][1:].count().should.equal(2)
+
+
+@clean_slate
+def test_queryset_mixed_lookups_and_python_ordering(context):
+    ('QuerySet should compare the lookups without index in python and order by any attribute')
+
+    create_wizards()
+
+    query = Wizard.objects.filter(level__gte=6).filter(name__in=['Harry', 'Draco', 'Luna'])
+    names(query).should.equal(['Draco', 'Harry', 'Luna'])
+    names(query.order_by('-name')).should.equal(['Luna', 'Harry', 'Draco'])
+    names(query.order_by('name')[1:]).should.equal(['Harry', 'Luna'])
+
+
+@clean_slate
+def test_queryset_cannot_filter_a_slice(context):
+    ('QuerySet.filter() should not be called after slicing')
+
+    Wizard.objects.all()[:2].filter.when.called_with(house='Gryffindor').should.throw(TypeError)
+    Wizard.objects.filter.when.called_with(wand='holly').should.throw(AttributeError)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import time
+from mock import patch
+from redis.client import BasePipeline
+from repocket.connections import configure, get_database
+from repocket.readcache import enable_read_cache
+from repocket.readcache import disable_read_cache
+from sure import scenario
+
+from .helpers import prepare_redis, sweep_redis
+from .test_active_record import User
+
+
+def stop_read_cache(context):
+    disable_read_cache()
+    configure.publish_invalidations(False)
+
+
+read_cache = scenario([prepare_redis], [stop_read_cache, sweep_redis])
+
+
+def wait_until(condition, timeout=5):
+    started = time.time()
+    while not condition() and time.time() - started < timeout:
+        time.sleep(0.01)
+
+
+@read_cache
+def test_read_cache_avoids_round_trips(context):
+    ('Retrieving an item twice with the read cache enabled should cost a single round-trip')
+
+    # Given a user
+    user = User.create(email='foo@bar.com')
+
+    # And that the read cache is enabled
+    context.cache = enable_read_cache(ttl=60)
+
+    # When I retrieve it twice
+    User.objects.get(id=user.id)
+    with patch.object(BasePipeline, 'execute', autospec=True, side_effect=BasePipeline.execute) as execute:
+        result = User.objects.get(id=user.id)
+
+    # Then the second time should come from the cache
+    result.email.should.equal('foo@bar.com')
+    execute.called.should.be.false
+    context.cache.stats()['hits'].should.equal(1)
+
+
+@read_cache
+def test_read_cache_is_invalidated_by_save(context):
+    ('Saving an item should invalidate it in the read cache')
+
+    # Given a cached user
+    user = User.create(email='foo@bar.com')
+    context.cache = enable_read_cache(ttl=60)
+    User.objects.get(id=user.id)
+
+    # When I save a new email
+    user.email = 'bar@foo.com'
+    user.save()
+
+    # Then retrieving it should return the new email
+    User.objects.get(id=user.id).email.should.equal('bar@foo.com')
+
+
+@read_cache
+def test_read_cache_is_invalidated_by_other_processes(context):
+    ('Keys published in the invalidation channel should be evicted by the listener thread')
+
+    # Given a cached user
+    user = User.create(email='foo@bar.com')
+    context.cache = enable_read_cache(ttl=60)
+    key = (get_database(configure.get_connection()), user._calculate_hash_key())
+    User.objects.get(id=user.id)
+    (key in context.cache).should.be.true
+
+    # When another process changes it and publishes the key
+    context.connection.hset(key[1], 'email', '{"type": "Unicode", "value": "bar@foo.com", "module": "repocket.attributes"}')
+    context.connection.publish('repocket:invalidations', key[1])
+
+    # Then the listener should evict it
+    wait_until(lambda: key not in context.cache)
+    User.objects.get(id=user.id).email.should.equal('bar@foo.com')
+
+
+@read_cache
+def test_read_cache_keeps_the_items_of_every_pool_apart(context):
+    ('The read cache should keep the same key of different pools apart and evict it from all of them')
+
+    # Given a user
+    user = User.create(email='foo@bar.com')
+    key = user._calculate_hash_key()
+    context.cache = enable_read_cache(ttl=60)
+
+    # And a copy of it with another email in another pool
+    configure.connection_pool(db=2, alias='archive')
+    try:
+        archive = configure.get_connection('archive')
+        archive.hmset(key, context.connection.hgetall(key))
+        archive.hset(key, 'email', '{"type": "Unicode", "value": "bar@foo.com", "module": "repocket.attributes"}')
+        wait_until(lambda: get_database(archive) in context.cache.listener.databases)
+
+        # When I retrieve both of them
+        User.objects.get(id=user.id).email.should.equal('foo@bar.com')
+        User.objects.using('archive').get(id=user.id).email.should.equal('bar@foo.com')
+
+        # Then each one should be cached on its own
+        User.objects.get(id=user.id).email.should.equal('foo@bar.com')
+        User.objects.using('archive').get(id=user.id).email.should.equal('bar@foo.com')
+        context.cache.stats()['hits'].should.equal(2)
+
+        # And the listener should evict the key of both
+        get_database(archive).should.be.within(context.cache.listener.databases)
+        archive.publish('repocket:invalidations', key)
+        wait_until(lambda: len(context.cache) == 0)
+        context.cache.should.have.length_of(0)
+    finally:
+        archive.flushdb()
+        for registry in (configure.pools, configure.settings, configure.clients):
+            registry.pop('archive', None)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from decimal import Decimal
+from mock import patch
+from repocket.model import ActiveRecord
+from repocket.manager import ActiveRecordManager
+from repocket import attributes, scripting
+
+from .helpers import clean_slate
+
+
+class Potion(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+    brewer = attributes.UUID()
+    doses = attributes.Integer()
+    price = attributes.Decimal()
+
+
+class CompactPotion(ActiveRecord):
+    __codec__ = 'compact'
+
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+    brewer = attributes.UUID()
+    doses = attributes.Integer()
+    price = attributes.Decimal()
+
+
+BREWER = '2e6a8c5a-7c3b-11e5-9ab2-6c4008a70392'
+OTHER_BREWER = '5d2e4d0e-7c3b-11e5-9ab2-6c4008a70392'
+
+
+def create_potions(Model):
+    Model.create(name='Felix Felicis', brewer=BREWER, doses=1, price=Decimal('99.5'))
+    Model.create(name='Polyjuice', brewer=BREWER, doses=3, price=Decimal('12'))
+    Model.create(name='Amortentia', brewer=OTHER_BREWER, doses=2, price=Decimal('40'))
+    Model.create(name='Veritaserum', brewer=OTHER_BREWER, doses=5, price=Decimal('70.25'))
+
+
+def names(potions):
+    return sorted([p.name for p in potions])
+
+
+def assert_filters_in_redis(Model):
+    create_potions(Model)
+
+    with patch.object(ActiveRecordManager, 'build_item', wraps=Model.objects.build_item) as build_item:
+        names(Model.objects.filter(name='Polyjuice')).should.equal(['Polyjuice'])
+        build_item.call_count.should.equal(1)
+
+        names(Model.objects.filter(brewer=BREWER, doses__gte=2)).should.equal(['Polyjuice'])
+        names(Model.objects.filter(doses__in=[1, 5])).should.equal(['Felix Felicis', 'Veritaserum'])
+        names(Model.objects.filter(price__gt=Decimal('40'))).should.equal(['Felix Felicis', 'Veritaserum'])
+        names(Model.objects.filter(name__in=['Amortentia', 'Nothing'], price=40)).should.equal(['Amortentia'])
+        build_item.call_count.should.equal(7)
+
+
+@clean_slate
+def test_filter_compares_envelope_values_in_redis(context):
+    ('ActiveRecord.objects.filter() should retrieve only the items matched by the lua script')
+
+    assert_filters_in_redis(Potion)
+
+
+@clean_slate
+def test_filter_compares_compact_values_in_redis(context):
+    ('ActiveRecord.objects.filter() should compare the values stored by the compact codec in redis')
+
+    assert_filters_in_redis(CompactPotion)
+
+
+@clean_slate
+def test_filter_script_is_loaded_once(context):
+    ('the filter script should be loaded once and called with EVALSHA')
+
+    create_potions(Potion)
+    context.connection.script_flush()
+
+    # When I filter twice
+    names(Potion.objects.filter(name='Polyjuice')).should.equal(['Polyjuice'])
+    names(Potion.objects.filter(name='Amortentia')).should.equal(['Amortentia'])
+
+    # Then the script should be cached in redis
+    context.connection.script_exists(scripting.FILTER_SCRIPT_SHA).should.equal([True])
+
+
+@clean_slate
+def test_server_side_filtering_can_be_disabled(context):
+    ('ActiveRecordManager.server_side_filtering = False should compare every lookup in python')
+
+    create_potions(Potion)
+    manager = Potion.objects._clone(server_side_filtering=False)
+
+    with patch.object(scripting, 'scan_matching') as scan_matching:
+        names(manager.filter(doses__gt=2)).should.equal(['Polyjuice', 'Veritaserum'])
+
+    scan_matching.called.should.be.false
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from mock import patch
+from sure import scenario
+from repocket import background, configure, attributes
+from repocket.model import ActiveRecord
+from repocket.sharding import Rebalancer
+
+from .helpers import prepare_redis, sweep_redis
+
+
+class Account(ActiveRecord):
+    __using__ = 'sharded'
+
+    id = attributes.AutoUUID()
+    email = attributes.Unicode(index=True)
+    bio = attributes.ByteStream()
+
+
+def prepare_nodes(context):
+    configure.connection_pool(db=2, alias='node-a')
+    configure.connection_pool(db=3, alias='node-b')
+    configure.shards(['node-a', 'node-b'], alias='sharded')
+    context.nodes = {
+        'node-a': configure.get_connection('node-a'),
+        'node-b': configure.get_connection('node-b'),
+    }
+    sweep_nodes(context)
+
+
+def sweep_nodes(context):
+    for conn in context.nodes.values():
+        conn.flushdb()
+
+
+sharded = scenario([prepare_redis, prepare_nodes], [sweep_nodes, sweep_redis])
+
+
+def node_of(account):
+    return configure.get_node('sharded', account._calculate_hash_key())
+
+
+@sharded
+def test_records_are_spread_across_nodes(context):
+    ('sharded models should store all the keys of a record in the node of its hash key')
+
+    # Given 20 accounts
+    accounts = [Account.create(email='user{0}@bar.com'.format(i), bio=b'bio') for i in range(20)]
+
+    # Then both nodes should store some of them
+    set(map(node_of, accounts)).should.equal({'node-a', 'node-b'})
+
+    # And the keys of each one should be in the same node
+    for account in accounts:
+        conn = context.nodes[node_of(account)]
+        conn.exists(account._calculate_hash_key()).should.be.true
+        conn.get(account._calculate_key_for_field('bio')).should.equal(b'bio')
+        conn.smembers(Account._calculate_index_key('email', account.email)).should.equal({bytes(account.id)})
+
+    # And each one should be retrieved
+    Account.objects.get(accounts[0].id).should.equal(accounts[0])
+
+
+@sharded
+def test_all_and_filter_merge_the_nodes(context):
+    ('sharded models should merge the results of every node')
+
+    # Given 20 accounts
+    accounts = [Account.create(email='user{0}@bar.com'.format(i)) for i in range(20)]
+
+    # Then all() should return all of them
+    sorted(Account.objects.all(), key=lambda a: a.email).should.equal(sorted(accounts, key=lambda a: a.email))
+
+    # And filter() should find them in any node
+    emails = [a.email for a in accounts[:5]]
+    results = Account.objects.filter(email__in=emails)
+    sorted(r.email for r in results).should.equal(sorted(emails))
+
+    # And get_items_from_redis_keys() should keep the order
+    keys = [a._calculate_hash_key() for a in reversed(accounts)]
+    Account.objects.get_items_from_redis_keys(keys).should.equal(list(reversed(accounts)))
+
+
+@sharded
+def test_all_streams_the_nodes(context):
+    ('sharded models should retrieve a batch of every node at a time')
+
+    # Given 100 accounts
+    accounts = [Account.create(email='user{0}@bar.com'.format(i)) for i in range(100)]
+
+    # When I retrieve the first of them, 2 per batch
+    with patch.object(Account, '__decoder__', wraps=Account.__decoder__) as decoder:
+        items = Account.objects.all().iterator(batch_size=2)
+        first = next(items)
+
+        # Then only the first batch of every node should have been decoded
+        decoder.call_count.should.be.lower_than(50)
+
+        # And the remaining items should be retrieved as they are consumed
+        sorted([first] + list(items), key=lambda a: a.email).should.equal(sorted(accounts, key=lambda a: a.email))
+        decoder.call_count.should.equal(100)
+
+
+@sharded
+def test_background_calls_query_the_nodes_inline(context):
+    ('sharded queries made by a worker thread should not wait for another worker')
+
+    # Given 10 accounts and a single worker thread
+    accounts = [Account.create(email='user{0}@bar.com'.format(i)) for i in range(10)]
+    background.configure_workers(1)
+    try:
+        # When I filter and count them in the background
+        results = Account.objects.afilter().get(timeout=5)
+        count = background.submit(Account.objects.count).get(timeout=5)
+        keys = [a._calculate_hash_key() for a in accounts]
+        items = background.submit(Account.objects.get_items_from_redis_keys, keys).get(timeout=5)
+    finally:
+        background.configure_workers()
+
+    # Then every node should have been queried
+    results.should.have.length_of(10)
+    count.should.equal(10)
+    items.should.equal(accounts)
+
+
+@sharded
+def test_rebalancer_moves_records_to_new_node(context):
+    ('Rebalancer should move the records that belong to the new node')
+
+    # Given 20 accounts stored in a single node
+    configure.shards(['node-a'], alias='sharded')
+    accounts = [Account.create(email='user{0}@bar.com'.format(i), bio=b'bio') for i in range(20)]
+
+    # When I add a node and rebalance
+    configure.shards(['node-a', 'node-b'], alias='sharded')
+    rebalancer = Rebalancer('sharded', batch_size=5)
+    rebalancer.rebalance()
+
+    # Then the records should be in their new node
+    moved = [a for a in accounts if node_of(a) == 'node-b']
+    rebalancer.moved.should.equal(len(moved))
+    for account in accounts:
+        for name, conn in context.nodes.items():
+            expected = name == node_of(account)
+            conn.exists(account._calculate_hash_key()).should.equal(expected)
+            conn.exists(account._calculate_key_for_field('bio')).should.equal(expected)
+            conn.exists(Account._calculate_index_key('email', account.email)).should.equal(expected)
+
+    # And be retrieved through the indexes
+    Account.objects.filter(email=moved[0].email).should.equal([moved[0]])
+
+    # And no checkpoint should be left
+    context.nodes['node-a'].exists(Rebalancer.checkpoint_key).should.be.false
+
+
+@sharded
+def test_rebalancer_keeps_records_written_to_the_new_node(context):
+    ('Rebalancer should not replace the records written to the new node during the rebalance')
+
+    # Given 20 accounts stored in a single node
+    configure.shards(['node-a'], alias='sharded')
+    accounts = [Account.create(email='user{0}@bar.com'.format(i), bio=b'old bio') for i in range(20)]
+
+    # And a node was added
+    configure.shards(['node-a', 'node-b'], alias='sharded')
+    moved = [a for a in accounts if node_of(a) == 'node-b']
+
+    # When one of the records that belong to the new node is saved
+    # there before the rebalancer moves it
+    newer = Account(id=moved[0].id, email='newer@bar.com', bio=b'new bio')
+    newer.save()
+
+    rebalancer = Rebalancer('sharded', batch_size=5)
+    rebalancer.rebalance()
+
+    # Then the newer version should be kept
+    stored = Account.objects.get(moved[0].id)
+    stored.email.should.equal('newer@bar.com')
+    stored.bio.should.equal(b'new bio')
+    rebalancer.moved.should.equal(len(moved) - 1)
+
+    # And the old version should be gone from the old node, with its index entries
+    context.nodes['node-a'].exists(moved[0]._calculate_hash_key()).should.be.false
+    context.nodes['node-a'].exists(moved[0]._calculate_key_for_field('bio')).should.be.false
+    Account.objects.filter(email=moved[0].email).should.be.empty
+
+
+class Ranking(ActiveRecord):
+    __using__ = 'sharded'
+
+    id = attributes.AutoUUID()
+    points = attributes.Integer(index='range')
+
+
+@sharded
+def test_order_by_merges_the_nodes(context):
+    ('ordered managers of sharded models should merge the sorted sets of every node')
+
+    # Given 20 rankings spread across the nodes
+    for i in range(20):
+        Ranking.create(points=i)
+
+    # When I order them
+    ordered = Ranking.objects.order_by('-points')
+
+    # Then slices and pages should follow the global order
+    [r.points for r in ordered[3:6]].should.equal([16, 15, 14])
+    page = ordered.page(size=7)
+    second = ordered.page(after=page.next_cursor, size=7)
+    [r.points for r in second].should.equal(range(12, 5, -1))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import io
+from mock import patch
+from redis import Redis
+from repocket.model import ActiveRecord
+from repocket.streams import StreamReader
+from repocket import attributes
+
+from .helpers import clean_slate
+
+
+class Job(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+    stdout = attributes.ByteStream(lazy=True)
+    stderr = attributes.ByteStream()
+
+
+@clean_slate
+def test_open_stream_reads_chunks_with_getrange(context):
+    ('ActiveRecord#open_stream() should return a file that reads the ByteStream with GETRANGE')
+
+    # Given a job with 10 lines of output
+    job = Job.create(name='build', stdout=b''.join([b'line {0}\n'.format(i) for i in range(10)]))
+
+    # When I open the stream with chunks of 8 bytes
+    stream = job.open_stream('stdout', chunk_size=8)
+    stream.should.be.a(StreamReader)
+    stream.size().should.equal(70)
+
+    # Then every read should be limited to a chunk
+    with patch.object(Redis, 'getrange', wraps=context.connection.getrange) as getrange:
+        stream.read(100).should.equal(b'line 0\nl')
+        getrange.call_count.should.equal(1)
+
+        # And readinto() should fill the buffer chunk by chunk
+        buffer = bytearray(20)
+        stream.readinto(buffer).should.equal(20)
+        bytes(buffer).should.equal(b'ine 1\nline 2\nline 3\n')
+        getrange.call_count.should.equal(4)
+
+    # And it should be seekable
+    stream.seek(-7, io.SEEK_END).should.equal(63)
+    stream.read().should.equal(b'line 9\n')
+    stream.read().should.equal(b'')
+    stream.readinto(buffer).should.equal(0)
+
+    # And it can be read line by line
+    stream.seek(0)
+    io.BufferedReader(stream, 16).readline().should.equal(b'line 0\n')
+
+
+@clean_slate
+def test_open_stream_only_opens_bytestreams(context):
+    ('ActiveRecord#open_stream() should only accept ByteStream attributes')
+
+    job = Job.create(name='build')
+    job.open_stream.when.called_with('name').should.throw(AttributeError)
+
+
+@clean_slate
+def test_lazy_bytestream_is_not_retrieved(context):
+    ('ByteStream(lazy=True) should only be retrieved when the attribute is accessed')
+
+    # Given a saved job
+    job = Job.create(name='build', stdout=b'compiling\n', stderr=b'warning\n')
+
+    # When I retrieve it
+    result = Job.objects.get(job.id)
+
+    # Then only the lazy stream should be deferred
+    result.get_deferred_fields().should.equal({'stdout'})
+    result.__dict__.should_not.have.key('stdout')
+    result.stderr.should.equal(b'warning\n')
+
+    # And it should be retrieved when accessed
+    result.stdout.should.equal(b'compiling\n')
+
+
+@clean_slate
+def test_append_does_not_keep_the_contents(context):
+    ('ActiveRecord#append_to_bytestream() should drop the contents from memory instead of concatenating them')
+
+    # Given a saved job
+    job = Job.create(name='build', stdout=b'a\n', stderr=b'b\n')
+
+    # When I append to both streams
+    job.append_stdout(b'c\n')
+    job.append_stderr(b'd\n')
+
+    # Then the contents should not be in memory
+    job.__dict__.should_not.have.key('stdout')
+    job.__dict__.should_not.have.key('stderr')
+
+    # And they should be retrieved from redis when accessed
+    job.stdout.should.equal(b'a\nc\n')
+    job.stderr.should.equal(b'b\nd\n')
+
+
+@clean_slate
+def test_set_appends_to_unretrieved_stream_on_save(context):
+    ('ActiveRecord#set() should append to a ByteStream that was not retrieved without retrieving it')
+
+    # Given a retrieved job
+    Job.create(name='build', stdout=b'a\n')
+    job = Job.objects.first()
+
+    # When I set more output and save
+    job.set('stdout', b'b\n')
+    job.set('stdout', b'c\n')
+    job.__dict__.should_not.have.key('stdout')
+    job.save()
+
+    # Then the output should be appended in redis
+    context.connection.get(job._calculate_key_for_field('stdout')).should.equal(b'a\nb\nc\n')
+
+    # And pending output should be kept when the stream is accessed before saving
+    job.set('stdout', b'd\n')
+    job.stdout.should.equal(b'a\nb\nc\nd\n')
+    job.save()
+    Job.objects.get(job.id).stdout.should.equal(b'a\nb\nc\nd\n')
+
+
+@clean_slate
+def test_set_appends_to_retrieved_stream_on_save(context):
+    ('ActiveRecord#set() should only append the new bytes to a ByteStream that was already retrieved')
+
+    # Given a retrieved job whose stderr is in memory
+    Job.create(name='build', stderr=b'a\n')
+    job = Job.objects.first()
+    job.stderr.should.equal(b'a\n')
+
+    # When I set more output
+    job.set('stderr', b'b\n')
+
+    # Then the contents should be dropped from memory
+    job.__dict__.should_not.have.key('stderr')
+
+    # And saving should append the new bytes instead of setting the whole value
+    with patch.object(Redis, 'set', wraps=context.connection.set) as set_:
+        job.save()
+
+    set_.called.should.be.false
+    context.connection.get(job._calculate_key_for_field('stderr')).should.equal(b'a\nb\n')
+    Job.objects.get(job.id).stderr.should.equal(b'a\nb\n')
@@ -4,7 +4,10 @@ from __future__ import unicode_literals
 import json
 from uuid import UUID
 from datetime import datetime
+from mock import patch
+from repocket._cache import ATTRIBUTES, DECODERS
 from repocket.attributes import Attribute
+from repocket.attributes import get_decoder
 from repocket.attributes import AutoUUID
 from repocket.attributes import Unicode
 from repocket.attributes import Bytes
@@ -12,6 +15,9 @@ from repocket.attributes import JSON
 from repocket.attributes import DateTime
 from repocket.attributes import Pointer
 from repocket.attributes import ByteStream
+from repocket.attributes import Integer
+from repocket.attributes import Float
+from repocket.attributes import Decimal
 
 test_uuid = UUID('3112edba-4b5d-11e5-b02e-6c4008a70392')
 
@@ -442,3 +448,57 @@ def test_datetime_to_json():
     result.should.equal(
         '{"type": "DateTime", "value": "2015-08-25T15:57:37-04:00", "module": "repocket.attributes"}'
     )
+
+
+def test_attributes_are_registered():
+    ('Every Attribute subclass should be registered in ATTRIBUTES by module and type name')
+
+    ATTRIBUTES[('repocket.attributes', 'Unicode')].should.equal(Unicode)
+    ATTRIBUTES[('repocket.attributes', 'Pointer')].should.equal(Pointer)
+
+    class UnitCustomAttribute(Attribute):
+        pass
+
+    ATTRIBUTES[('tests.unit.test_attributes', 'UnitCustomAttribute')].should.equal(UnitCustomAttribute)
+
+
+@patch('repocket.attributes.importlib')
+def test_from_python_does_not_import_registered_attributes(importlib):
+    ('Attribute.from_python() should resolve registered attributes without importing modules')
+
+    # When I call from_python with a registered type
+    result = Attribute.from_python({
+        'module': 'repocket.attributes',
+        'type': 'Unicode',
+        'value': 'foobar',
+    })
+
+    # Then it should have decoded the value
+    result.should.equal('foobar')
+
+    # And no module should be imported
+    importlib.import_module.called.should.be.false
+
+
+def test_get_decoder_is_memoized():
+    ('get_decoder() should memoize the decoder of each (module, type) pair')
+
+    decoder = get_decoder('repocket.attributes', 'DateTime')
+
+    decoder.should.equal(DateTime.cast)
+    DECODERS[('repocket.attributes', 'DateTime')].should.equal(decoder)
+
+
+def test_datetime_to_score():
+    ('DateTime#to_score() should return the seconds since the epoch')
+
+    field = DateTime()
+    field.to_score(datetime(1970, 1, 1, 0, 1, 0, 500000)).should.equal(60.5)
+
+
+def test_numbers_to_score():
+    ('Integer, Float and Decimal#to_score() should return a float')
+
+    Integer().to_score(3).should.equal(3.0)
+    Float().to_score(1.5).should.equal(1.5)
+    Decimal().to_score('2.25').should.equal(2.25)
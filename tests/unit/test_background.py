@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import threading
+from mock import patch
+from repocket.background import configure_workers, get_pool, submit, iter_ahead
+from repocket.identity import get_context_identity_map, identity_map
+
+
+def test_submit_runs_in_worker_thread():
+    ('background.submit() should call the function in a worker thread')
+
+    # Given a function that returns the current thread
+    def current_thread(suffix):
+        return threading.current_thread(), suffix
+
+    # When I submit it
+    result = submit(current_thread, suffix='ok')
+
+    # Then it should run in another thread
+    thread, suffix = result.get(timeout=5)
+    thread.should_not.equal(threading.current_thread())
+    suffix.should.equal('ok')
+
+
+def test_iter_ahead_retrieves_the_next_batch():
+    ('background.iter_ahead() should retrieve the next batch while the current one is consumed')
+
+    # Given a generator of batches that records when they were produced
+    produced = []
+
+    def batches():
+        for batch in ([1, 2], [], [3]):
+            produced.append(batch)
+            yield batch
+
+    # When I consume the first item
+    items = iter_ahead(batches())
+    next(items).should.equal(1)
+
+    # Then the second batch should be requested as well
+    submit(lambda: None).get(timeout=5)
+    produced.should.have.length_of(2)
+
+    # And all the items should be yielded in order
+    list(items).should.equal([2, 3])
+
+
+def test_pool_is_recreated_after_fork():
+    ('background.get_pool() should create a new pool in a child process')
+
+    # Given the pool of the parent process
+    parent = get_pool()
+
+    # When the process id changes
+    try:
+        with patch('repocket.background.os.getpid', return_value=-1):
+            child = get_pool()
+
+            # Then the pool should be new
+            child.should_not.be(parent)
+
+            # And usable
+            submit(lambda: 'ok').get(timeout=5).should.equal('ok')
+    finally:
+        parent.close()
+        configure_workers()
+
+
+def test_submit_keeps_the_identity_map_context():
+    ('background.submit() should call the function within the identity_map() context of the caller')
+
+    # When I submit a function within an identity map context
+    with identity_map() as items:
+        result = submit(get_context_identity_map).get(timeout=5)
+
+    # Then it should use the same identity map
+    result.should.be(items)
+
+    # And outside of the context it should not use any
+    submit(get_context_identity_map).get(timeout=5).should.be.none
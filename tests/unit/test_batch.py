@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from array import array
+from mock import patch
+from repocket import attributes
+from repocket.model import ActiveRecord
+from repocket.batch import RecordBatch
+
+
+class Driver(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+
+
+class Team(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+    country = attributes.Unicode()
+
+    def __init__(self, *args, **kw):
+        super(Team, self).__init__(*args, **kw)
+        self.initialized = True
+
+
+class Lap(ActiveRecord):
+    id = attributes.AutoUUID()
+    number = attributes.Integer()
+    duration = attributes.Float()
+    notes = attributes.Unicode()
+    driver = attributes.Pointer(Driver)
+
+
+def make_laps(count):
+    driver = Driver(id='d9bd3e24-8bd7-4d09-9d2d-3fbd0c5c4e48', name='Ayrton')
+    return driver, [Lap(number=i, duration=60.0 + i, notes='lap {0}'.format(i), driver=driver) for i in range(count)]
+
+
+def test_record_batch_stores_columns():
+    ('RecordBatch should store the values of each attribute in a single column')
+
+    # Given 3 laps
+    driver, laps = make_laps(3)
+
+    # When I store them in a batch
+    batch = RecordBatch.from_items(Lap, laps)
+
+    # Then it should have one column per attribute
+    len(batch).should.equal(3)
+    sorted(batch.columns.keys()).should.equal(['driver', 'duration', 'id', 'notes', 'number'])
+
+    # And the numeric columns should be arrays
+    batch.column('number').should.equal(array(b'l', [0, 1, 2]))
+    batch.column('duration').should.equal(array(b'd', [60.0, 61.0, 62.0]))
+    batch.column('notes').should.equal(['lap 0', 'lap 1', 'lap 2'])
+
+    # And the pointers should be stored without being resolved
+    batch.get(1, 'driver').should.be(driver)
+
+    # And the rows can be iterated without instances
+    list(batch.iter_rows('number', 'notes')).should.equal([(0, 'lap 0'), (1, 'lap 1'), (2, 'lap 2')])
+
+
+def test_record_batch_falls_back_to_lists():
+    ('RecordBatch should turn an array column into a list when a value does not fit')
+
+    # Given a batch of laps
+    driver, laps = make_laps(2)
+    batch = RecordBatch.from_items(Lap, laps, names=['number'])
+
+    # When I append a lap whose number does not fit in the array
+    lap = Lap(number=2 ** 70)
+    batch.append(lap)
+
+    # Then the column should become a list
+    batch.column('number').should.equal([0, 1, 2 ** 70])
+
+    # And the primary key should always be stored
+    list(batch.columns.keys()).should.equal(['id', 'number'])
+
+
+def test_record_batch_builds_instances():
+    ('RecordBatch[index] should build an instance with the attributes missing from the batch deferred')
+
+    # Given a batch with the number of the laps
+    driver, laps = make_laps(3)
+    batch = RecordBatch.from_items(Lap, laps, names=['number'], alias='analytics')
+
+    # When I retrieve a row
+    lap = batch[-1]
+
+    # Then it should be an instance with the stored values
+    lap.should.be.a(Lap)
+    lap.id.should.equal(laps[2].id)
+    lap['number'].should.equal(2)
+    lap.get('number').should.equal(2)
+    lap.get_alias().should.equal('analytics')
+
+    # And the other attributes should be deferred
+    lap.get_deferred_fields().should.equal(frozenset(['duration', 'notes', 'driver']))
+    lap.get_dirty_fields().should.equal(set())
+
+    # And they are retrieved when accessed
+    with patch.object(Lap.objects, 'using') as using:
+        using.return_value.load_fields.return_value = {'notes': 'lap 2'}
+        lap.notes.should.equal('lap 2')
+        using.assert_called_once_with('analytics')
+
+    # And every instance shares the set of deferred fields
+    batch[0].get_deferred_fields().should.be(batch[1].get_deferred_fields())
+
+    # And a slice should return a batch
+    tail = batch[1:]
+    tail.should.be.a(RecordBatch)
+    [l.number for l in tail].should.equal([1, 2])
+
+    batch.__getitem__.when.called_with(3).should.throw(IndexError)
+
+
+def test_record_batch_validates_items():
+    ('RecordBatch should only accept valid attributes and instances of its model')
+
+    RecordBatch.when.called_with(Lap, ['speed']).should.throw(KeyError)
+
+    batch = RecordBatch(Lap)
+    batch.append.when.called_with(Driver()).should.throw(TypeError)
+
+
+def test_record_batch_calls_post_load():
+    ('RecordBatch should call __post_load__ on the instances it builds')
+
+    # Given a batch of drivers whose model declares __post_load__
+    driver = Driver(id='d9bd3e24-8bd7-4d09-9d2d-3fbd0c5c4e48', name='Ayrton')
+    batch = RecordBatch.from_items(Driver, [driver])
+
+    # When I build an instance from a row
+    with patch.object(Driver, '__post_load__') as post_load:
+        item = batch[0]
+
+    # Then the hook should have been called
+    post_load.assert_called_once_with()
+    item.name.should.equal('Ayrton')
+
+
+def test_record_batch_calls_the_init_of_the_model():
+    ('RecordBatch should build the instances through __init__ when the model defines its own')
+
+    # Given a batch with the names of teams whose model defines __init__
+    team = Team(id='5b0e2a4c-8f43-4f57-9d5e-8b1e7f1c2d3a', name='McLaren', country='UK')
+    batch = RecordBatch.from_items(Team, [team], ['name'])
+
+    # When I build an instance from a row
+    item = batch[0]
+
+    # Then __init__ should have been called
+    item.initialized.should.be.true
+    item.name.should.equal('McLaren')
+
+    # And the attributes that were not stored should be deferred
+    item.get_deferred_fields().should.equal({'country'})
+    item.__dict__.should_not.have.key('country')
+    item.is_persisted().should.be.true
+    item.get_dirty_fields().should.be.empty
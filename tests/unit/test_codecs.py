@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from uuid import UUID
+from decimal import Decimal as PythonsDecimal
+from datetime import datetime
+
+from repocket.attributes import AutoUUID
+from repocket.attributes import Unicode
+from repocket.attributes import Integer
+from repocket.attributes import Float
+from repocket.attributes import Decimal
+from repocket.attributes import JSON
+from repocket.attributes import DateTime
+from repocket.codecs import CompactCodec
+from repocket.codecs import EnvelopeCodec
+from repocket.codecs import decode_value
+from repocket.codecs import get_codec
+from repocket.errors import RepocketActiveRecordDefinitionError
+
+test_uuid = UUID('3112edba-4b5d-11e5-b02e-6c4008a70392')
+
+
+def test_compact_codec_stores_raw_values():
+    ('CompactCodec#encode() should store the raw value prefixed by the format version')
+
+    codec = CompactCodec()
+
+    codec.encode(Unicode(), 'cão').should.equal(b'\x01c\xc3\xa3o')
+    codec.encode(Integer(), 42).should.equal(b'\x0142')
+    codec.encode(AutoUUID(), test_uuid).should.equal(b'\x01' + test_uuid.bytes)
+    codec.encode(Unicode(), None).should.equal(b'\x02')
+
+
+def test_compact_codec_round_trip():
+    ('CompactCodec should decode the exact values that were encoded')
+
+    codec = CompactCodec()
+    values = [
+        (Unicode(), 'cão'),
+        (Integer(), 42),
+        (Float(), 0.1),
+        (Decimal(), PythonsDecimal('10.25')),
+        (JSON(), {'yay': ['this is json baby!']}),
+        (DateTime(), datetime(2015, 8, 25, 15, 57, 37)),
+        (AutoUUID(), test_uuid),
+        (Unicode(), None),
+    ]
+    for field, value in values:
+        codec.decode(field, codec.encode(field, value)).should.equal(value)
+
+
+def test_decode_value_detects_the_codec():
+    ('decode_value() should decode values stored by any codec')
+
+    field = Unicode()
+
+    decode_value(field, EnvelopeCodec().encode(field, 'foo')).should.equal('foo')
+    decode_value(field, CompactCodec().encode(field, 'foo')).should.equal('foo')
+
+
+def test_decode_value_without_field():
+    ('decode_value() should only decode compact values when the field is known')
+
+    decode_value(None, EnvelopeCodec().encode(Unicode(), 'foo')).should.equal('foo')
+    decode_value(None, CompactCodec().encode(Unicode(), 'foo')).should.be.none
+
+
+def test_get_codec_invalid_name():
+    ('get_codec() should raise RepocketActiveRecordDefinitionError for unknown codecs')
+
+    get_codec.when.called_with('xml').should.throw(
+        RepocketActiveRecordDefinitionError,
+        "invalid codec u'xml', options are compact, envelope")
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import zlib
+from repocket import attributes
+from repocket.compression import (
+    COMPRESSED, FRAME_HEADER, STREAM_MAGIC,
+    compress_value, decompress_value, pack_stream, unpack_stream,
+)
+from repocket.errors import RepocketActiveRecordDefinitionError
+
+
+def test_compress_value_above_threshold():
+    ('compression.compress_value() should prefix the compressed values with a header')
+
+    raw = b'{"value": "' + b'a' * 100 + b'"}'
+    compressed = compress_value('zlib', 50, raw)
+    compressed.should.equal(COMPRESSED + b'z' + zlib.compress(raw))
+    decompress_value(compressed).should.equal(raw)
+
+
+def test_compress_value_keeps_small_and_incompressible_values():
+    ('compression.compress_value() should not touch values below the threshold or that would grow')
+
+    compress_value('zlib', 50, b'a' * 49).should.equal(b'a' * 49)
+    compress_value('bz2', 1, b'ab').should.equal(b'ab')
+    compress_value(None, 1, b'a' * 100).should.equal(b'a' * 100)
+    decompress_value(b'\x01raw').should.equal(b'\x01raw')
+
+
+def test_pack_stream_in_frames():
+    ('compression.pack_stream() should store the contents in frames that can be unpacked')
+
+    data = b'line\n' * 1000
+    packed = pack_stream('zlib', 4096, data)
+    packed[:len(STREAM_MAGIC)].should.equal(STREAM_MAGIC)
+    len(packed).should.be.lower_than(len(data) / 10)
+    unpack_stream(packed).should.equal(data)
+
+    # And small contents should be stored without compression
+    pack_stream('zlib', 4096, b'small').should.equal(STREAM_MAGIC + FRAME_HEADER.pack(b'-', 5, 5) + b'small')
+
+
+def test_unpack_stream_without_frames():
+    ('compression.unpack_stream() should return the contents stored without frames untouched')
+
+    unpack_stream(b'plain').should.equal(b'plain')
+    unpack_stream(pack_stream('zlib', 1, b'a' * 100) + b'appended raw').should.equal(b'a' * 100 + b'appended raw')
+
+
+def test_unpack_stream_starting_with_the_magic_bytes():
+    ('compression.unpack_stream() should only read frames when the magic bytes are followed by a valid frame header')
+
+    unpack_stream(STREAM_MAGIC + b'not a frame').should.equal(STREAM_MAGIC + b'not a frame')
+    unpack_stream(STREAM_MAGIC + FRAME_HEADER.pack(b'z', 100, 5) + b'short').should.equal(
+        STREAM_MAGIC + FRAME_HEADER.pack(b'z', 100, 5) + b'short')
+    unpack_stream(STREAM_MAGIC + FRAME_HEADER.pack(b'-', 5, 9) + b'sizes').should.equal(
+        STREAM_MAGIC + FRAME_HEADER.pack(b'-', 5, 9) + b'sizes')
+
+
+def test_invalid_compression():
+    ('Attribute(compress=...) should only accept the known algorithms')
+
+    attributes.JSON.when.called_with(compress='lzma').should.throw(
+        RepocketActiveRecordDefinitionError,
+        "invalid compression u'lzma', options are bz2, zlib")
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from repocket.identity import IdentityMap
+from repocket.identity import identity_map
+from repocket.identity import get_context_identity_map
+
+
+def test_identity_map_counts_hits_and_misses():
+    ('IdentityMap#get() should count the hits and misses')
+
+    # Given an identity map with one item
+    items = IdentityMap(max_size=10)
+    items.put('key1', 'item1')
+
+    # When I retrieve an existing and a missing key
+    items.get('key1').should.equal('item1')
+    items.get('key2').should.be.none
+
+    # Then the stats should reflect it
+    items.stats().should.equal({
+        'hits': 1,
+        'misses': 1,
+        'size': 1,
+        'max_size': 10,
+    })
+
+
+def test_identity_map_evicts_least_recently_used():
+    ('IdentityMap#put() should evict the least recently used items when full')
+
+    # Given a full identity map
+    items = IdentityMap(max_size=2)
+    items.put('key1', 'item1')
+    items.put('key2', 'item2')
+
+    # When I use the first key and add a third one
+    items.get('key1')
+    items.put('key3', 'item3')
+
+    # Then the second key should be evicted
+    items.should.have.length_of(2)
+    ('key1' in items).should.be.true
+    ('key3' in items).should.be.true
+    ('key2' in items).should.be.false
+
+
+def test_identity_map_context():
+    ('identity_map() should enable an identity map within the context')
+
+    get_context_identity_map().should.be.none
+
+    with identity_map(max_size=10) as outer:
+        get_context_identity_map().should.be(outer)
+
+        with identity_map() as inner:
+            get_context_identity_map().should.be(inner)
+
+        get_context_identity_map().should.be(outer)
+
+    get_context_identity_map().should.be.none
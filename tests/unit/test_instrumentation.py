@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import sys
+import threading
+from mock import patch
+from repocket import attributes, instrumentation
+from repocket.model import ActiveRecord
+from repocket.instrumentation import Histogram, InstrumentedConnectionMixin, Operation, Stats
+
+
+class Wand(ActiveRecord):
+    id = attributes.AutoUUID()
+    wood = attributes.Unicode()
+
+
+class FakeConnection(object):
+    def send_command(self, *args):
+        pass
+
+    def pack_commands(self, commands):
+        return commands
+
+
+class CountedConnection(InstrumentedConnectionMixin, FakeConnection):
+    pass
+
+
+def test_histogram_counts_values_per_bucket():
+    ('Histogram should count the values per bucket, cumulatively, like prometheus')
+
+    # Given a histogram with 2 buckets
+    histogram = Histogram([1, 10])
+
+    # When I observe 4 values
+    for value in [0.5, 1, 7, 50]:
+        histogram.observe(value)
+
+    # Then it should count them per bucket
+    histogram.to_dict().should.equal({
+        'buckets': [(1, 2), (10, 3), ('+Inf', 4)],
+        'count': 4,
+        'sum': 58.5,
+    })
+
+
+def test_stats_aggregates_operations_per_model():
+    ('Stats should keep counters and histograms per model and operation')
+
+    # Given 2 save operations
+    stats = Stats(duration_buckets=[0.01], pipeline_size_buckets=[5])
+    first, second = Operation('save', Wand), Operation('save', Wand)
+    first.duration, first.commands, first.round_trips, first.pipelines = 0.001, 3, 1, [3]
+    first.bytes_sent, first.bytes_received = 100, 20
+    second.duration, second.commands, second.round_trips, second.pipelines = 0.5, 8, 1, [8]
+    second.error = ValueError('boom')
+
+    # When the hook receives them
+    stats(first)
+    stats(second)
+
+    # Then the snapshot should have the metrics of the model
+    snapshot = stats.snapshot()
+    snapshot.keys().should.equal([Wand.__compound_name__])
+    save = snapshot[Wand.__compound_name__]['save']
+    save['counters'].should.equal({
+        'calls': 2,
+        'errors': 1,
+        'commands': 11,
+        'round_trips': 2,
+        'bytes_sent': 100,
+        'bytes_received': 20,
+        'items': 0,
+    })
+    save['duration']['buckets'].should.equal([(0.01, 1), ('+Inf', 2)])
+    save['pipeline_size']['buckets'].should.equal([(5, 1), ('+Inf', 2)])
+
+    # And reset() should discard them
+    stats.reset()
+    stats.snapshot().should.be.empty
+
+
+def test_instrumented_calls_skip_measuring_without_hooks():
+    ('instrumented calls should not create operations when no hook is registered')
+
+    # Given that no hook is registered
+    instrumentation.hooks.should.be.empty
+
+    # When I serialize an instance
+    with patch.object(instrumentation, 'Operation') as Operation:
+        Wand.__encoder__(Wand(wood='holly'))
+
+    # Then no operation should be created
+    Operation.called.should.be.false
+
+
+def test_instrumented_calls_notify_the_hooks():
+    ('instrumented calls should report an operation to every hook, even when a hook fails')
+
+    # Given a hook that fails and a hook that collects the operations
+    operations = []
+
+    def broken(operation):
+        raise RuntimeError('boom')
+
+    with instrumentation.collect_stats(), instrumentation.collect_stats(broken), \
+            instrumentation.collect_stats(operations.append):
+        # When I serialize an instance
+        Wand.__encoder__(Wand(wood='holly'))
+
+    # Then the operation should be reported
+    operations.should.have.length_of(1)
+    operations[0].name.should.equal('serialize')
+    operations[0].model.should.be(Wand)
+    operations[0].duration.should.be.greater_than(0)
+
+    # And the hooks should be unregistered afterwards
+    instrumentation.hooks.should.be.empty
+
+
+def test_operations_are_accounted_from_many_threads():
+    ('InstrumentedConnectionMixin should account the commands of every thread running the same operation')
+
+    # Given an operation running in 8 threads
+    def send_commands():
+        connection = CountedConnection()
+        for i in range(500):
+            connection.send_command('GET', 'key')
+            connection.pack_commands([('GET', 'a'), ('GET', 'b')])
+
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        with patch.object(instrumentation, 'hooks', [lambda operation: None]):
+            with instrumentation.measure('get', Wand) as operation:
+                threads = [threading.Thread(target=instrumentation.propagate(send_commands)) for i in range(8)]
+                for thread in threads:
+                    thread.start()
+
+                for thread in threads:
+                    thread.join()
+    finally:
+        sys.setcheckinterval(interval)
+
+    # Then every command should have been counted
+    operation.commands.should.equal(8 * 500 * 3)
+    operation.pipelines.should.have.length_of(8 * 500)
@@ -3,7 +3,9 @@
 from __future__ import unicode_literals
 import uuid
 from repocket.model import ActiveRecord
-from repocket.attributes import ByteStream
+from datetime import datetime
+from repocket.attributes import ByteStream, DateTime, Integer, Unicode
+from repocket.errors import RepocketActiveRecordDefinitionError
 
 
 class UnitModelOne(ActiveRecord):
@@ -53,3 +55,74 @@ def test_getitem():
     item1 = UnitModelOne(id='059f3270-9e73-4d53-9970-443f83e412a0', contents=b'123')
     item1['id'].should.equal(uuid.UUID('059f3270-9e73-4d53-9970-443f83e412a0'))
     item1['contents'].should.equal('123')
+
+
+class UnitIndexedModel(ActiveRecord):
+    email = Unicode(index=True)
+    name = Unicode()
+    score = Integer(index='range')
+    created_at = DateTime(index='range')
+
+
+def test_active_record_indexes():
+    ('ActiveRecord.__indexes__ should contain only the attributes declared with index=True')
+
+    UnitIndexedModel.__indexes__.keys().should.equal(['email'])
+
+
+def test_active_record_calculate_index_key():
+    ('ActiveRecord._calculate_index_key should return a key based on the field name and value')
+
+    result = UnitIndexedModel._calculate_index_key('email', 'foo@bar.com')
+    result.should.equal('repocket-index:tests.unit.test_model:UnitIndexedModel:eq:email:foo@bar.com')
+
+
+def test_active_record_matches():
+    ('ActiveRecord#matches() should return True only when all the lookups match')
+
+    item = UnitIndexedModel(email='foo@bar.com', name='Foo')
+
+    item.matches({'email': 'foo@bar.com', 'name': 'Foo'}).should.be.true
+    item.matches({'email': 'foo@bar.com', 'name': 'Bar'}).should.be.false
+    item.matches({'name': 'Bar', 'email': 'foo@bar.com'}).should.be.false
+    item.matches({'email__in': ['bar@foo.com', 'foo@bar.com']}).should.be.true
+
+
+def test_bytestream_cannot_be_indexed():
+    ('ActiveRecordRegistry should not allow indexing a ByteStream')
+
+    def declare():
+        class UnitInvalidIndex(ActiveRecord):
+            contents = ByteStream(index=True)
+
+    declare.when.called.should.have.raised(RepocketActiveRecordDefinitionError)
+
+
+def test_active_record_range_indexes():
+    ('ActiveRecord.__range_indexes__ should contain only the attributes declared with index="range"')
+
+    sorted(UnitIndexedModel.__range_indexes__.keys()).should.equal(['created_at', 'score'])
+    UnitIndexedModel._calculate_range_index_key('score').should.equal(
+        'repocket-index:tests.unit.test_model:UnitIndexedModel:range:score')
+
+
+def test_active_record_matches_range_lookups():
+    ('ActiveRecord#matches() should support the range lookups')
+
+    item = UnitIndexedModel(score=100, created_at=datetime(2015, 2, 25))
+
+    item.matches({'score__gt': 99, 'score__lte': 100}).should.be.true
+    item.matches({'score__gt': 100}).should.be.false
+    item.matches({'score__lt': 100}).should.be.false
+    item.matches({'created_at__gte': datetime(2015, 2, 25)}).should.be.true
+    item.matches({'created_at__lt': datetime(2015, 2, 25)}).should.be.false
+
+
+def test_unicode_cannot_have_range_index():
+    ('ActiveRecordRegistry should only allow range indexes for numbers and dates')
+
+    def declare():
+        class UnitInvalidRangeIndex(ActiveRecord):
+            name = Unicode(index='range')
+
+    declare.when.called.should.have.raised(RepocketActiveRecordDefinitionError)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from mock import patch
+from repocket.readcache import ReadCache
+
+
+def test_read_cache_get_and_put():
+    ('ReadCache should keep the raw items and count hits and misses')
+
+    cache = ReadCache()
+    cache.put('key1', ({'email': 'foo'}, {}), cache.get_token())
+
+    cache.get('key1').should.equal(({'email': 'foo'}, {}))
+    cache.get('key2').should.be.none
+    cache.stats().should.equal({
+        'hits': 1,
+        'misses': 1,
+        'size': 1,
+        'bytes': 12,
+        'invalidations': 0,
+    })
+
+
+def test_read_cache_ignores_data_retrieved_before_an_invalidation():
+    ('ReadCache#put() should not store data when any key was invalidated after the token was taken')
+
+    cache = ReadCache()
+    token = cache.get_token()
+    cache.invalidate('key1')
+
+    cache.put('key1', ({'email': 'foo'}, {}), token)
+
+    cache.get('key1').should.be.none
+
+
+def test_read_cache_max_bytes():
+    ('ReadCache#put() should evict the least recently used items above max_bytes')
+
+    # Given a cache that fits 2 items
+    cache = ReadCache(max_bytes=24)
+    cache.put('key1', ({'email': 'foo'}, {}), cache.get_token())
+    cache.put('key2', ({'email': 'bar'}, {}), cache.get_token())
+
+    # When I use the first item and add a third one
+    cache.get('key1')
+    cache.put('key3', ({'email': 'baz'}, {}), cache.get_token())
+
+    # Then the second item should be evicted
+    ('key1' in cache).should.be.true
+    ('key2' in cache).should.be.false
+    ('key3' in cache).should.be.true
+    cache.stats()['bytes'].should.equal(24)
+
+
+@patch('repocket.readcache.time')
+def test_read_cache_ttl(time):
+    ('ReadCache#get() should not return expired items')
+
+    cache = ReadCache(ttl=10)
+    time.time.return_value = 100
+    cache.put('key1', ({'email': 'foo'}, {}), cache.get_token())
+
+    time.time.return_value = 109
+    cache.get('key1').should_not.be.none
+
+    time.time.return_value = 111
+    cache.get('key1').should.be.none
+    cache.stats()['bytes'].should.equal(0)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from uuid import UUID
+from repocket import attributes
+from repocket.model import ActiveRecord
+from repocket.scripting import compile_lookups
+
+
+class Broom(ActiveRecord):
+    id = attributes.AutoUUID()
+    model = attributes.Unicode()
+    speed = attributes.Float()
+    specs = attributes.JSON()
+    manual = attributes.ByteStream()
+
+
+def test_compile_lookups_bytes():
+    ('scripting.compile_lookups() should pass the value stored by each codec')
+
+    uuid = UUID('2e6a8c5a-7c3b-11e5-9ab2-6c4008a70392')
+    compile_lookups(Broom, {'id': uuid, 'model__in': ['Nimbus 2000']}).should.equal([
+        'id', 'bytes', 'exact', 1, b'2e6a8c5a-7c3b-11e5-9ab2-6c4008a70392', 1, uuid.bytes,
+        'model', 'bytes', 'in', 1, b'Nimbus 2000', 1, b'Nimbus 2000',
+    ])
+
+
+def test_compile_lookups_numbers():
+    ('scripting.compile_lookups() should pass the numbers as scores')
+
+    compile_lookups(Broom, {'speed__gte': 150}).should.equal([
+        'speed', 'number', 'gte', 1, '150.0', 1, '150.0',
+    ])
+
+
+def test_compile_lookups_skips_what_lua_cannot_compare():
+    ('scripting.compile_lookups() should leave JSON, ByteStream, null and string range lookups to python')
+
+    compile_lookups(Broom, {
+        'specs': {'brakes': True},
+        'manual': b'fly',
+        'speed': None,
+        'model__gt': 'A',
+    }).should.equal([])
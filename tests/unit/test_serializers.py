@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from datetime import datetime
+from decimal import Decimal
+from repocket import attributes
+from repocket.model import ActiveRecord
+from repocket.attributes import Reference
+from repocket.compression import pack_stream
+
+
+class Author(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+
+
+class EnvelopePost(ActiveRecord):
+    id = attributes.AutoUUID()
+    title = attributes.Unicode()
+    slug = attributes.Bytes()
+    views = attributes.Integer()
+    rating = attributes.Float()
+    price = attributes.Decimal()
+    published_at = attributes.DateTime()
+    metadata = attributes.JSON()
+    author = attributes.Pointer(Author)
+    summary = attributes.Unicode(compress='zlib', threshold=64)
+    body = attributes.ByteStream(compress='zlib', threshold=64)
+    notes = attributes.ByteStream()
+
+
+class CompactPost(ActiveRecord):
+    __codec__ = 'compact'
+
+    id = attributes.AutoUUID()
+    title = attributes.Unicode()
+    slug = attributes.Bytes()
+    views = attributes.Integer()
+    rating = attributes.Float()
+    price = attributes.Decimal()
+    published_at = attributes.DateTime()
+    metadata = attributes.JSON()
+    author = attributes.Pointer(Author)
+    summary = attributes.Unicode(compress='zlib', threshold=64)
+    body = attributes.ByteStream(compress='zlib', threshold=64)
+    notes = attributes.ByteStream()
+
+
+class PreparedAuthor(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+
+    def __post_load__(self):
+        self.display_name = self.name.upper()
+
+
+class LoadedAuthor(ActiveRecord):
+    id = attributes.AutoUUID()
+    name = attributes.Unicode()
+
+    def __init__(self, *args, **kw):
+        super(LoadedAuthor, self).__init__(*args, **kw)
+        self.initialized = True
+
+    def __post_load__(self):
+        self.display_name = self.name.upper()
+
+
+AUTHOR = Author(id='b9c9bf17-ef60-45bf-8217-4daabc6bc483', name='Lincoln')
+
+
+def create_post(Model, **kw):
+    data = dict(
+        id='059f3270-9e73-4d53-9970-443f83e412a0',
+        title='Hello',
+        slug=b'hello',
+        views=42,
+        rating=4.5,
+        price=Decimal('9.99'),
+        published_at=datetime(2015, 8, 25, 15, 57, 37),
+        metadata={'tags': ['redis']},
+        author=AUTHOR,
+        summary='a long summary ' * 10,
+        body=b'the body',
+        notes=b'some notes',
+    )
+    data.update(kw)
+    return Model(**data)
+
+
+def hydrate_with_reference(Model, data):
+    instance = Model(**Model.objects.deserialize_raw_item(data['hash']))
+    for name, value in data['strings'].items():
+        instance.set(name, value)
+
+    instance._mark_as_persisted()
+    return instance
+
+
+def normalize(instance):
+    values = dict(instance.__dict__)
+    for name, value in values.items():
+        if isinstance(value, Reference):
+            values[name] = value._calculate_hash_key()
+
+    return values
+
+
+def assert_same_item(generated, reference):
+    normalize(generated).should.equal(normalize(reference))
+
+
+def test_encoder_matches_to_dict():
+    ('Model.__encoder__() should return the same data as ActiveRecord#to_dict()')
+
+    for Model in (EnvelopePost, CompactPost):
+        post = create_post(Model)
+        Model.__encoder__(post).should.equal(post.to_dict())
+        Model.__encoder__(post, {'title', 'body'}).should.equal(post.to_dict(fields={'title', 'body'}))
+
+
+def test_encoder_handles_failures_like_to_dict():
+    ('Model.__encoder__() should store the empty value of the fields that cannot be serialized')
+
+    post = create_post(EnvelopePost)
+    post.views = 'not a number'
+    EnvelopePost.__encoder__(post)['hash']['views'].should.equal(0)
+    EnvelopePost.__encoder__(post).should.equal(post.to_dict())
+
+
+def test_decoder_matches_init():
+    ('Model.__decoder__() should build the same instance as the reference hydration')
+
+    for Model in (EnvelopePost, CompactPost):
+        data = create_post(Model).to_dict()
+        strings = dict([(k, pack_stream(Model.__fields__[k].compress, 64, v)) for k, v in data['strings'].items()])
+        post = Model.__decoder__(data['hash'], strings)
+
+        assert_same_item(post, hydrate_with_reference(Model, data))
+        post._get_reference('author').should.be.a(Reference)
+        post.is_persisted().should.be.true
+        post.get_dirty_fields().should.be.empty
+
+
+def test_decoder_handles_empty_and_other_types():
+    ('Model.__decoder__() should use the empty values and cast values stored by other attribute types')
+
+    # Given a post with empty values
+    data = create_post(EnvelopePost, title='', views=0, published_at=None, author=None).to_dict()
+
+    # And a value stored by another attribute type
+    data['hash']['rating'] = attributes.Unicode().to_json('3.5')
+
+    post = EnvelopePost.__decoder__(data['hash'], data['strings'])
+    assert_same_item(post, hydrate_with_reference(EnvelopePost, data))
+    post.rating.should.equal(3.5)
+
+
+def test_decoder_defers_fields():
+    ('Model.__decoder__() should leave the deferred fields out of the instance')
+
+    data = create_post(EnvelopePost).to_dict()
+    post = EnvelopePost.__decoder__(data['hash'], {}, frozenset(['title', 'notes']), 'replica')
+
+    post.__dict__.should_not.have.key('title')
+    post.__dict__.should_not.have.key('notes')
+    post.get_deferred_fields().should.equal({'title', 'notes'})
+    post.get_alias().should.equal('replica')
+
+
+def test_decoder_calls_post_load():
+    ('Model.__decoder__() should call __post_load__ without __init__ when the model does not define one')
+
+    # Given an author stored in redis
+    data = PreparedAuthor(id='b9c9bf17-ef60-45bf-8217-4daabc6bc483', name='Lincoln').to_dict()
+
+    # When it is decoded
+    author = PreparedAuthor.__decoder__(data['hash'], data['strings'])
+
+    # Then __post_load__ should have been called with the values set
+    author.display_name.should.equal('LINCOLN')
+    author.get_dirty_fields().should.be.empty
+
+
+def test_decoder_calls_the_init_of_the_model():
+    ('Model.__decoder__() should build the instance through __init__ when the model defines its own')
+
+    # Given an author stored in redis
+    data = LoadedAuthor(id='b9c9bf17-ef60-45bf-8217-4daabc6bc483', name='Lincoln').to_dict()
+
+    # When it is decoded
+    author = LoadedAuthor.__decoder__(data['hash'], data['strings'], alias='default')
+
+    # Then __init__ should have been called
+    author.initialized.should.be.true
+    author.name.should.equal('Lincoln')
+
+    # And __post_load__ too, with the values set
+    author.display_name.should.equal('LINCOLN')
+
+    # And the instance should be persisted
+    author.is_persisted().should.be.true
+    author.get_alias().should.equal('default')
+    author.get_dirty_fields().should.be.empty
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from repocket.sharding import HashRing, get_routing_key
+
+
+def test_get_routing_key_with_hash_tag():
+    ('sharding.get_routing_key() should return the content of the hash tag')
+
+    get_routing_key(b'repocket:app:User:{123}:field:bio').should.equal(b'123')
+    get_routing_key(b'repocket:app:User:123').should.equal(b'repocket:app:User:123')
+    get_routing_key(b'repocket:app:User:{}:123').should.equal(b'repocket:app:User:{}:123')
+
+
+def test_hash_ring_routes_keys_to_every_node():
+    ('HashRing#get_node() should spread the keys across all the nodes')
+
+    # Given a ring with 3 nodes
+    ring = HashRing(['a', 'b', 'c'])
+
+    # When I route 300 keys
+    nodes = [ring.get_node(b'repocket:app:User:{0}'.format(i)) for i in range(300)]
+
+    # Then every node should get some of them
+    set(nodes).should.equal({'a', 'b', 'c'})
+
+    # And the same key should always go to the same node
+    ring.get_node(b'repocket:app:User:1').should.equal(nodes[1])
+
+
+def test_hash_ring_honours_hash_tags():
+    ('HashRing#get_node() should route keys with the same hash tag to the same node')
+
+    ring = HashRing(['a', 'b', 'c'])
+    nodes = set([ring.get_node(b'{user1}:' + bytes(i)) for i in range(50)])
+    nodes.should.have.length_of(1)
+
+
+def test_hash_ring_adding_a_node_moves_only_some_keys():
+    ('HashRing should only move the keys that belong to the new node')
+
+    # Given the nodes of 1000 keys in a ring of 3 nodes
+    keys = [b'repocket:app:User:{0}'.format(i) for i in range(1000)]
+    before = HashRing(['a', 'b', 'c'])
+    after = HashRing(['a', 'b', 'c', 'd'])
+
+    # When a node is added
+    moved = [k for k in keys if before.get_node(k) != after.get_node(k)]
+
+    # Then every moved key should go to the new node
+    set([after.get_node(k) for k in moved]).should.equal({'d'})
+    len(moved).should.be.lower_than(500)
+
+
+def test_hash_ring_without_nodes():
+    ('HashRing should not accept an empty list of nodes')
+
+    HashRing.when.called_with([]).should.throw(ValueError)
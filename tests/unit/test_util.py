@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from repocket.util import parse_lookup
+
+
+def test_parse_lookup_exact():
+    ('parse_lookup() should default to the exact operator')
+
+    parse_lookup('email').should.equal(('email', 'exact'))
+
+
+def test_parse_lookup_in():
+    ('parse_lookup() should split the known operators from the field name')
+
+    parse_lookup('email__in').should.equal(('email', 'in'))
+
+
+def test_parse_lookup_range():
+    ('parse_lookup() should split the range operators from the field name')
+
+    parse_lookup('created_at__gte').should.equal(('created_at', 'gte'))
+    parse_lookup('score__lt').should.equal(('score', 'lt'))
+
+
+def test_parse_lookup_unknown_operator():
+    ('parse_lookup() should keep unknown suffixes as part of the field name')
+
+    parse_lookup('github__metadata').should.equal(('github__metadata', 'exact'))